@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import User, Muestra, Espectrograma, Anotacion, Clasificacion
+from .models import User, Muestra, Espectrograma, Anotacion, Clasificacion, CaracteristicasEvento, TrabajoProcesamiento
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 
 # Register your models here.
@@ -22,3 +22,5 @@ admin.site.register(Muestra)
 admin.site.register(Espectrograma)
 admin.site.register(Anotacion)
 admin.site.register(Clasificacion)
+admin.site.register(CaracteristicasEvento)
+admin.site.register(TrabajoProcesamiento)
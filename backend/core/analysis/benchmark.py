@@ -0,0 +1,180 @@
+import os
+import platform
+import statistics
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+import scipy
+
+from .stockwell import (
+    MST_ALPHA, MST_FS, MST_P_ORDER, modified_stockwell_transform_loop, mst_processing,
+    mst_processing_batch, normalize_signals, window_bank_cache,
+)
+from .synthetic import EVENT_TYPES, generate_event_set
+from ..spectrogram_format import ENCODINGS, decode_spectrogram, encode_spectrogram
+
+
+def _mst_variants():
+    """Variantes de la MST a medir: nombre -> función(señal) que retorna la matriz."""
+    cpu_count = os.cpu_count() or 1
+    return {
+        'double': lambda s: mst_processing(s, precision='double'),
+        'single': lambda s: mst_processing(s, precision='single'),
+        'band_0_1khz_dec8': lambda s: mst_processing(s, f_max=1000, decimation=8, precision='single'),
+        'chunked_64mb': lambda s: mst_processing(s, max_memory=64 * 1024 ** 2, precision='single'),
+        f'threads_{cpu_count}': lambda s: mst_processing(s, workers=cpu_count, precision='single'),
+    }
+
+
+def _thread_counts():
+    """1, 2, 4, ... hasta el número de núcleos (incluido)."""
+    cpu_count = os.cpu_count() or 1
+    counts = [1]
+    while counts[-1] * 2 < cpu_count:
+        counts.append(counts[-1] * 2)
+    return counts + [cpu_count] if cpu_count > 1 else counts
+
+
+def _scaling_variants():
+    """
+    Variantes de escalamiento con el número de hilos: nombre -> (hilos, función(señal)).
+    - 'hilos_por_bloque_<n>': un hilo por bloque de filas (producto e ifft en paralelo).
+    - 'fft_workers_<n>': un solo bloque (presupuesto sin límite práctico) y los
+      hilos como `workers=` de scipy.fft, que solo paraleliza las ifft.
+    """
+    variants = {}
+    for n in _thread_counts():
+        variants[f'hilos_por_bloque_{n}'] = (n, lambda s, n=n: mst_processing(s, workers=n, precision='single'))
+        variants[f'fft_workers_{n}'] = (n, lambda s, n=n: mst_processing(s, workers=n, max_memory=2 ** 40,
+                                                                         precision='single'))
+    return variants
+
+
+# Submatriz de la referencia comparable con cada variante (las reducidas solo cubren una banda)
+_REFERENCE_VIEW = {
+    'band_0_1khz_dec8': lambda ref, out: ref[:out.shape[0], ::8],
+}
+
+
+def _measure(function, repeats):
+    """Ejecuta `function` `repeats` veces. Retorna (tiempos en s, pico de memoria en bytes, último resultado)."""
+    times = []
+    peak = 0
+    result = None
+    for _ in range(repeats):
+        result = None  # Liberar el resultado anterior antes de medir
+        tracemalloc.start()
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return times, peak, result
+
+
+def _record(event, variant, times, peak, output_bytes, max_rel_error=None, **extra):
+    return {
+        'evento': event,
+        'variante': variant,
+        'tiempo_min_s': min(times),
+        'tiempo_mediana_s': statistics.median(times),
+        'repeticiones': len(times),
+        'pico_memoria_mb': peak / 1024 ** 2,
+        'tamano_salida_bytes': int(output_bytes),
+        'error_relativo_max': max_rel_error,
+        **extra,
+    }
+
+
+def _max_rel_error(result, reference):
+    if np.iscomplexobj(reference) and not np.iscomplexobj(result):
+        reference = np.abs(reference)  # Codificaciones de solo magnitud
+    scale = np.max(np.abs(reference))
+    return float(np.max(np.abs(result - reference)) / scale) if scale > 0 else 0.0
+
+
+def run_benchmark_suite(event_types=EVENT_TYPES, repeats=3, include_loop=False, include_batch=True,
+                        include_serialization=True, include_scaling=False, progress=print):
+    """
+    Ejecuta la suite de benchmarks del análisis de señales sobre eventos sintéticos
+    (60 Hz, 30 720 Hz, 5 120 muestras). Por cada evento y variante registra el
+    tiempo de pared, el pico de memoria (tracemalloc) y el tamaño de la salida,
+    además del error relativo frente a la MST de referencia en doble precisión.
+    Con `include_scaling` mide además, sobre el primer evento, cómo escala la
+    MST con el número de hilos (ver `_scaling_variants`), con la aceleración
+    respecto a un hilo.
+    Retorna un diccionario serializable a JSON con metadatos del entorno y resultados.
+    """
+    events = generate_event_set(event_types)
+    results = []
+
+    # El banco de ventanas se construye una vez por proceso (o se lee de disco): se mide aparte
+    window_bank_cache.clear()
+    for precision, dtype in (('double', np.float64), ('single', np.float32)):
+        times, peak, bank = _measure(
+            lambda: window_bank_cache.get(len(next(iter(events.values()))), MST_FS, p=MST_P_ORDER,
+                                          alpha=MST_ALPHA, dtype=dtype), 1)
+        results.append(_record('-', f'banco_ventanas_{precision}', times, peak, bank.nbytes))
+
+    variants = _mst_variants()
+    for event, signal in events.items():
+        progress(f"Evento '{event}'...")
+        reference = mst_processing(signal, precision='double')
+
+        if include_loop:
+            normalized = normalize_signals(signal)[0]
+            times, peak, (mst, _, _) = _measure(
+                lambda: modified_stockwell_transform_loop(normalized, MST_FS, p=MST_P_ORDER, alpha=MST_ALPHA), repeats)
+            results.append(_record(event, 'bucle', times, peak, mst.nbytes, _max_rel_error(mst, reference)))
+
+        for name, function in variants.items():
+            times, peak, mst = _measure(lambda: function(signal), repeats)
+            expected = _REFERENCE_VIEW.get(name, lambda ref, out: ref)(reference, mst)
+            results.append(_record(event, name, times, peak, mst.nbytes, _max_rel_error(mst, expected)))
+
+        if include_serialization:
+            single = mst_processing(signal, precision='single')
+            for encoding in ENCODINGS:
+                times, peak, (blob, header) = _measure(lambda: encode_spectrogram(single, encoding=encoding), repeats)
+                decoded = decode_spectrogram(blob, header)
+                results.append(_record(event, f'serializacion_{encoding}', times, peak, len(blob),
+                                       _max_rel_error(decoded, single), codec=header['codec']))
+
+    if include_batch:
+        progress("Lote con todos los eventos...")
+        stack = np.stack(list(events.values()))
+        times, peak, mst = _measure(lambda: mst_processing_batch(stack, max_memory=256 * 1024 ** 2,
+                                                                     precision='single'), repeats)
+        error = max(_max_rel_error(mst[i], mst_processing(signal, precision='single'))
+                    for i, signal in enumerate(stack))
+        results.append(_record(f'lote_{len(stack)}', 'batch_single_256mb', times, peak, mst.nbytes, error,
+                               tiempo_por_evento_s=min(times) / len(stack)))
+
+    if include_scaling:
+        event, signal = next(iter(events.items()))
+        progress(f"Escalamiento con el número de hilos (evento '{event}')...")
+        reference = mst_processing(signal, precision='single')
+        base = {}
+        for name, (threads, function) in _scaling_variants().items():
+            times, peak, mst = _measure(lambda: function(signal), repeats)
+            modo = name.rsplit('_', 1)[0]
+            base.setdefault(modo, min(times))
+            results.append(_record(event, name, times, peak, mst.nbytes, _max_rel_error(mst, reference),
+                                   hilos=threads, aceleracion=base[modo] / min(times)))
+
+    return {
+        'metadatos': {
+            'fecha': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'scipy': scipy.__version__,
+            'plataforma': platform.platform(),
+            'cpus': os.cpu_count(),
+            'fs_hz': MST_FS,
+            'num_muestras': len(next(iter(events.values()))),
+            'repeticiones': repeats,
+        },
+        'resultados': results,
+    }
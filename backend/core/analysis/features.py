@@ -0,0 +1,103 @@
+import numpy as np
+
+# Versión del vector de características. Cambiarla si se modifica su contenido u orden.
+FEATURE_VERSION = 1
+
+# Bandas de energía (Hz): subarmónicos/fundamental, armónicos bajos, armónicos altos, alta frecuencia
+ENERGY_BANDS_HZ = ((0, 120), (120, 1000), (1000, 5000), (5000, None))
+MAX_HARMONIC = 40
+
+
+def feature_names(num_cycles):
+    """Nombres de cada posición del vector de características, en orden."""
+    names = [f"energia_banda_{lo}_{hi if hi is not None else 'nyquist'}_hz" for lo, hi in ENERGY_BANDS_HZ]
+    names.append('energia_total')
+    names += [f'rms_ciclo_{i}' for i in range(num_cycles)]
+    names += [f'fundamental_ciclo_{i}' for i in range(num_cycles)]
+    names += ['thd', 'tiempo_desviacion_max_s', 'desviacion_max_relativa']
+    return names
+
+
+def _row_energies(mst, block_rows=256):
+    """Energía (suma de |MST|^2) de cada fila, por bloques para acotar los temporales."""
+    energies = np.empty(mst.shape[0], dtype=np.float64)
+    for start in range(0, mst.shape[0], block_rows):
+        block = mst[start:start + block_rows]
+        energies[start:start + block_rows] = (block.real.astype(np.float64) ** 2
+                                              + block.imag.astype(np.float64) ** 2).sum(axis=1)
+    return energies
+
+
+def _thd(signal, fs, f0):
+    """Distorsión armónica total a partir del espectro de la señal (armónicos 2..MAX_HARMONIC)."""
+    N = len(signal)
+    spectrum = np.abs(np.fft.rfft(signal))
+    bin_width = fs / N
+    harmonics = np.arange(1, MAX_HARMONIC + 1) * f0
+    harmonics = harmonics[harmonics < fs / 2]
+    bins = np.rint(harmonics / bin_width).astype(int)
+    magnitudes = spectrum[bins]
+    if magnitudes[0] == 0:
+        return 0.0
+    return float(np.sqrt(np.sum(magnitudes[1:] ** 2)) / magnitudes[0])
+
+
+def extract_features(signal, mst, fs, f0=60, samples_per_cycle=512, pre_trigger_cycles=2, freqs=None, t=None):
+    """
+    Calcula el vector de características de un evento a partir de la señal
+    cruda y de su MST, para clasificación y tableros sin releer la matriz.
+
+    - Energía por banda (fracción de la energía total de la MST) y energía total.
+    - RMS por ciclo de la señal sin componente de DC (en unidades del ADC).
+    - Magnitud media de la fundamental (fila de f0 de la MST) en cada ciclo.
+    - THD de la señal.
+    - Instante (s) y tamaño relativo de la mayor desviación de la fundamental
+      respecto a su valor de referencia en los ciclos previos al disparo.
+
+    `freqs` y `t` describen las filas/columnas de `mst`; si se omiten se asume la
+    salida completa (N // 2, N) de la MST.
+    Retorna un diccionario con 'version', 'nombres' y 'vector' (lista de floats
+    de longitud fija para una configuración de captura dada).
+    """
+    signal = np.nan_to_num(np.asarray(signal, dtype=np.float64))
+    N = len(signal)
+    num_cycles = N // samples_per_cycle
+    if freqs is None:
+        freqs = np.arange(mst.shape[0]) * fs / N
+    if t is None:
+        t = np.arange(mst.shape[1]) / fs
+
+    # Energía por banda
+    energies = _row_energies(mst)
+    total_energy = float(energies.sum())
+    band_fractions = []
+    for lo, hi in ENERGY_BANDS_HZ:
+        mask = freqs >= lo if hi is None else (freqs >= lo) & (freqs < hi)
+        band_fractions.append(float(energies[mask].sum() / total_energy) if total_energy > 0 else 0.0)
+
+    # RMS por ciclo
+    centered = signal - signal.mean()
+    cycles = centered[:num_cycles * samples_per_cycle].reshape(num_cycles, samples_per_cycle)
+    rms_per_cycle = np.sqrt(np.mean(cycles ** 2, axis=1))
+
+    # Trayectoria de la fundamental en el tiempo y su media por ciclo
+    fundamental_row = int(np.argmin(np.abs(freqs - f0)))
+    fundamental_track = np.abs(mst[fundamental_row]).astype(np.float64)
+    cycle_index = np.minimum((t * f0).astype(int), num_cycles - 1)
+    counts = np.bincount(cycle_index, minlength=num_cycles)
+    fundamental_per_cycle = np.bincount(cycle_index, weights=fundamental_track, minlength=num_cycles) / np.maximum(counts, 1)
+
+    # Mayor desviación de la fundamental respecto a la referencia previa al disparo
+    pre_trigger = fundamental_track[cycle_index < pre_trigger_cycles]
+    reference = float(np.median(pre_trigger)) if pre_trigger.size else float(np.median(fundamental_track))
+    deviation = np.abs(fundamental_track - reference)
+    peak_index = int(np.argmax(deviation))
+    relative_deviation = float(deviation[peak_index] / reference) if reference > 0 else 0.0
+
+    vector = (band_fractions + [total_energy] + rms_per_cycle.tolist() + fundamental_per_cycle.tolist()
+              + [_thd(signal, fs, f0), float(t[peak_index]), relative_deviation])
+    return {
+        'version': FEATURE_VERSION,
+        'nombres': feature_names(num_cycles),
+        'vector': vector,
+    }
@@ -0,0 +1,94 @@
+import numpy as np
+
+DEFAULT_TILE_SIZE = 256
+
+
+def magnitude_to_db_u8(matrix, db_range=120.0, block_rows=256):
+    """
+    Magnitud de la MST en dB relativos al pico, recortada a `db_range` dB y
+    cuantizada a uint8 (0 = por debajo del rango, 255 = pico). Se procesa por
+    bloques de filas para no duplicar la matriz en float32.
+    """
+    matrix = np.asarray(matrix)
+    out = np.empty(matrix.shape, dtype=np.uint8)
+    peak = 0.0
+    for start in range(0, matrix.shape[0], block_rows):
+        peak = max(peak, float(np.abs(matrix[start:start + block_rows]).max(initial=0.0)))
+    scale = peak if peak > 0 else 1.0
+    for start in range(0, matrix.shape[0], block_rows):
+        magnitude = np.abs(matrix[start:start + block_rows]).astype(np.float32, copy=False) / np.float32(scale)
+        with np.errstate(divide='ignore'):
+            db = 20 * np.log10(magnitude, out=magnitude)
+        np.clip(db, -db_range, 0.0, out=db)
+        db += db_range
+        db *= 255 / db_range
+        out[start:start + block_rows] = np.rint(db)
+    return out, scale
+
+
+def _downsample_2x(level):
+    """
+    Reduce a la mitad ambas dimensiones tomando el máximo de cada bloque 2x2.
+    Se usa el máximo y no la media para que los transitorios de pocas muestras
+    sigan visibles en los niveles gruesos (el máximo conmuta con la escala dB).
+    """
+    rows, cols = level.shape
+    if rows % 2:
+        level = np.vstack([level, level[-1:]])
+    if cols % 2:
+        level = np.hstack([level, level[:, -1:]])
+    return level.reshape(level.shape[0] // 2, 2, level.shape[1] // 2, 2).max(axis=(1, 3))
+
+
+def to_tiles(level, tile_size=DEFAULT_TILE_SIZE):
+    """
+    Parte un nivel (F, T) en teselas de tile_size x tile_size, rellenando con 0.
+    Retorna un arreglo (teselas_f, teselas_t, tile_size, tile_size) contiguo, de
+    modo que cada tesela ocupa un bloque contiguo del archivo.
+    """
+    rows, cols = level.shape
+    n_f = -(-rows // tile_size)
+    n_t = -(-cols // tile_size)
+    padded = np.zeros((n_f * tile_size, n_t * tile_size), dtype=level.dtype)
+    padded[:rows, :cols] = level
+    return np.ascontiguousarray(padded.reshape(n_f, tile_size, n_t, tile_size).transpose(0, 2, 1, 3))
+
+
+def build_pyramid(matrix, tile_size=DEFAULT_TILE_SIZE, db_range=120.0):
+    """
+    Construye la pirámide de magnitud de una matriz MST para visualización con zoom.
+
+    El nivel 0 tiene la resolución completa; cada nivel siguiente reduce tiempo y
+    frecuencia a la mitad, hasta que el nivel cabe en una sola tesela. Cada nivel
+    se retorna ya partido en teselas uint8 (dB relativos al pico, ver
+    `magnitude_to_db_u8`).
+    Retorna (lista de (teselas, forma del nivel sin relleno), escala del pico).
+    """
+    level, scale = magnitude_to_db_u8(matrix, db_range=db_range)
+    levels = [(to_tiles(level, tile_size), level.shape)]
+    while level.shape[0] > tile_size or level.shape[1] > tile_size:
+        level = _downsample_2x(level)
+        levels.append((to_tiles(level, tile_size), level.shape))
+    return levels, scale
+
+
+def tile_range(start, stop, step, tile_size, n_tiles):
+    """Índices [primero, último] de las teselas que cubren el intervalo [start, stop) en unidades físicas."""
+    first = int(np.floor(start / (step * tile_size))) if start is not None else 0
+    last = int(np.ceil(stop / (step * tile_size))) - 1 if stop is not None else n_tiles - 1
+    return max(first, 0), min(last, n_tiles - 1)
+
+
+def read_window(tiles, row_start, row_stop, col_start, col_stop):
+    """
+    Arma la región [row_start:row_stop, col_start:col_stop] de un nivel a partir
+    de sus teselas (teselas_f, teselas_t, tile, tile), leyendo solo las teselas
+    que la cubren (útil cuando `tiles` es un memmap).
+    """
+    tile_size = tiles.shape[2]
+    f0, f1 = row_start // tile_size, -(-row_stop // tile_size)
+    t0, t1 = col_start // tile_size, -(-col_stop // tile_size)
+    block = np.asarray(tiles[f0:f1, t0:t1])
+    region = block.transpose(0, 2, 1, 3).reshape((f1 - f0) * tile_size, (t1 - t0) * tile_size)
+    return region[row_start - f0 * tile_size:row_stop - f0 * tile_size,
+                  col_start - t0 * tile_size:col_stop - t0 * tile_size]
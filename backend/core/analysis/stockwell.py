@@ -1,14 +1,20 @@
+import os
 import time
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import pandas as pd
+import scipy.fft
 from scipy.special import i0
 
-# --- NO HAY CAMBIOS EN ESTA FUNCIÓN ---
-# La Transformada de Stockwell Modificada (MST) con ventana de Kaiser
-def modified_stockwell_transform(signal, fs, p=2, alpha=1.0):
+from .window_cache import WindowBankCache
+
+# --- IMPLEMENTACIÓN DE REFERENCIA (BUCLE POR FILA) ---
+# La Transformada de Stockwell Modificada (MST) con ventana de Kaiser.
+# Se conserva sin cambios para validar y comparar la versión vectorizada.
+def modified_stockwell_transform_loop(signal, fs, p=2, alpha=1.0):
     """
     Calcula la Transformada de Stockwell Modificada (MST) de una señal.
-    (El cuerpo de esta función permanece igual)
+    Versión original: construye la ventana y ejecuta una ifft por cada fila.
     """
     N = len(signal)
     t = np.arange(N) / fs
@@ -36,14 +42,367 @@ def modified_stockwell_transform(signal, fs, p=2, alpha=1.0):
     return mst_matrix, freqs[:N // 2], t
 
 
-def mst_processing(signal):
+
+def _kaiser_beta(n, freqs, alpha):
+    """Parámetro beta de la ventana de Kaiser para cada fila de frecuencia n."""
+    return np.where(freqs[n] <= 2 * 60, alpha * 10 * n, alpha * 0.055 * n)
+
+
+def kaiser_window_rows(n, N, fs, p=2, alpha=1.0, dtype=np.float64):
+    """
+    Calcula las filas `n` (arreglo de índices de frecuencia) del banco de ventanas
+    Kaiser-sinh. La fila n es la ventana ya desplazada n posiciones (equivalente
+    al np.roll de la versión con bucle); la fila 0 (DC) es cero.
+    Las ventanas siempre se calculan en doble precisión; `dtype` (float64 o
+    float32) solo define el tipo del resultado (complejo si p no es entero).
+    Retorna una matriz de forma (len(n), N).
+    """
+    n = np.asarray(n)
+    freqs = np.fft.fftfreq(N, 1 / fs)
+    k = np.arange(N)
+    real_power = float(p).is_integer()
+    dtype = np.dtype(dtype)
+    rows = np.zeros((len(n), N), dtype=dtype if real_power else np.result_type(dtype, np.complex64))
+    non_dc = n != 0
+    n = n[non_dc]
+    if len(n) == 0:
+        return rows
+
+    beta = _kaiser_beta(n, freqs, alpha)[:, None]
+    # Índice desplazado: equivale a np.roll(ventana, n) sobre cada fila
+    shifted_k = (k[None, :] - n[:, None]) % N
+    inside_sqrt = beta ** 2 - (shifted_k * np.pi) ** 2
+    if real_power:
+        # sinh(sqrt(x)) / sqrt(x) es real: sinh(s)/s si x > 0 y sin(s)/s si x < 0
+        sqrt_abs = np.sqrt(np.abs(inside_sqrt))
+        second_term_kscw = np.ones_like(sqrt_abs)
+        positive = inside_sqrt > 0
+        negative = inside_sqrt < 0
+        second_term_kscw[positive] = np.sinh(sqrt_abs[positive]) / sqrt_abs[positive]
+        second_term_kscw[negative] = np.sin(sqrt_abs[negative]) / sqrt_abs[negative]
+    else:
+        # Potencias no enteras de lóbulos negativos dependen de la rama compleja:
+        # se replica exactamente la aritmética compleja de la versión original
+        sqrt_val = np.emath.sqrt(inside_sqrt)
+        second_term_kscw = np.ones_like(sqrt_val, dtype=np.complex128)
+        non_zero_indices = sqrt_val != 0
+        second_term_kscw[non_zero_indices] = np.sinh(sqrt_val[non_zero_indices]) / sqrt_val[non_zero_indices]
+    rows[non_dc] = ((N / i0(beta)) * second_term_kscw) ** p
+    return rows
+
+
+def kaiser_window_bank(N, fs, p=2, alpha=1.0, dtype=np.float64, block_rows=256, path=None):
+    """
+    Construye el banco de ventanas Kaiser-sinh de la MST, una fila por frecuencia.
+
+    Con el banco, toda la transformada se reduce a multiplicar el espectro de la
+    señal por el banco y aplicar una ifft 2-D (ver `kaiser_window_rows`).
+    Solo depende de (N, fs, p, alpha), así que puede reutilizarse entre eventos.
+    Con `path`, el banco se escribe por bloques en ese archivo .npy mapeado en
+    memoria en lugar de construirse en la memoria del proceso.
+    Retorna una matriz de forma (N // 2, N) con el tipo indicado por `dtype`.
+    """
+    first_rows = kaiser_window_rows(np.arange(min(block_rows, N // 2)), N, fs, p=p, alpha=alpha, dtype=dtype)
+    if path is None:
+        bank = np.empty((N // 2, N), dtype=first_rows.dtype)
+    else:
+        bank = np.lib.format.open_memmap(path, mode='w+', dtype=first_rows.dtype, shape=(N // 2, N))
+    bank[:len(first_rows)] = first_rows
+    # Se construye por bloques de filas para acotar los temporales intermedios
+    for start in range(block_rows, N // 2, block_rows):
+        n = np.arange(start, min(start + block_rows, N // 2))
+        bank[n] = kaiser_window_rows(n, N, fs, p=p, alpha=alpha, dtype=dtype)
+    if path is not None:
+        bank.flush()
+    return bank
+
+
+# Caché compartida de bancos de ventanas. El directorio de persistencia se
+# configura desde settings en CoreConfig.ready() (MST_WINDOW_CACHE_DIR).
+window_bank_cache = WindowBankCache(builder=kaiser_window_bank)
+
+
+def _band_rows(freqs, f_min=None, f_max=None):
+    """
+    Rango contiguo de filas de la MST (slice) cuyas frecuencias están en [f_min, f_max].
+    Sin límites retorna todas las filas, incluida la fila 0 (DC).
+    """
+    n_rows = len(freqs) // 2
+    positive_freqs = freqs[:n_rows]
+    start = 0 if f_min is None else int(np.searchsorted(positive_freqs, f_min, side='left'))
+    stop = n_rows if f_max is None else int(np.searchsorted(positive_freqs, f_max, side='right'))
+    if start >= stop:
+        raise ValueError(f"La banda [{f_min}, {f_max}] Hz no contiene ninguna fila de frecuencia.")
+    return slice(start, stop)
+
+
+def _real_signal_fft(signal, workers=1):
+    """
+    FFT completa de una señal real en precisión simple a partir de rfft.
+    Solo se calcula la mitad del espectro; el resto se obtiene por simetría
+    hermitiana X[N - k] = conj(X[k]).
+    """
+    N = signal.shape[-1]
+    half = scipy.fft.rfft(signal, axis=-1, workers=workers)  # float32 -> complex64
+    full = np.empty(signal.shape, dtype=half.dtype)
+    full[..., :half.shape[-1]] = half
+    full[..., half.shape[-1]:] = np.conj(half[..., 1:N - N // 2][..., ::-1])
+    return full
+
+
+def _mst_rows(signal_fft, window_rows, decimation, fft_module, fft_workers=1):
+    """
+    Filas de la MST para un bloque de ventanas: producto con el espectro,
+    plegado opcional por decimación e ifft. Retorna complex64 (..., filas, N // D).
+    Con scipy.fft, `fft_workers` reparte las ifft de las filas entre varios hilos.
+    """
+    options = {'workers': fft_workers} if fft_module is scipy.fft else {}
+    # (..., 1, N) * (filas, N) -> (..., filas, N): una fila de frecuencia por ventana
+    product = window_rows * signal_fft[..., None, :]
+    N = product.shape[-1]
+    if decimation > 1:
+        M = N // decimation
+        product = product.reshape(*product.shape[:-1], decimation, M).sum(axis=-2)
+        mst_rows = fft_module.ifft(product, axis=-1, **options)
+        mst_rows /= decimation
+    else:
+        mst_rows = fft_module.ifft(product, axis=-1, **options)
+    return mst_rows.astype(np.complex64, copy=False)
+
+
+def _rows_per_block(max_memory, n_signals, N, complex_itemsize, build_windows):
+    """Número de filas por bloque para que los temporales quepan en `max_memory` bytes."""
+    # Producto + resultado de la ifft + conversión a complex64, por cada señal del lote
+    per_row = n_signals * N * (2 * complex_itemsize + 8)
+    if build_windows:
+        # Temporales en float64 de kaiser_window_rows (índices, argumento, raíz, término)
+        per_row += 6 * 8 * N
+    return max(1, int(max_memory // per_row))
+
+
+def _resolve_workers(workers):
+    """Normaliza el número de hilos: None -> 1, valores <= 0 -> núcleos disponibles."""
+    if workers is None:
+        return 1
+    workers = int(workers)
+    if workers <= 0:
+        return os.cpu_count() or 1
+    return workers
+
+
+def modified_stockwell_transform(signal, fs, p=2, alpha=1.0, window_bank=None,
+                                 f_min=None, f_max=None, decimation=1, precision='double',
+                                 max_memory=None, out=None, workers=1):
+    """
+    Calcula la Transformada de Stockwell Modificada (MST) de una señal.
+
+    Versión vectorizada: usa un banco de ventanas precalculado (ver
+    `kaiser_window_bank`) y calcula todas las filas con una sola ifft 2-D.
+    Da el mismo resultado que `modified_stockwell_transform_loop`.
+    Si no se pasa `window_bank`, se obtiene de `window_bank_cache`.
+    Acepta una señal 1-D de N puntos o un lote 2-D (B, N) de capturas; en el
+    segundo caso la FFT, el producto con el banco y la ifft se hacen sobre
+    todo el lote a la vez.
+
+    Modo de salida reducida:
+    - `f_min` / `f_max` (Hz) limitan el cálculo a las filas dentro de la banda.
+    - `decimation` = D conserva una de cada D columnas de tiempo. En lugar de
+      calcular la ifft completa y descartar columnas, el espectro de cada fila
+      se pliega (suma de sus D segmentos de longitud N / D) y se aplica una
+      ifft de N / D puntos, que da exactamente las muestras 0, D, 2D, ...
+      N debe ser divisible entre D.
+    Con los valores por defecto se obtiene la salida completa.
+
+    `precision='single'` activa la ruta rápida para señales reales: FFT de
+    entrada real (rfft), banco de ventanas float32 y producto/ifft en complex64
+    de principio a fin (scipy.fft conserva la precisión simple). Reduce a la
+    mitad el tráfico de memoria y el pico de RSS, con un error relativo del
+    orden de 1e-6 respecto a `precision='double'` (referencia exacta).
+
+    Modo de memoria acotada: con `max_memory` (bytes) y/o `out`, las filas se
+    calculan por bloques cuyos temporales caben en el presupuesto y cada bloque
+    se escribe directamente en `out` (un arreglo complex64 o un numpy.memmap,
+    ver `mst_to_memmap`). Las filas del banco se leen del archivo mapeado de
+    `window_bank_cache` (la primera vez se construye por bloques en disco); si
+    la caché no tiene directorio, las ventanas de cada bloque se calculan al
+    vuelo. En ambos casos el pico de memoria no crece con N más allá de la
+    propia salida.
+
+    Ejecución multinúcleo: con `workers` > 1 los bloques de filas se reparten
+    entre un pool de hilos. Las ifft usan scipy.fft y las operaciones de NumPy
+    sobre arreglos grandes liberan el GIL, así que los hilos corren en paralelo.
+    Un hilo por bloque paraleliza también el producto con el banco, que el
+    `workers=` de scipy.fft no cubre; si hay menos bloques que hilos (p. ej. un
+    presupuesto de memoria que da un solo bloque), los hilos sobrantes se pasan
+    como `workers=` a las ifft de cada bloque. `workers` <= 0 usa todos los
+    núcleos. Con presupuesto de memoria, este se divide entre los hilos.
+
+    Retorna (mst_matrix complex64 de forma (filas, N // D) o (B, filas, N // D),
+    freqs de las filas, t de las columnas). En modo por bloques, mst_matrix es `out`.
+    """
+    if precision not in ('double', 'single'):
+        raise ValueError(f"precision debe ser 'double' o 'single', se recibió '{precision}'.")
+    single = precision == 'single'
+    signal = np.asarray(signal, dtype=np.float32 if single else np.float64)
+    if signal.ndim not in (1, 2):
+        raise ValueError(f"Se esperaba una señal 1-D o un lote 2-D (B, N), se recibió forma {signal.shape}.")
+    N = signal.shape[-1]
+    if decimation < 1 or N % decimation != 0:
+        raise ValueError(f"El factor de decimación debe dividir a N={N}, se recibió {decimation}.")
+    t = np.arange(N) / fs
+    freqs = np.fft.fftfreq(N, 1 / fs)
+    bank_dtype = np.float32 if single else np.float64
+    workers = _resolve_workers(workers)
+    chunked = max_memory is not None or out is not None
+    if window_bank is None:
+        if chunked:
+            # Mapeado desde el disco; sin directorio de caché, None y las ventanas se calculan por bloque
+            window_bank = window_bank_cache.get_bounded(N, fs, p=p, alpha=alpha, dtype=bank_dtype)
+        else:
+            window_bank = window_bank_cache.get(N, fs, p=p, alpha=alpha, dtype=bank_dtype)
+    elif window_bank.shape != (N // 2, N):
+        raise ValueError(f"El banco de ventanas tiene forma {window_bank.shape}, se esperaba {(N // 2, N)}.")
+    rows = _band_rows(freqs, f_min, f_max)
+    fft_module = scipy.fft if single or workers > 1 else np.fft
+    signal_fft = _real_signal_fft(signal, workers) if single else np.fft.fft(signal, axis=-1)
+
+    if not chunked and workers == 1:
+        print("Calculando la MST (vectorizada)...")
+        mst_matrix = _mst_rows(signal_fft, window_bank[rows], decimation, fft_module)
+        print("Cálculo completado.")
+        return mst_matrix, freqs[rows], t[::decimation]
+
+    out_shape = signal.shape[:-1] + (rows.stop - rows.start, N // decimation)
+    if out is None:
+        out = np.empty(out_shape, dtype=np.complex64)
+    elif out.shape != out_shape or out.dtype != np.complex64:
+        raise ValueError(f"`out` debe ser complex64 con forma {out_shape}, se recibió {out.dtype} {out.shape}.")
+    n_rows = rows.stop - rows.start
+    if max_memory is not None or window_bank is None:
+        n_signals = int(np.prod(signal.shape[:-1]))
+        block = _rows_per_block((max_memory if max_memory is not None else 256 * 1024 ** 2) / workers,
+                                n_signals, N, signal_fft.itemsize, window_bank is None)
+    else:
+        # Sin presupuesto: un par de bloques por hilo para equilibrar la carga
+        block = -(-n_rows // (2 * workers))
+
+    block = min(block, n_rows)
+    starts = range(rows.start, rows.stop, block)
+    threads = min(workers, len(starts))
+    fft_workers = max(1, workers // threads)  # Hilos que no tienen bloque propio
+
+    def compute_block(start):
+        stop = min(start + block, rows.stop)
+        if window_bank is not None:
+            window_rows = window_bank[start:stop]
+        else:
+            window_rows = kaiser_window_rows(np.arange(start, stop), N, fs, p=p, alpha=alpha, dtype=bank_dtype)
+        out[..., start - rows.start:stop - rows.start, :] = _mst_rows(signal_fft, window_rows, decimation,
+                                                                      fft_module, fft_workers)
+
+    print(f"Calculando la MST por bloques de {block} filas con {threads} hilo(s) "
+          f"y {fft_workers} hilo(s) por ifft...")
+    if threads > 1:
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(compute_block, starts))  # list() propaga las excepciones de los hilos
+    else:
+        for start in starts:
+            compute_block(start)
+    if isinstance(out, np.memmap):
+        out.flush()
+    print("Cálculo completado.")
+    return out, freqs[rows], t[::decimation]
+
+
+def mst_to_memmap(signal, fs, path, max_memory=256 * 1024 ** 2, **kwargs):
+    """
+    Calcula la MST por bloques escribiendo el resultado en un archivo .npy
+    mapeado en memoria (`path`), que puede reabrirse con np.load(mmap_mode='r').
+    Acepta los mismos argumentos que `modified_stockwell_transform`.
+    Retorna (memmap complex64, freqs, t).
+    """
+    signal = np.asarray(signal)
+    N = signal.shape[-1]
+    decimation = kwargs.get('decimation', 1)
+    rows = _band_rows(np.fft.fftfreq(N, 1 / fs), kwargs.get('f_min'), kwargs.get('f_max'))
+    shape = signal.shape[:-1] + (rows.stop - rows.start, N // decimation)
+    out = np.lib.format.open_memmap(path, mode='w+', dtype=np.complex64, shape=shape)
+    return modified_stockwell_transform(signal, fs, max_memory=max_memory, out=out, **kwargs)
+
+
+def normalize_signals(signals):
+    """
+    Prepara una o varias capturas para la MST: reemplaza NaN por 0, elimina la
+    componente de DC y escala cada captura a [-1, 1] según su máximo absoluto.
+    Acepta un arreglo 1-D (N,) o 2-D (B, N) y retorna siempre float64 (B, N).
+    """
+    signals = np.array(signals, dtype=np.float64, ndmin=2)  # Copia: no modifica la entrada
+    nan_mask = np.isnan(signals)
+    if nan_mask.any():
+        capturas_con_nan = int(nan_mask.any(axis=1).sum())
+        print(f"Advertencia: Se encontraron valores nulos en {capturas_con_nan} captura(s), se reemplazarán por 0.")
+        signals[nan_mask] = 0.0
+    signals -= signals.mean(axis=1, keepdims=True)  # Centrar en cero
+    peak = np.abs(signals).max(axis=1, keepdims=True)
+    np.divide(signals, peak, out=signals, where=peak > 0)
+    return signals
+
+
+# Parámetros de la MST usados en el pipeline para las capturas del STM32
+MST_FS = 30720  # Hz (512 muestras/ciclo * 60 ciclos/s)
+MST_P_ORDER = 1
+MST_ALPHA = 0.05
+
+
+def mst_processing_batch(signals, f_min=None, f_max=None, decimation=1, precision='double',
+                         max_memory=None, out=None, workers=1, timings=None):
+    """
+    Versión por lotes de `mst_processing` para ráfagas de eventos.
+    Recibe un arreglo (B, N) con B capturas, las normaliza de forma vectorizada
+    y calcula la MST de todas en una sola llamada.
+    Retorna un arreglo complex64 de forma (B, N // 2, N), o reducido según
+    `f_min`, `f_max` y `decimation` (ver `modified_stockwell_transform`).
+    precision='single' activa la ruta rápida (ver `mst_processing`).
+    `max_memory` / `out` activan el cálculo por bloques con memoria acotada y
+    `workers` reparte los bloques entre varios hilos.
+    Si se pasa un diccionario `timings`, se llenan 'normalizacion' y 'mst' (s).
+    """
+    start_time = time.perf_counter()
+    signals = normalize_signals(signals)
+    normalized_time = time.perf_counter()
+    MST, FREQS, T = modified_stockwell_transform(signals, MST_FS, p=MST_P_ORDER, alpha=MST_ALPHA,
+                                                 f_min=f_min, f_max=f_max, decimation=decimation,
+                                                 precision=precision, max_memory=max_memory, out=out,
+                                                 workers=workers)
+    execution_time = time.perf_counter() - normalized_time
+    if timings is not None:
+        timings.update(normalizacion=normalized_time - start_time, mst=execution_time)
+    print(f"Tiempo de ejecución del lote ({signals.shape[0]} capturas): {execution_time:.6f} segundos")
+    return MST
+
+
+def mst_processing(signal, f_min=None, f_max=None, decimation=1, precision='double',
+                   max_memory=None, out=None, workers=1, timings=None):
+    """
+    Normaliza una captura y calcula su MST con los parámetros del pipeline.
+    Por defecto retorna la matriz completa (N // 2, N); `f_min`, `f_max` (Hz)
+    y `decimation` permiten pedir solo una banda y una rejilla de tiempo reducida,
+    p. ej. f_max=1000, decimation=8 para la vista de 0-1 kHz.
+    Por defecto reproduce el cálculo de referencia en doble precisión; como la
+    salida es complex64 en cualquier caso, precision='single' (ruta rápida, error
+    relativo ~1e-6) es la que usa el pipeline según settings.MST_PRECISION.
+    Con `max_memory` (bytes) y/o `out` (arreglo o numpy.memmap complex64) las
+    filas se calculan por bloques y se escriben directamente en la salida.
+    `workers` > 1 reparte los bloques de filas entre un pool de hilos.
+    Si se pasa un diccionario `timings`, se llenan 'normalizacion' y 'mst' (s).
+    """
     # ==============================================================================
     # --- SECCIÓN MODIFICADA: CARGA DE LA SEÑAL REAL DESDE EL CSV ---
     # ==============================================================================
     
     # --- Parámetros de la Señal REAL ---
     # Frecuencia de muestreo del STM32 (512 muestras/ciclo * 60 ciclos/s)
-    fs = 30720  # Hz
+    fs = MST_FS  # Hz
     
     # Cargar los datos desde tu archivo CSV organizado
     # try:
@@ -69,28 +428,26 @@ def mst_processing(signal):
     # # Obtiene el event_id para usarlo en el título de la gráfica
     # event_id = signal_row['event_id']
     
-    # Asegurarse de que la señal no tenga valores NaN (Not a Number)
-    if np.isnan(signal).any():
-        print("Advertencia: Se encontraron valores nulos en la señal, se reemplazarán por 0.")
-        signal = np.nan_to_num(signal)
-    
-    # Normalizar la señal (opcional pero recomendado para el análisis)
-    # Esto escala la señal para que sus valores estén entre -1 y 1
-    signal = signal - np.mean(signal) # Centrar en cero
-    if np.max(np.abs(signal)) > 0:
-        signal = signal / np.max(np.abs(signal))
+    # Reemplazar NaN por 0, centrar en cero y escalar la señal a [-1, 1]
+    start_time = time.perf_counter()
+    signal = normalize_signals(signal)[0]
+    normalized_time = time.perf_counter()
     
     # --- FIN DE LA SECCIÓN MODIFICADA ---
     
     # --- Ejecución de la Transformada (Sin cambios, pero con los datos reales) ---
-    p_order = 1
-    alpha_factor = 0.05
+    p_order = MST_P_ORDER
+    alpha_factor = MST_ALPHA
     
-    start_time = time.time()
-    MST, FREQS, T = modified_stockwell_transform(signal, fs, p=p_order, alpha=alpha_factor)
-    end_time = time.time()
-    execution_time = end_time - start_time
+    MST, FREQS, T = modified_stockwell_transform(signal, fs, p=p_order, alpha=alpha_factor,
+                                                 f_min=f_min, f_max=f_max, decimation=decimation,
+                                                 precision=precision, max_memory=max_memory, out=out,
+                                                 workers=workers)
+    end_time = time.perf_counter()
+    execution_time = end_time - normalized_time
     print(f"Tiempo de ejecución: {execution_time:.6f} segundos")
+    if timings is not None:
+        timings.update(normalizacion=normalized_time - start_time, mst=execution_time)
     
     # # --- Visualización de Resultados (Títulos actualizados) ---
     # fig, axs = plt.subplots(2, 1, figsize=(15, 10), sharex=True)
@@ -0,0 +1,78 @@
+import numpy as np
+
+# Parámetros de captura del STM32 (ver signal_config.h)
+FS = 30720  # Hz (512 muestras/ciclo * 60 ciclos/s)
+F0 = 60  # Hz
+NUM_SAMPLES = 5120  # 10 ciclos
+PRE_TRIGGER_CYCLES = 2
+
+# Escala del ADC de 16 bits: la señal se centra a media escala
+ADC_MIDSCALE = 32768
+ADC_AMPLITUDE = 20000
+
+EVENT_TYPES = ('normal', 'sag', 'swell', 'harmonics', 'oscillatory_transient', 'interruption', 'notch')
+
+
+def _event_window(t, start_cycle, cycles):
+    """Máscara booleana de los instantes entre start_cycle y start_cycle + cycles."""
+    return (t >= start_cycle / F0) & (t < (start_cycle + cycles) / F0)
+
+
+def generate_event(event_type, num_samples=NUM_SAMPLES, fs=FS, noise=0.002, seed=0, as_adc=True):
+    """
+    Genera una captura sintética de un evento de calidad de energía.
+    El evento comienza al terminar los ciclos previos al disparo, como en las
+    capturas reales del STM32.
+
+    Tipos: 'normal', 'sag' (caída al 50 %), 'swell' (subida al 140 %),
+    'harmonics' (3°, 5° y 7° armónicos), 'oscillatory_transient' (oscilación
+    amortiguada de 2.5 kHz), 'interruption' (tensión al 5 %) y 'notch'
+    (muescas de conmutación en cada semiciclo).
+
+    Con `as_adc=True` retorna muestras uint16 como las que envía el STM32;
+    si no, float64 en por unidad.
+    """
+    if event_type not in EVENT_TYPES:
+        raise ValueError(f"Tipo de evento '{event_type}' no válido. Opciones: {EVENT_TYPES}")
+    rng = np.random.default_rng(seed)
+    t = np.arange(num_samples) / fs
+    phase = 2 * np.pi * F0 * t
+    amplitude = np.ones(num_samples)
+    start = PRE_TRIGGER_CYCLES
+    signal_pu = None
+
+    if event_type == 'sag':
+        amplitude[_event_window(t, start, 4)] = 0.5
+    elif event_type == 'swell':
+        amplitude[_event_window(t, start, 4)] = 1.4
+    elif event_type == 'interruption':
+        amplitude[_event_window(t, start, 5)] = 0.05
+    elif event_type == 'harmonics':
+        during = _event_window(t, start, num_samples)
+        signal_pu = np.sin(phase) + during * (0.15 * np.sin(3 * phase) + 0.10 * np.sin(5 * phase)
+                                             + 0.07 * np.sin(7 * phase))
+    elif event_type == 'oscillatory_transient':
+        t_event = t - (start + 0.25) / F0  # En el pico del ciclo
+        transient = 0.8 * np.exp(-t_event / 0.5e-3) * np.sin(2 * np.pi * 2500 * t_event)
+        signal_pu = np.sin(phase) + np.where(t_event >= 0, transient, 0.0)
+    elif event_type == 'notch':
+        signal_pu = np.sin(phase)
+        during = _event_window(t, start, num_samples)
+        # Muescas de ~150 µs tras cada cruce por cero (conmutación de un rectificador)
+        notch_phase = np.mod(phase, np.pi)
+        notches = during & (notch_phase > 0.35) & (notch_phase < 0.35 + 2 * np.pi * F0 * 150e-6)
+        signal_pu[notches] *= 0.2
+
+    if signal_pu is None:
+        signal_pu = amplitude * np.sin(phase)
+    signal_pu = signal_pu + noise * rng.standard_normal(num_samples)
+
+    if not as_adc:
+        return signal_pu
+    adc = np.rint(ADC_MIDSCALE + ADC_AMPLITUDE * signal_pu)
+    return np.clip(adc, 0, 65535).astype(np.uint16)
+
+
+def generate_event_set(event_types=EVENT_TYPES, **kwargs):
+    """Diccionario {tipo: captura} con un evento sintético de cada tipo."""
+    return {event_type: generate_event(event_type, seed=i, **kwargs) for i, event_type in enumerate(event_types)}
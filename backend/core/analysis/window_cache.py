@@ -0,0 +1,112 @@
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+class WindowBankCache:
+    """
+    Caché LRU de bancos de ventanas de la MST indexada por (N, fs, p, alpha, dtype).
+
+    Si se configura un directorio, cada banco se construye directamente en un
+    archivo .npy (con `path`, el constructor escribe ahí por bloques) y se abre
+    como memoria mapeada (mmap_mode='r'). Así todos los procesos prefork de
+    Celery en un mismo host comparten una única copia a través del page cache del
+    sistema operativo en lugar de construir y guardar cada uno la suya.
+    Sin directorio, los bancos se conservan solo en la memoria del proceso.
+    """
+
+    def __init__(self, builder, max_entries=4, directory=None):
+        self._builder = builder  # builder(N, fs, p=..., alpha=..., dtype=..., path=None) -> np.ndarray
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.max_entries = max_entries
+        self.directory = directory
+
+    def configure(self, max_entries=None, directory=None):
+        """Ajusta el tamaño máximo y/o el directorio de persistencia. Vacía la caché en memoria."""
+        with self._lock:
+            if max_entries is not None:
+                self.max_entries = max_entries
+            if directory is not None:
+                self.directory = str(directory)
+            self._entries.clear()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    @staticmethod
+    def _key(N, fs, p, alpha, dtype):
+        return (int(N), float(fs), float(p), float(alpha), np.dtype(dtype).name)
+
+    def _path(self, key):
+        N, fs, p, alpha, dtype = key
+        return os.path.join(self.directory, f"kaiser_N{N}_fs{fs!r}_p{p!r}_a{alpha!r}_{dtype}.npy")
+
+    def _load_or_build(self, key):
+        N, fs, p, alpha, dtype = key
+        if not self.directory:
+            bank = self._builder(N, fs, p=p, alpha=alpha, dtype=dtype)
+            bank.flags.writeable = False
+            return bank
+
+        path = self._path(key)
+        if os.path.exists(path):
+            try:
+                return np.load(path, mmap_mode='r')
+            except (OSError, ValueError) as e:
+                print(f"Advertencia: no se pudo leer el banco de ventanas '{path}' ({e}). Se reconstruirá.")
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # El banco se construye directamente en un archivo temporal (sin tenerlo completo en
+            # memoria) y se renombra de forma atómica: otro proceso nunca verá un archivo a medio escribir
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            os.close(fd)
+            try:
+                bank = self._builder(N, fs, p=p, alpha=alpha, dtype=dtype, path=tmp_path)
+                del bank  # Cierra el memmap antes de renombrar
+                os.chmod(tmp_path, 0o644)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+            return np.load(path, mmap_mode='r')
+        except OSError as e:
+            print(f"Advertencia: no se pudo persistir el banco de ventanas en '{self.directory}' ({e}).")
+            bank = self._builder(N, fs, p=p, alpha=alpha, dtype=dtype)
+            bank.flags.writeable = False
+            return bank
+
+    def get_bounded(self, N, fs, p=2, alpha=1.0, dtype=np.float64):
+        """
+        Banco para el modo de memoria acotada. Con directorio se obtiene como en
+        `get` (la primera vez se construye por bloques en disco y después se lee
+        mapeado, así que no ocupa memoria del proceso). Sin directorio solo se
+        retorna si ya está en memoria; si no, None, porque construirlo ocuparía
+        la memoria que se quiere acotar.
+        """
+        if self.directory:
+            return self.get(N, fs, p=p, alpha=alpha, dtype=dtype)
+        key = self._key(N, fs, p, alpha, dtype)
+        with self._lock:
+            bank = self._entries.get(key)
+            if bank is not None:
+                self._entries.move_to_end(key)
+            return bank
+
+    def get(self, N, fs, p=2, alpha=1.0, dtype=np.float64):
+        """Retorna el banco (de solo lectura) para (N, fs, p, alpha, dtype), construyéndolo si hace falta."""
+        key = self._key(N, fs, p, alpha, dtype)
+        with self._lock:
+            bank = self._entries.get(key)
+            if bank is not None:
+                self._entries.move_to_end(key)
+                return bank
+            bank = self._load_or_build(key)
+            self._entries[key] = bank
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return bank
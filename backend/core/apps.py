@@ -4,3 +4,37 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        from django.conf import settings
+        from .analysis.stockwell import window_bank_cache
+        from .metrics import metrics
+        from .render_cache import render_cache
+        from .waveform_cache import waveform_cache
+
+        # Bancos de ventanas de la MST persistidos en disco y compartidos entre procesos
+        window_bank_cache.configure(
+            max_entries=getattr(settings, 'MST_WINDOW_CACHE_MAX_ENTRIES', None),
+            directory=getattr(settings, 'MST_WINDOW_CACHE_DIR', None),
+        )
+
+        # Imágenes renderizadas de espectrogramas, acotadas por tamaño total
+        max_mb = getattr(settings, 'SPECTROGRAM_RENDER_CACHE_MAX_MB', None)
+        render_cache.configure(
+            max_bytes=max_mb * 1024 ** 2 if max_mb else None,
+            directory=getattr(settings, 'SPECTROGRAM_RENDER_CACHE_DIR', None),
+        )
+
+        # Capturas crudas delante de InfluxDB (LRU local + Redis opcional)
+        max_mb = getattr(settings, 'WAVEFORM_CACHE_MAX_MB', None)
+        waveform_cache.configure(
+            max_bytes=max_mb * 1024 ** 2 if max_mb else None,
+            redis_url=getattr(settings, 'WAVEFORM_CACHE_REDIS_URL', None),
+            redis_ttl=getattr(settings, 'WAVEFORM_CACHE_TTL_S', None),
+        )
+
+        # Métricas por etapa del procesamiento, sumadas entre workers en Redis
+        metrics.configure(
+            redis_url=getattr(settings, 'METRICS_REDIS_URL', None),
+            trace_memory=getattr(settings, 'METRICS_TRACE_MEMORY', None),
+        )
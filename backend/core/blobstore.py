@@ -0,0 +1,332 @@
+# core/blobstore.py
+
+"""
+Almacenamiento de arreglos grandes (espectrogramas) fuera de PostgreSQL.
+
+Los arreglos se guardan como archivos .npy direccionados por contenido: la
+referencia se deriva del SHA-256 del archivo, de modo que un mismo contenido
+se guarda una sola vez y nunca se sobrescribe. Por eso un arreglo puede estar
+referenciado por más de un Espectrograma y no se borra al reemplazar o borrar
+la fila: los que ya no referencia ninguna los retira el comando limpiar_blobs.
+Los lectores reciben un numpy.memmap, así que servir o recortar un
+espectrograma no lo copia completo a la memoria del proceso.
+
+El backend se elige con settings.SPECTROGRAM_STORAGE (ruta de la clase y
+opciones), siguiendo el mismo esquema que STORAGES de Django.
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+import numpy as np
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def _sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _write_npy_tmp(array, directory):
+    """Escribe el arreglo como .npy en un archivo temporal de `directory`. Retorna (ruta, sha256)."""
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.lib.format.write_array(f, np.ascontiguousarray(array), allow_pickle=False)
+        os.chmod(tmp_path, 0o644)
+        return tmp_path, _sha256_file(tmp_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _touch(path):
+    """
+    Renueva la fecha de un arreglo que se vuelve a guardar con el mismo
+    contenido, para que `limpiar_blobs` no lo tome por huérfano mientras la
+    fila que lo referencia aún no se confirma.
+    """
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        pass
+
+
+class BlobStore:
+    """Interfaz común de los backends de almacenamiento de arreglos."""
+
+    def put_array(self, array):
+        """Guarda el arreglo. Retorna (referencia, checksum 'sha256:<hex>')."""
+        raise NotImplementedError
+
+    def open_array(self, ref, mmap=True):
+        """Abre el arreglo guardado; con mmap=True retorna un numpy.memmap de solo lectura."""
+        raise NotImplementedError
+
+    def local_path(self, ref):
+        """Ruta local del archivo .npy (descargándolo si hace falta), para servirlo por streaming."""
+        raise NotImplementedError
+
+    def exists(self, ref):
+        raise NotImplementedError
+
+    def delete(self, ref):
+        raise NotImplementedError
+
+    def list_refs(self):
+        """Itera (referencia, fecha de última escritura como timestamp) de todos los arreglos guardados."""
+        raise NotImplementedError
+
+    def modified_at(self, ref):
+        """Fecha de última escritura (timestamp) del arreglo, o None si no existe."""
+        raise NotImplementedError
+
+
+class LocalBlobStore(BlobStore):
+    """Archivos .npy direccionados por contenido en un directorio local: <root>/ab/cd/<sha256>.npy"""
+
+    def __init__(self, root):
+        self.root = str(root)
+
+    @staticmethod
+    def _ref_for(checksum):
+        return f"{checksum[:2]}/{checksum[2:4]}/{checksum}.npy"
+
+    def local_path(self, ref):
+        return os.path.join(self.root, ref)
+
+    def put_array(self, array):
+        tmp_path, checksum = _write_npy_tmp(array, self.root)
+        ref = self._ref_for(checksum)
+        path = self.local_path(ref)
+        if os.path.exists(path):
+            os.unlink(tmp_path)  # Mismo contenido ya guardado
+            _touch(path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+        return ref, f"sha256:{checksum}"
+
+    def open_array(self, ref, mmap=True):
+        return np.load(self.local_path(ref), mmap_mode='r' if mmap else None, allow_pickle=False)
+
+    def exists(self, ref):
+        return os.path.exists(self.local_path(ref))
+
+    def delete(self, ref):
+        try:
+            os.unlink(self.local_path(ref))
+        except FileNotFoundError:
+            pass
+
+    def list_refs(self):
+        for directorio, _, names in os.walk(self.root):
+            for name in names:
+                if name.endswith('.npy'):
+                    path = os.path.join(directorio, name)
+                    try:
+                        yield os.path.relpath(path, self.root), os.stat(path).st_mtime
+                    except FileNotFoundError:
+                        pass
+
+    def modified_at(self, ref):
+        try:
+            return os.stat(self.local_path(ref)).st_mtime
+        except FileNotFoundError:
+            return None
+
+
+class DirectoryObjectStore(BlobStore):
+    """
+    Sustituto de un almacenamiento de objetos (S3/MinIO) basado en un directorio.
+
+    Solo usa operaciones de objeto completo (put/get/head/delete sobre
+    <bucket_dir>/<prefix><clave>), igual que lo haría un cliente de S3, para
+    poder cambiarlo por uno real sin tocar a los lectores. Para ofrecer memmap,
+    los objetos leídos se descargan una vez a `cache_dir`.
+    """
+
+    def __init__(self, bucket_dir, cache_dir, prefix='espectrogramas/'):
+        self.bucket_dir = str(bucket_dir)
+        self.cache = LocalBlobStore(cache_dir)
+        self.prefix = prefix
+
+    def _object_path(self, key):
+        return os.path.join(self.bucket_dir, self.prefix + key)
+
+    # --- Operaciones de objeto (equivalentes a put_object/get_object/head_object) ---
+    def _put_object(self, key, source_path):
+        path = self._object_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        os.close(fd)
+        shutil.copyfile(source_path, tmp_path)
+        os.replace(tmp_path, path)
+
+    def _get_object(self, key, dest_path):
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dest_path), suffix='.tmp')
+        os.close(fd)
+        shutil.copyfile(self._object_path(key), tmp_path)
+        os.replace(tmp_path, dest_path)
+
+    def _head_object(self, key):
+        return os.path.exists(self._object_path(key))
+
+    def _list_objects(self):
+        """(clave, última modificación) de los objetos bajo el prefijo, como list_objects_v2."""
+        raiz = self._object_path('')
+        for directorio, _, names in os.walk(raiz):
+            for name in names:
+                if name.endswith('.npy'):
+                    path = os.path.join(directorio, name)
+                    try:
+                        yield os.path.relpath(path, raiz), os.stat(path).st_mtime
+                    except FileNotFoundError:
+                        pass
+
+    # --- Interfaz BlobStore ---
+    def put_array(self, array):
+        tmp_path, checksum = _write_npy_tmp(array, self.cache.root)
+        key = f"{checksum}.npy"
+        try:
+            if self._head_object(key):
+                _touch(self._object_path(key))  # En S3: copiar el objeto sobre sí mismo
+            else:
+                self._put_object(key, tmp_path)
+            # La copia local queda en la caché para lecturas posteriores
+            cache_path = self.cache.local_path(key)
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            os.replace(tmp_path, cache_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+        return key, f"sha256:{checksum}"
+
+    def local_path(self, ref):
+        path = self.cache.local_path(ref)
+        if not os.path.exists(path):
+            self._get_object(ref, path)
+        return path
+
+    def open_array(self, ref, mmap=True):
+        return np.load(self.local_path(ref), mmap_mode='r' if mmap else None, allow_pickle=False)
+
+    def exists(self, ref):
+        return self._head_object(ref)
+
+    def delete(self, ref):
+        for path in (self._object_path(ref), self.cache.local_path(ref)):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def list_refs(self):
+        return self._list_objects()
+
+    def modified_at(self, ref):
+        try:
+            return os.stat(self._object_path(ref)).st_mtime
+        except FileNotFoundError:
+            return None
+
+
+class StagingBlobStore(LocalBlobStore):
+    """
+    Área temporal para los resultados intermedios del pipeline por etapas
+    (ver core/tasks.py): cada arreglo se guarda en <root>/<uuid>.npy, sin
+    deduplicar por contenido, para que cada etapa borre los suyos sin afectar a
+    otras tareas. `promote` los pasa al almacén definitivo.
+    """
+
+    def put_array(self, array):
+        tmp_path, checksum = _write_npy_tmp(array, self.root)
+        ref = f"{uuid.uuid4().hex}.npy"
+        os.replace(tmp_path, self.local_path(ref))
+        return ref, f"sha256:{checksum}"
+
+    def promote(self, ref, checksum, store):
+        """
+        Guarda en `store` el arreglo `ref` del área temporal y lo retira de esta.
+        Si `store` es un LocalBlobStore, el archivo se mueve sin copiarlo (el
+        checksum ya se calculó al escribirlo). Retorna (referencia, checksum) en `store`.
+        """
+        if type(store) is LocalBlobStore and checksum:
+            final_ref = store._ref_for(checksum.removeprefix('sha256:'))
+            path = store.local_path(final_ref)
+            if os.path.exists(path):
+                self.delete(ref)  # Mismo contenido ya guardado
+                _touch(path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                try:
+                    os.replace(self.local_path(ref), path)
+                except OSError:  # Otro sistema de archivos: se copia
+                    final_ref, checksum = store.put_array(self.open_array(ref, mmap=True))
+                    self.delete(ref)
+            return final_ref, checksum
+        final = store.put_array(self.open_array(ref, mmap=True))
+        self.delete(ref)
+        return final
+
+    def purge(self, max_age_s):
+        """Borra los arreglos con más de `max_age_s` segundos (restos de tareas interrumpidas)."""
+        limite = time.time() - max_age_s
+        try:
+            names = os.listdir(self.root)
+        except FileNotFoundError:
+            return 0
+        borrados = 0
+        for name in names:
+            path = os.path.join(self.root, name)
+            try:
+                if os.stat(path).st_mtime < limite:
+                    os.unlink(path)
+                    borrados += 1
+            except FileNotFoundError:
+                pass
+        return borrados
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_blob_store():
+    """
+    Backend configurado en settings.SPECTROGRAM_STORAGE, o None si los
+    espectrogramas deben guardarse en línea (BYTEA) como antes.
+    """
+    global _store
+    config = getattr(settings, 'SPECTROGRAM_STORAGE', None)
+    if not config:
+        return None
+    with _store_lock:
+        if _store is None:
+            backend = import_string(config['BACKEND'])
+            _store = backend(**config.get('OPTIONS', {}))
+        return _store
+
+
+_staging = None
+
+
+def get_staging_store():
+    """Área temporal del pipeline por etapas en settings.PIPELINE_STAGING_DIR."""
+    global _staging
+    with _store_lock:
+        if _staging is None:
+            _staging = StagingBlobStore(settings.PIPELINE_STAGING_DIR)
+        return _staging
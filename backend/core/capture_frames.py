@@ -0,0 +1,87 @@
+# core/capture_frames.py
+
+"""
+Formato de la trama cruda que el STM32 envía por UART (ver signal_config.h y
+esp32_paquet.c):
+
+    0xAA 0x55 | longitud uint16 LE (10240) | 5120 muestras uint16 LE | checksum uint16 LE
+
+Los tamaños salen de settings.CAPTURE_NUM_SAMPLES (PROCESSING_BUFFER_LEN en el
+firmware), así que cambiar CAPTURE_TOTAL_CYCLES cambia también la trama esperada.
+
+El checksum es Fletcher-16 sobre los bytes del payload. Aquí se calcula con
+NumPy para muchas tramas a la vez.
+"""
+
+import numpy as np
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+FRAME_HEADER = b'\xaa\x55'
+PAYLOAD_LEN = 2 * settings.CAPTURE_NUM_SAMPLES  # PAYLOAD_LEN del firmware: 5120 * 2 = 10240 bytes
+PACKET_LEN = len(FRAME_HEADER) + 2 + PAYLOAD_LEN + 2  # 10246 bytes con la configuración por defecto
+
+if PAYLOAD_LEN > 0xFFFF:
+    raise ImproperlyConfigured(
+        f"CAPTURE_NUM_SAMPLES = {settings.CAPTURE_NUM_SAMPLES} no cabe en la trama: la longitud del payload "
+        f"es un uint16 ({PAYLOAD_LEN} > 65535 bytes).")
+
+_weights = {}
+
+
+def _fletcher_weights(n):
+    # sum2 = Σ (n - i) · d_i mod 255 (i desde 0), equivalente al bucle del firmware
+    if n not in _weights:
+        _weights[n] = np.arange(n, 0, -1, dtype=np.float64)
+    return _weights[n]
+
+
+def fletcher16(payloads):
+    """
+    Fletcher-16 de uno o varios payloads: arreglo uint8 (n,) o (tramas, n), o bytes.
+    Da el mismo valor que calculate_checksum() del firmware, (sum2 << 8) | sum1.
+
+    El producto con los pesos se hace en float64: el máximo, 255 · n² / 2 para
+    n = 10240 (la trama por defecto), es ~1.3e10 y se representa exacto (< 2**53).
+    """
+    data = np.frombuffer(payloads, dtype=np.uint8) if isinstance(payloads, (bytes, bytearray)) else payloads
+    sum1 = data.sum(axis=-1, dtype=np.int64) % 255
+    sum2 = (data @ _fletcher_weights(data.shape[-1])).astype(np.int64) % 255
+    return (sum2 << 8) | sum1
+
+
+def build_frame(samples):
+    """Arma una trama completa (PACKET_LEN bytes) a partir de CAPTURE_NUM_SAMPLES muestras uint16, como el STM32."""
+    samples = np.asarray(samples)
+    if samples.size != settings.CAPTURE_NUM_SAMPLES:
+        raise ValueError(f"La trama lleva {settings.CAPTURE_NUM_SAMPLES} muestras; se recibieron {samples.size}.")
+    payload = samples.astype('<u2').tobytes()
+    checksum = int(fletcher16(payload))
+    return FRAME_HEADER + len(payload).to_bytes(2, 'little') + payload + checksum.to_bytes(2, 'little')
+
+
+def split_frames(data):
+    """
+    Separa las tramas de un bloque de bytes (p. ej. el cuerpo de una petición
+    HTTP), resincronizando en el siguiente encabezado 0xAA 0x55 si hay basura o
+    una longitud inválida. No verifica el checksum.
+    Retorna (lista de (payload, checksum), bytes descartados).
+    """
+    frames = []
+    discarded = 0
+    pos = 0
+    while True:
+        start = data.find(FRAME_HEADER, pos)
+        if start < 0:
+            discarded += len(data) - pos
+            break
+        discarded += start - pos
+        end = start + PACKET_LEN
+        length = int.from_bytes(data[start + 2:start + 4], 'little')
+        if length != PAYLOAD_LEN or end > len(data):
+            discarded += 1
+            pos = start + 1
+            continue
+        frames.append((bytes(data[start + 4:end - 2]), int.from_bytes(data[end - 2:end], 'little')))
+        pos = end
+    return frames, discarded
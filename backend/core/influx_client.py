@@ -1,10 +1,40 @@
 # core/influx_client.py
 
+import base64
 import os
-from influxdb_client import InfluxDBClient, Point, WriteOptions
+import re
+import numpy as np
+import pandas as pd
+from influxdb_client import InfluxDBClient, Point, WriteOptions, WritePrecision
 from influxdb_client.client.write_api import SYNCHRONOUS
 from django.conf import settings
 
+# event_id menores a este valor no son instantes en ns (el ESP32 usa el tiempo en ns de la primera muestra)
+MIN_EVENT_ID_NS = 10 ** 17
+
+CAPTURE_STORAGE_MODES = ('packed', 'points')
+PACKED_ENCODING = 'u16le_b64' # Muestras uint16 little-endian en base64
+
+
+def encode_packed_samples(samples):
+    """Muestras del ADC (uint16) como texto base64 para el campo 'payload' de la captura empaquetada."""
+    samples = np.asarray(samples)
+    if samples.size and (samples.min() < 0 or samples.max() > 65535 or np.any(samples != np.rint(samples))):
+        raise ValueError("Las muestras no son enteros de 16 bits sin signo; no se pueden empaquetar sin pérdidas.")
+    return base64.b64encode(samples.astype('<u2').tobytes()).decode('ascii')
+
+
+def _escape_tag(value):
+    """Escapa un valor de tag para el protocolo de línea de InfluxDB."""
+    return str(value).replace('\\', '\\\\').replace(',', '\\,').replace('=', '\\=').replace(' ', '\\ ')
+
+
+def decode_packed_capture(payload, start_ns, sampling_period_ns):
+    """Decodifica una captura empaquetada. Retorna (timestamps datetime64[ns], valores float64)."""
+    samples = np.frombuffer(base64.b64decode(payload), dtype='<u2')
+    timestamps = (start_ns + np.arange(samples.size, dtype=np.int64) * sampling_period_ns).astype('datetime64[ns]')
+    return timestamps, samples.astype(np.float64)
+
 class InfluxService:
     _instance = None
 
@@ -43,37 +73,364 @@ class InfluxService:
             self._write_api = self.client.write_api(write_options=WriteOptions(batch_size=500, flush_interval=10_000, write_type=SYNCHRONOUS))
         return self._write_api
 
-    def get_signal_data(self, event_id: str, measurement: str):
+    @staticmethod
+    def _flux_time(ns):
+        """Instante en ns desde la época como literal RFC3339 de Flux."""
+        return f"{np.datetime_as_string(np.datetime64(int(ns), 'ns'), unit='ns')}Z"
+
+    def _event_range(self, event_id, start=None):
+        """
+        Intervalo (inicio, fin) en ns que contiene la captura de un evento, con
+        un margen de settings.INFLUX_QUERY_MARGIN_S a cada lado.
+
+        El ESP32 usa como event_id el instante en ns de la primera muestra; si el
+        event_id no tiene esa forma se usa `start` (p. ej. Muestra.timestamp_inicio).
+        Retorna None si no hay forma de acotarlo.
         """
-        Recupera los 5120 puntos de una señal de InfluxDB dado un event_id.
+        try:
+            start_ns = int(event_id)
+            if start_ns < MIN_EVENT_ID_NS:
+                raise ValueError
+        except (TypeError, ValueError):
+            if start is None:
+                return None
+            start_ns = int(pd.Timestamp(start).value)
+        duration_ns = settings.CAPTURE_NUM_SAMPLES * settings.CAPTURE_SAMPLING_PERIOD_NS
+        margin_ns = int(settings.INFLUX_QUERY_MARGIN_S * 1e9)
+        return start_ns - margin_ns, start_ns + duration_ns + margin_ns
+
+    def get_signal_data(self, event_id: str, measurement: str, start=None):
+        """
+        Recupera los puntos de una señal de InfluxDB dado un event_id
+        (settings.CAPTURE_NUM_SAMPLES, 5120 con la configuración actual del STM32).
         Asume que los puntos están bajo un 'measurement' y 'event_id' tag.
-        Retorna una lista de tuplas (timestamp, value).
+        Si la captura está guardada empaquetada (ver `write_captures`) se lee ese
+        único registro en lugar de los puntos; las dos formas se piden en la
+        misma consulta (ver `_query_captures`).
+
+        La consulta se acota al intervalo de la captura (ver `_event_range`), así
+        que su costo no crece con la historia del bucket, y el resultado se lee
+        por columnas (DataFrames) directamente a arreglos de NumPy.
+        Retorna (timestamps datetime64[ns] en UTC, valores float64), ordenados por tiempo.
+        """
+        time_range = self._event_range(event_id, start)
+        if time_range is None:
+            print(f"Advertencia: no se pudo acotar el rango de tiempo del event_id {event_id}; se consulta toda la historia.")
+            time_range = (None, None)
+        range_clause = self._range_clause(*time_range)
+
+        captures = self._query_captures(measurement, range_clause, [event_id])
+        if event_id in captures:
+            return captures[event_id]
+        empty = np.empty(0, dtype='datetime64[ns]'), np.empty(0, dtype=np.float64)
+        return self._sorted_capture(event_id, *empty)
+
+    @staticmethod
+    def _read_columns(frames, tag=None):
+        """
+        Lee por columnas los DataFrames de una consulta de puntos a arreglos de
+        NumPy. Retorna (timestamps datetime64[ns] en UTC, valores float64,
+        columna `tag` como arreglo de str o None).
+        """
+        times = []
+        values = []
+        tags = []
+        for frame in frames:
+            if frame.empty:
+                continue
+            times.append(frame['_time'].dt.tz_convert('UTC').dt.tz_localize(None).to_numpy(dtype='datetime64[ns]'))
+            values.append(frame['_value'].to_numpy(dtype=np.float64))
+            if tag is not None:
+                tags.append(frame[tag].to_numpy(dtype=str))
+        timestamps = np.concatenate(times) if times else np.empty(0, dtype='datetime64[ns]')
+        data = np.concatenate(values) if values else np.empty(0, dtype=np.float64)
+        if tag is None:
+            return timestamps, data, None
+        return timestamps, data, np.concatenate(tags) if tags else np.empty(0, dtype=str)
+
+    @staticmethod
+    def _sorted_capture(event_id, timestamps, data):
+        """Ordena por tiempo (solo si hace falta) y recorta a settings.CAPTURE_NUM_SAMPLES puntos."""
+        if np.any(timestamps[1:] < timestamps[:-1]):
+            order = np.argsort(timestamps, kind='stable')
+            timestamps, data = timestamps[order], data[order]
+
+        # Si hay más de num_samples puntos, tomar los primeros num_samples
+        num_samples = settings.CAPTURE_NUM_SAMPLES
+        if len(data) > num_samples:
+            timestamps, data = timestamps[:num_samples], data[:num_samples]
+        elif len(data) < num_samples:
+             print(f"Advertencia: El event_id {event_id} tiene menos de {num_samples} puntos ({len(data)}).")
+
+        return timestamps, data
+
+    def get_signals_data(self, event_ids=None, measurement='voltage_waveform', start=None, stop=None, starts=None):
+        """
+        Recupera las capturas de muchos eventos con una consulta, o con pocas, en
+        lugar de una por evento, para procesamiento por lotes y reprocesamiento.
+
+        - Con `event_ids`: los eventos se agrupan por cercanía en el tiempo (ver
+          `_event_range`; `starts` puede dar el inicio de los event_id que no son
+          instantes en ns) y se hace una consulta por grupo que abarque como máximo
+          settings.INFLUX_BULK_MAX_SPAN_S.
+        - Sin `event_ids`: todos los eventos de la ventana [start, stop).
+
+        Retorna {event_id: (timestamps datetime64[ns], valores float64)} con cada
+        captura ordenada y recortada como en `get_signal_data`; los eventos sin
+        puntos no aparecen. np.stack sobre los valores da el arreglo (B, 5120)
+        que espera mst_processing_batch.
+        """
+        if event_ids is None:
+            if start is None or stop is None:
+                raise ValueError("Se requieren event_ids o una ventana de tiempo (start y stop).")
+            return self._query_events(measurement, pd.Timestamp(start).value, pd.Timestamp(stop).value)
+
+        starts = starts or {}
+        bounded = []
+        unbounded = []
+        for event_id in dict.fromkeys(str(e) for e in event_ids):
+            time_range = self._event_range(event_id, starts.get(event_id))
+            if time_range is None:
+                unbounded.append(event_id)
+            else:
+                bounded.append((time_range[0], time_range[1], event_id))
+
+        # Agrupa los rangos ordenados mientras el grupo no exceda el intervalo máximo
+        max_span_ns = int(settings.INFLUX_BULK_MAX_SPAN_S * 1e9)
+        groups = []
+        for range_start, range_stop, event_id in sorted(bounded):
+            if groups and range_stop - groups[-1][0] <= max_span_ns:
+                groups[-1][1] = max(groups[-1][1], range_stop)
+                groups[-1][2].append(event_id)
+            else:
+                groups.append([range_start, range_stop, [event_id]])
+        if unbounded:
+            print(f"Advertencia: {len(unbounded)} event_id sin rango de tiempo conocido; se consulta toda la historia.")
+            groups.append([None, None, unbounded])
+
+        result = {}
+        for range_start, range_stop, ids in groups:
+            result.update(self._query_events(measurement, range_start, range_stop, ids))
+        return result
+
+    @classmethod
+    def _range_clause(cls, start_ns, stop_ns):
+        if start_ns is None:
+            return 'range(start: 0)'
+        return f'range(start: {cls._flux_time(start_ns)}, stop: {cls._flux_time(stop_ns)})'
+
+    @staticmethod
+    def _event_filter(event_ids):
+        if event_ids is None:
+            return ''
+        # Una expresión regular sobre el tag se resuelve en el índice del almacenamiento
+        pattern = '|'.join(re.escape(e).replace('/', '\\/') for e in event_ids)
+        return f'|> filter(fn: (r) => r.event_id =~ /^({pattern})$/)'
+
+    def _query_events(self, measurement, start_ns, stop_ns, event_ids=None):
+        """Capturas de los eventos `event_ids` (o de todos) del rango, empaquetadas o como puntos de `measurement`."""
+        return self._query_captures(measurement, self._range_clause(start_ns, stop_ns), event_ids)
+
+    def _packed_flux(self, range_clause, event_filter):
+        """Flux de las capturas empaquetadas del rango: una fila por captura con su payload."""
+        return f'''from(bucket: "{self.bucket}")
+                |> {range_clause}
+                |> filter(fn: (r) => r._measurement == "{settings.INFLUX_CAPTURE_MEASUREMENT}")
+                {event_filter}
+                |> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")
+                |> keep(columns: ["_time", "event_id", "payload", "sampling_period_ns"])
+                |> group()'''
+
+    def _points_flux(self, measurement, range_clause, event_filter, exclude=''):
+        """Flux de los puntos individuales de `measurement`, agrupados por event_id y ordenados por tiempo."""
+        return f'''from(bucket: "{self.bucket}")
+                |> {range_clause}
+                |> filter(fn: (r) => r._measurement == "{measurement}")
+                {event_filter}
+                {exclude}
+                |> keep(columns: ["_time", "_value", "event_id"])
+                |> group(columns: ["event_id"])
+                |> sort(columns: ["_time"])'''
+
+    def _captures_query(self, measurement, range_clause, event_ids=None):
+        """
+        Consulta Flux con dos resultados: 'packed', las capturas empaquetadas, y
+        'points', los puntos individuales de `measurement` de los eventos que no
+        tienen captura empaquetada (los que se empaquetaron sin --borrar-puntos
+        no se transfieren dos veces).
+        """
+        event_filter = self._event_filter(event_ids)
+        sin_empaquetar = '|> filter(fn: (r) => not contains(value: r.event_id, set: empaquetados))'
+        return f'''
+            packed = {self._packed_flux(range_clause, event_filter)}
+            empaquetados = packed |> findColumn(fn: (key) => true, column: "event_id")
+            packed |> yield(name: "packed")
+
+            {self._points_flux(measurement, range_clause, event_filter, exclude=sin_empaquetar)}
+                |> yield(name: "points")
+        '''
+
+    def _query_captures(self, measurement, range_clause, event_ids=None):
+        """
+        Capturas de los eventos `event_ids` (o de todos) del rango en un solo
+        viaje a InfluxDB: las empaquetadas y, para las que no lo están, los puntos
+        individuales. Retorna {event_id: (timestamps, valores)}.
+        """
+        packed_frames = []
+        point_frames = []
+        query = self._captures_query(measurement, range_clause, event_ids)
+        for frame in self.query_api.query_data_frame_stream(query, org=self.org):
+            if frame.empty:
+                continue
+            (packed_frames if frame['result'].iloc[0] == 'packed' else point_frames).append(frame)
+        result = self._group_points(point_frames)
+        result.update(self._decode_packed(packed_frames))
+        return result
+
+    def _query_points(self, measurement, range_clause, event_ids=None):
+        """Solo los puntos individuales de los eventos `event_ids` (o de todos): {event_id: (timestamps, valores)}."""
+        query = self._points_flux(measurement, range_clause, self._event_filter(event_ids))
+        return self._group_points(self.query_api.query_data_frame_stream(query, org=self.org))
+
+    def _group_points(self, frames):
+        """Agrupa por el tag event_id los DataFrames de una consulta de puntos: {event_id: (timestamps, valores)}."""
+        timestamps, data, tags = self._read_columns(frames, tag='event_id')
+
+        # Agrupa por event_id con un solo ordenamiento estable (conserva el orden temporal)
+        order = np.argsort(tags, kind='stable')
+        tags, timestamps, data = tags[order], timestamps[order], data[order]
+        unique_ids, first = np.unique(tags, return_index=True)
+        bounds = np.append(first, len(tags))
+        return {
+            str(event_id): self._sorted_capture(str(event_id), timestamps[lo:hi], data[lo:hi])
+            for event_id, lo, hi in zip(unique_ids, bounds[:-1], bounds[1:])
+        }
+
+    def _query_packed(self, range_clause, event_ids=None):
+        """Solo las capturas empaquetadas del rango: {event_id: (timestamps, valores)}."""
+        query = self._packed_flux(range_clause, self._event_filter(event_ids))
+        return self._decode_packed(self.query_api.query_data_frame_stream(query, org=self.org))
+
+    @staticmethod
+    def _decode_packed(frames):
+        """Decodifica los DataFrames de una consulta de capturas empaquetadas: {event_id: (timestamps, valores)}."""
+        result = {}
+        for frame in frames:
+            if frame.empty:
+                continue
+            start_ns = frame['_time'].dt.tz_convert('UTC').dt.tz_localize(None).to_numpy(dtype='datetime64[ns]').astype(np.int64)
+            for event_id, payload, period_ns, t0 in zip(frame['event_id'], frame['payload'],
+                                                        frame['sampling_period_ns'], start_ns):
+                result[str(event_id)] = decode_packed_capture(payload, int(t0), int(period_ns))
+        return result
+
+    def events_window(self, event_ids):
+        """Rango (inicio, fin) en ns que contiene las capturas de todos los eventos, o (None, None) si alguno no se puede acotar."""
+        ranges = [self._event_range(e) for e in event_ids]
+        if not ranges or any(r is None for r in ranges):
+            return None, None
+        return min(r[0] for r in ranges), max(r[1] for r in ranges)
+
+    def get_packed_captures(self, event_ids, start_ns=None, stop_ns=None):
+        """
+        Solo las capturas empaquetadas de los eventos: {event_id: (timestamps, valores)}.
+        Las usa empaquetar_capturas para distinguir y verificar cada formato; para
+        leer capturas está `get_signals_data`, que acepta ambos.
         """
+        return self._query_packed(self._range_clause(start_ns, stop_ns), event_ids)
+
+    def get_point_captures(self, event_ids, start_ns=None, stop_ns=None, measurement=None):
+        """Solo las capturas guardadas como puntos individuales: {event_id: (timestamps, valores)}."""
+        measurement = measurement or settings.INFLUX_POINTS_MEASUREMENT
+        return self._query_points(measurement, self._range_clause(start_ns, stop_ns), event_ids)
+
+    def write_captures(self, captures, mode=None):
+        """
+        Guarda capturas crudas en InfluxDB. Cada captura es un diccionario con
+        'event_id', 'samples' (arreglo uint16), 'start_ns' y, opcionalmente,
+        'sampling_period_ns', 'device_id', 'location' y 'trigger_type'.
+
+        mode='packed' (por defecto settings.INFLUX_CAPTURE_STORAGE) escribe un solo
+        registro por captura con las muestras uint16 little-endian en base64;
+        'points' escribe un punto por muestra, como el firmware del ESP32.
+        Todas las capturas van en una sola petición de escritura.
+        """
+        mode = mode or settings.INFLUX_CAPTURE_STORAGE
+        if mode not in CAPTURE_STORAGE_MODES:
+            raise ValueError(f"Modo '{mode}' no válido. Opciones: {CAPTURE_STORAGE_MODES}")
+        records = []
+        for capture in captures:
+            samples = np.asarray(capture['samples'])
+            period_ns = int(capture.get('sampling_period_ns') or settings.CAPTURE_SAMPLING_PERIOD_NS)
+            tags = {
+                'event_id': str(capture['event_id']),
+                'device_id': capture.get('device_id'),
+                'location': capture.get('location'),
+                'trigger_type': capture.get('trigger_type'),
+            }
+            if mode == 'packed':
+                point = (Point(settings.INFLUX_CAPTURE_MEASUREMENT)
+                         .field('payload', encode_packed_samples(samples))
+                         .field('num_samples', int(samples.size))
+                         .field('sampling_period_ns', period_ns)
+                         .field('encoding', PACKED_ENCODING)
+                         .time(int(capture['start_ns']), WritePrecision.NS))
+                for key, value in tags.items():
+                    if value:
+                        point = point.tag(key, value)
+                records.append(point)
+            else:
+                tag_str = ''.join(f',{key}={_escape_tag(value)}' for key, value in tags.items() if value)
+                prefix = f"{settings.INFLUX_POINTS_MEASUREMENT}{tag_str} value="
+                times = int(capture['start_ns']) + np.arange(samples.size, dtype=np.int64) * period_ns
+                records.extend(f"{prefix}{v} {t}" for v, t in zip(samples.tolist(), times.tolist()))
+        if records:
+            self.write_api.write(bucket=self.bucket, org=self.org, record=records, write_precision=WritePrecision.NS)
+
+    def get_event_tags(self, event_ids, start_ns=None, stop_ns=None, measurement=None):
+        """Tags de hardware (device_id, location, trigger_type) de cada evento guardado por puntos."""
+        measurement = measurement or settings.INFLUX_POINTS_MEASUREMENT
         query = f'''
             from(bucket: "{self.bucket}")
-            |> range(start: 0) // Consulta desde el inicio para asegurarnos de capturar todo
+            |> {self._range_clause(start_ns, stop_ns)}
             |> filter(fn: (r) => r._measurement == "{measurement}")
-            |> filter(fn: (r) => r.event_id == "{event_id}")
-            |> sort(columns: ["_time"])
-            |> yield(name: "mean")
+            {self._event_filter(event_ids)}
+            |> first()
+            |> group()
+        '''
+        tags = {}
+        for frame in self.query_api.query_data_frame_stream(query, org=self.org):
+            for row in frame.to_dict('records'):
+                tags[str(row['event_id'])] = {
+                    key: row.get(key) for key in ('device_id', 'location', 'trigger_type')
+                    if isinstance(row.get(key), str)
+                }
+        return tags
+
+    def list_event_ids(self, start_ns, stop_ns, measurement=None):
+        """event_id distintos de `measurement` en el rango, a partir del índice de tags."""
+        measurement = measurement or settings.INFLUX_POINTS_MEASUREMENT
+        query = f'''
+            import "influxdata/influxdb/schema"
+            schema.tagValues(
+                bucket: "{self.bucket}",
+                tag: "event_id",
+                predicate: (r) => r._measurement == "{measurement}",
+                start: {self._flux_time(start_ns)},
+                stop: {self._flux_time(stop_ns)},
+            )
         '''
         tables = self.query_api.query(query, org=self.org)
+        return [str(record.get_value()) for table in tables for record in table.records]
 
-        data = []
-        for table in tables:
-            for record in table.records:
-                data.append((record.get_time(), record.get_value()))
-
-        # Asegurar que los datos estén ordenados por tiempo y que sean 5120 puntos
-        # Si hay más, tomar los primeros 5120 o ajustar lógica según necesidad
-        data = sorted(data, key=lambda x: x[0])
-        if len(data) > 5120:
-            data = data[:5120] # Tomar solo los primeros 5120 puntos si hay más
-        elif len(data) < 5120:
-             print(f"Advertencia: El event_id {event_id} tiene menos de 5120 puntos ({len(data)}).")
-             # Manejar el caso de datos incompletos si es necesario, ej. rellenar con ceros o descartar
-
-        return data
+    def delete_points(self, event_id, start_ns, stop_ns, measurement=None):
+        """Borra los puntos individuales de un evento (tras empaquetarlo)."""
+        measurement = measurement or settings.INFLUX_POINTS_MEASUREMENT
+        self.client.delete_api().delete(
+            self._flux_time(start_ns), self._flux_time(stop_ns),
+            f'_measurement="{measurement}" AND event_id="{event_id}"',
+            bucket=self.bucket, org=self.org,
+        )
 
     def close(self):
         if self._client:
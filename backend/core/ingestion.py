@@ -0,0 +1,344 @@
+# core/ingestion.py
+
+"""
+Gateway de ingesta de tramas crudas del STM32 (ver core/capture_frames.py).
+
+El ESP32 reenvía la trama (10246 bytes por defecto) tal cual, sin convertirla a line
+protocol. Hay dos entradas:
+- TCP: flujo continuo de tramas. Opcionalmente, antes de las tramas (o entre
+  ellas), una línea de texto 'DEVICE <device_id> [<location>]' identifica al
+  equipo; si no, se usa la dirección del cliente.
+- HTTP: POST /frames con una o más tramas concatenadas en el cuerpo y los
+  encabezados X-Device-Id / X-Location. GET /stats devuelve los contadores.
+
+Las tramas pasan por una cola acotada. Cuando se llena, los lectores dejan de
+leer el socket y el control de flujo de TCP frena a los equipos (contrapresión)
+en lugar de acumular memoria. Los escritores toman lotes de la cola, verifican
+todos los checksums con una sola operación de NumPy y guardan las capturas
+válidas con una sola escritura a InfluxDB por lote. Con INGESTION_AUTO_PROCESS,
+cada lote guardado crea además sus Muestras y encola su procesamiento.
+"""
+
+import asyncio
+import json
+import logging
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from celery import group
+from django.conf import settings
+from django.db import close_old_connections
+
+from .analysis.stockwell import MST_FS
+from .capture_frames import FRAME_HEADER, PAYLOAD_LEN, PACKET_LEN, fletcher16, split_frames
+from .influx_client import influx_service
+from .models import Muestra
+from .tasks import firma_procesamiento
+from .waveform_cache import waveform_cache
+
+logger = logging.getLogger(__name__)
+
+_HELLO_PREFIX = b'DEVICE '
+_MAX_HTTP_BODY = 64 * PACKET_LEN
+
+
+def register_captures(captures):
+    """
+    Crea las Muestras de un lote de capturas recién guardadas y encola su
+    procesamiento. La inserción es masiva e ignora los event_id que ya existen
+    (reenvíos, varios gateways). Como bulk_create con ignore_conflicts no dice
+    qué filas insertó, cada fila nueva lleva en lote_ingesta la marca de esta
+    llamada: solo se encolan las que la tienen, no las que otro gateway creó al
+    mismo tiempo ni las que ya existían. Retorna los IDs encolados.
+    """
+    candidatos = {str(c['event_id']): c for c in captures}
+    existentes = set(Muestra.objects.filter(event_id__in=candidatos).values_list('event_id', flat=True))
+    nuevas = [e for e in candidatos if e not in existentes]
+    if not nuevas:
+        return []
+    lote = uuid.uuid4()
+    filas = []
+    for event_id in nuevas:
+        captura = candidatos[event_id]
+        n = len(captura['samples'])
+        periodo = int(captura.get('sampling_period_ns') or settings.CAPTURE_SAMPLING_PERIOD_NS)
+        filas.append(Muestra(
+            event_id=event_id,
+            timestamp_inicio=pd.Timestamp(int(captura['start_ns']), tz='UTC').to_pydatetime(warn=False),
+            duracion_ms=(n - 1) * periodo // 1_000_000,
+            frecuencia_muestreo_hz=MST_FS,
+            num_puntos=n,
+            origen_hardware=(captura.get('device_id') or '')[:50] or None,
+            lote_ingesta=lote,
+        ))
+    Muestra.objects.bulk_create(filas, ignore_conflicts=True)
+    ids = list(Muestra.objects.filter(event_id__in=nuevas, estado_procesamiento='pendiente', lote_ingesta=lote)
+               .values_list('id', flat=True))
+    try:
+        group(firma_procesamiento(muestra_id) for muestra_id in ids).apply_async()
+    except Exception:
+        # Las Muestras quedan 'pendiente' y se pueden procesar después (process-pending)
+        logger.exception("No se pudo encolar el procesamiento de %d muestras.", len(ids))
+        return []
+    return ids
+
+
+def store_captures(captures):
+    """
+    Guarda un lote de capturas recibidas (se ejecuta en un hilo del gateway).
+    Con INGESTION_AUTO_PROCESS, además registra las Muestras y encola su
+    procesamiento; las capturas se dejan en la caché de capturas para que la
+    tarea no tenga que volver a leerlas de InfluxDB.
+    """
+    influx_service.write_captures(captures)
+    if not settings.INGESTION_AUTO_PROCESS:
+        return
+    waveform_cache.put_many({
+        str(c['event_id']): (
+            (int(c['start_ns']) + np.arange(len(c['samples']), dtype=np.int64)
+             * int(c.get('sampling_period_ns') or settings.CAPTURE_SAMPLING_PERIOD_NS)).astype('datetime64[ns]'),
+            c['samples'],
+        )
+        for c in captures
+    })
+    register_captures(captures)
+
+
+class IngestionGateway:
+    """Servidor asyncio de ingesta: lectores TCP/HTTP -> cola acotada -> escritores por lotes."""
+
+    def __init__(self, sink=store_captures, queue_size=2048, batch_size=200, flush_interval=0.5,
+                 writers=2, write_retries=3, trigger_type='manual_button', location=None):
+        self.sink = sink
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.writers = writers
+        self.write_retries = write_retries
+        self.trigger_type = trigger_type
+        self.location = location
+        self.queue = None
+        self._executor = ThreadPoolExecutor(max_workers=writers, thread_name_prefix='ingesta')
+        self._last_event_ns = 0
+        self.stats = {
+            'conexiones_activas': 0,
+            'tramas_recibidas': 0,
+            'tramas_validas': 0,
+            'checksum_invalido': 0,
+            'bytes_descartados': 0,
+            'esperas_cola_llena': 0,
+            'lotes_escritos': 0,
+            'capturas_escritas': 0,
+            'capturas_perdidas': 0,
+            'errores_escritura': 0,
+        }
+
+    def _next_event_ns(self):
+        # event_id = marca de tiempo en ns al completar la trama (como el ESP32), única en el gateway
+        self._last_event_ns = max(time.time_ns(), self._last_event_ns + 1)
+        return self._last_event_ns
+
+    async def _enqueue(self, payload, checksum, device_id, location):
+        self.stats['tramas_recibidas'] += 1
+        if self.queue.full():
+            self.stats['esperas_cola_llena'] += 1
+        await self.queue.put((payload, checksum, device_id, location, self._next_event_ns()))
+
+    # --- TCP ---
+    async def handle_tcp(self, reader, writer):
+        peer = writer.get_extra_info('peername')
+        device_id = peer[0] if peer else 'desconocido'
+        location = self.location
+        self.stats['conexiones_activas'] += 1
+        try:
+            while True:
+                try:
+                    prefix = await reader.readuntil(FRAME_HEADER)
+                except asyncio.LimitOverrunError as e:
+                    # Basura sin encabezado: se descarta y se sigue buscando
+                    self.stats['bytes_descartados'] += e.consumed
+                    await reader.readexactly(e.consumed)
+                    continue
+                prefix = prefix[:-len(FRAME_HEADER)]
+                if prefix.startswith(_HELLO_PREFIX):
+                    campos = prefix[len(_HELLO_PREFIX):].decode('utf-8', 'replace').split()
+                    if campos:
+                        device_id = campos[0]
+                        location = campos[1] if len(campos) > 1 else self.location
+                else:
+                    self.stats['bytes_descartados'] += len(prefix)
+
+                length = int.from_bytes(await reader.readexactly(2), 'little')
+                if length != PAYLOAD_LEN:
+                    self.stats['bytes_descartados'] += len(FRAME_HEADER) + 2
+                    continue  # Longitud inválida: se resincroniza en el siguiente encabezado
+                body = await reader.readexactly(PAYLOAD_LEN + 2)
+                await self._enqueue(body[:-2], int.from_bytes(body[-2:], 'little'), device_id, location)
+        except asyncio.IncompleteReadError:
+            pass  # El equipo cerró la conexión (posiblemente a mitad de una trama)
+        except ConnectionError:
+            pass
+        finally:
+            self.stats['conexiones_activas'] -= 1
+            writer.close()
+
+    # --- HTTP (mínimo, para clientes que no pueden mantener un socket TCP) ---
+    async def handle_http(self, reader, writer):
+        self.stats['conexiones_activas'] += 1
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                    break
+                request_line, *header_lines = head.decode('latin-1').split('\r\n')
+                method, path, _ = (request_line.split(' ', 2) + ['', ''])[:3]
+                headers = {}
+                for line in header_lines:
+                    if ':' in line:
+                        key, value = line.split(':', 1)
+                        headers[key.strip().lower()] = value.strip()
+                length = int(headers.get('content-length') or 0)
+                if length > _MAX_HTTP_BODY:
+                    await self._http_reply(writer, 413, {'error': f'El cuerpo supera {_MAX_HTTP_BODY} bytes.'}, close=True)
+                    break
+                body = await reader.readexactly(length) if length else b''
+
+                if method == 'POST' and path == '/frames':
+                    frames, discarded = split_frames(body)
+                    self.stats['bytes_descartados'] += discarded
+                    device_id = headers.get('x-device-id') or writer.get_extra_info('peername')[0]
+                    location = headers.get('x-location') or self.location
+                    for payload, checksum in frames:
+                        await self._enqueue(payload, checksum, device_id, location)
+                    status, data = 202, {'tramas': len(frames), 'bytes_descartados': discarded}
+                elif method == 'GET' and path == '/stats':
+                    status, data = 200, self.get_stats()
+                else:
+                    status, data = 404, {'error': 'Ruta no encontrada.'}
+                close = headers.get('connection', '').lower() == 'close'
+                await self._http_reply(writer, status, data, close=close)
+                if close:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            self.stats['conexiones_activas'] -= 1
+            writer.close()
+
+    @staticmethod
+    async def _http_reply(writer, status, data, close=False):
+        reasons = {200: 'OK', 202: 'Accepted', 404: 'Not Found', 413: 'Payload Too Large'}
+        body = json.dumps(data).encode('utf-8')
+        writer.write(
+            f"HTTP/1.1 {status} {reasons[status]}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: {'close' if close else 'keep-alive'}\r\n\r\n".encode('latin-1')
+            + body)
+        await writer.drain()
+
+    # --- Escritura por lotes ---
+    async def _next_batch(self):
+        batch = [await self.queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    def _build_captures(self, batch):
+        """Verifica los checksums del lote de una vez y arma las capturas válidas."""
+        data = np.frombuffer(b''.join(item[0] for item in batch), dtype=np.uint8).reshape(len(batch), PAYLOAD_LEN)
+        valid = fletcher16(data) == np.array([item[1] for item in batch])
+        samples = data.view('<u2')
+        captures = []
+        for i in np.flatnonzero(valid):
+            _, _, device_id, location, event_ns = batch[i]
+            captures.append({
+                'event_id': str(event_ns),
+                'samples': samples[i],
+                'start_ns': event_ns,
+                'sampling_period_ns': settings.CAPTURE_SAMPLING_PERIOD_NS,
+                'device_id': device_id,
+                'location': location,
+                'trigger_type': self.trigger_type,
+            })
+        return captures, len(batch) - len(captures)
+
+    def _write(self, captures):
+        """
+        Llama al sink en un hilo del pool. Esos hilos viven lo que el gateway, así
+        que, como Django al empezar y terminar cada petición, se descartan antes y
+        después de cada lote las conexiones a la base de datos rotas o más viejas
+        que CONN_MAX_AGE (p. ej. tras reiniciar PostgreSQL).
+        """
+        close_old_connections()
+        try:
+            return self.sink(captures)
+        finally:
+            close_old_connections()
+
+    async def _writer_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            captures, invalid = await loop.run_in_executor(self._executor, self._build_captures, batch)
+            self.stats['checksum_invalido'] += invalid
+            self.stats['tramas_validas'] += len(captures)
+            if not captures:
+                continue
+            for attempt in range(self.write_retries + 1):
+                try:
+                    await loop.run_in_executor(self._executor, self._write, captures)
+                    self.stats['lotes_escritos'] += 1
+                    self.stats['capturas_escritas'] += len(captures)
+                    break
+                except Exception as e:
+                    # Mientras se reintenta la cola se llena y la contrapresión frena a los equipos
+                    self.stats['errores_escritura'] += 1
+                    logger.warning("Error al guardar un lote de %d capturas (intento %d/%d): %s",
+                                   len(captures), attempt + 1, self.write_retries + 1, e)
+                    await asyncio.sleep(min(2 ** attempt, 30))
+            else:
+                self.stats['capturas_perdidas'] += len(captures)
+
+    def get_stats(self):
+        return {**self.stats, 'cola': self.queue.qsize() if self.queue else 0, 'cola_max': self.queue_size}
+
+    async def _report_loop(self, interval):
+        anterior = dict(self.stats)
+        while True:
+            await asyncio.sleep(interval)
+            actual = self.get_stats()
+            tasa = (actual['capturas_escritas'] - anterior['capturas_escritas']) / interval
+            print(f"Ingesta: {tasa:.1f} capturas/s, cola {actual['cola']}/{self.queue_size}, "
+                  f"conexiones {actual['conexiones_activas']}, checksum inválido {actual['checksum_invalido']}, "
+                  f"errores de escritura {actual['errores_escritura']}")
+            anterior = actual
+
+    async def serve(self, host='0.0.0.0', tcp_port=None, http_port=None, report_interval=None):
+        """Atiende las conexiones hasta que se cancele la tarea."""
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        # El límite del lector permite buscar el encabezado entre algo más de una trama de basura
+        servers = []
+        if tcp_port is not None:
+            servers.append(await asyncio.start_server(self.handle_tcp, host, tcp_port, limit=2 * PACKET_LEN))
+        if http_port is not None:
+            servers.append(await asyncio.start_server(self.handle_http, host, http_port, limit=2 * PACKET_LEN))
+        tasks = [asyncio.create_task(self._writer_loop()) for _ in range(self.writers)]
+        if report_interval:
+            tasks.append(asyncio.create_task(self._report_loop(report_interval)))
+        try:
+            await asyncio.gather(*(server.serve_forever() for server in servers), *tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            for server in servers:
+                server.close()
+            self._executor.shutdown(wait=False)
@@ -0,0 +1,68 @@
+# core/management/commands/benchmark_mst.py
+
+import time
+import numpy as np
+from django.core.management.base import BaseCommand
+from core.analysis.stockwell import (
+    modified_stockwell_transform, modified_stockwell_transform_loop, kaiser_window_bank
+)
+
+class Command(BaseCommand):
+    help = ('Compara el tiempo de la MST con bucle por fila contra la versión vectorizada '
+            'y verifica la precisión de la ruta rápida en precisión simple')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--muestras', type=int, default=5120, help='Número de puntos de la señal (N)')
+        parser.add_argument('--fs', type=float, default=30720, help='Frecuencia de muestreo en Hz')
+        parser.add_argument('--repeticiones', type=int, default=3, help='Repeticiones por variante')
+
+    def _medir(self, funcion, repeticiones):
+        tiempos = []
+        resultado = None
+        for _ in range(repeticiones):
+            inicio = time.perf_counter()
+            resultado = funcion()
+            tiempos.append(time.perf_counter() - inicio)
+        return min(tiempos), resultado
+
+    def handle(self, *args, **options):
+        N = options['muestras']
+        fs = options['fs']
+        repeticiones = options['repeticiones']
+        p_order, alpha_factor = 1, 0.05  # Mismos parámetros que mst_processing
+
+        # Señal sintética: fundamental de 60 Hz con 5° armónico
+        t = np.arange(N) / fs
+        signal = np.sin(2 * np.pi * 60 * t) + 0.1 * np.sin(2 * np.pi * 300 * t)
+
+        t_loop, (mst_loop, _, _) = self._medir(
+            lambda: modified_stockwell_transform_loop(signal, fs, p=p_order, alpha=alpha_factor), repeticiones)
+        t_banco, banco = self._medir(
+            lambda: kaiser_window_bank(N, fs, p=p_order, alpha=alpha_factor), repeticiones)
+        t_vect, (mst_vect, _, _) = self._medir(
+            lambda: modified_stockwell_transform(signal, fs, p=p_order, alpha=alpha_factor, window_bank=banco), repeticiones)
+        banco_f32 = kaiser_window_bank(N, fs, p=p_order, alpha=alpha_factor, dtype=np.float32)
+        t_single, (mst_single, _, _) = self._medir(
+            lambda: modified_stockwell_transform(signal, fs, p=p_order, alpha=alpha_factor, window_bank=banco_f32,
+                                                 precision='single'), repeticiones)
+
+        escala = np.max(np.abs(mst_loop))
+        error_rel = float(np.max(np.abs(mst_vect - mst_loop)) / escala)
+        error_rel_single = float(np.max(np.abs(mst_single - mst_loop)) / escala)
+
+        self.stdout.write(f"N={N}, fs={fs} Hz, mejor de {repeticiones} repeticiones")
+        self.stdout.write(f"  Bucle por fila:                 {t_loop:.4f} s")
+        self.stdout.write(f"  Construcción del banco:         {t_banco:.4f} s (una vez por (N, fs, p, alpha))")
+        self.stdout.write(f"  Vectorizada con banco:          {t_vect:.4f} s")
+        self.stdout.write(f"  Vectorizada, precisión simple:  {t_single:.4f} s")
+        self.stdout.write(f"  Aceleración (banco ya construido): {t_loop / t_vect:.1f}x doble, {t_loop / t_single:.1f}x simple")
+        self.stdout.write(f"  Error relativo máximo (doble):  {error_rel:.3e}")
+        self.stdout.write(f"  Error relativo máximo (simple): {error_rel_single:.3e}")
+        if error_rel < 1e-6:
+            self.stdout.write(self.style.SUCCESS('Resultados equivalentes a la versión con bucle (precisión complex64).'))
+        else:
+            self.stdout.write(self.style.ERROR('Los resultados difieren de la versión con bucle.'))
+        if error_rel_single < 1e-5:
+            self.stdout.write(self.style.SUCCESS('La ruta en precisión simple está dentro de la tolerancia (1e-5).'))
+        else:
+            self.stdout.write(self.style.ERROR('La ruta en precisión simple excede la tolerancia (1e-5).'))
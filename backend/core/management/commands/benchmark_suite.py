@@ -0,0 +1,47 @@
+# core/management/commands/benchmark_suite.py
+
+import json
+from django.core.management.base import BaseCommand
+from core.analysis.benchmark import run_benchmark_suite
+from core.analysis.synthetic import EVENT_TYPES
+
+class Command(BaseCommand):
+    help = ('Ejecuta la suite de benchmarks de la MST y la serialización con eventos sintéticos '
+            '(hueco, sobretensión, armónicos, transitorio, interrupción, muesca) y guarda los resultados en JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--eventos', nargs='+', choices=EVENT_TYPES, default=list(EVENT_TYPES),
+                            help='Tipos de evento sintético a medir')
+        parser.add_argument('--repeticiones', type=int, default=3, help='Repeticiones por variante')
+        parser.add_argument('--incluir-bucle', action='store_true',
+                            help='Incluye la implementación original con bucle por fila (lenta)')
+        parser.add_argument('--sin-lote', action='store_true', help='Omite la variante por lotes')
+        parser.add_argument('--sin-serializacion', action='store_true', help='Omite las variantes de serialización')
+        parser.add_argument('--escalamiento', action='store_true',
+                            help='Mide la MST con 1, 2, 4, ... hilos: un hilo por bloque frente a workers= de scipy.fft')
+        parser.add_argument('--salida', default='benchmark_resultados.json', help='Archivo JSON de resultados')
+
+    def handle(self, *args, **options):
+        reporte = run_benchmark_suite(
+            event_types=options['eventos'],
+            repeats=options['repeticiones'],
+            include_loop=options['incluir_bucle'],
+            include_batch=not options['sin_lote'],
+            include_serialization=not options['sin_serializacion'],
+            include_scaling=options['escalamiento'],
+            progress=lambda mensaje: self.stdout.write(self.style.NOTICE(mensaje)),
+        )
+
+        self.stdout.write(f"{'evento':<24}{'variante':<28}{'t_min (s)':>11}{'pico (MB)':>11}{'salida (MB)':>13}"
+                          f"{'err. rel.':>11}{'acel.':>8}")
+        for r in reporte['resultados']:
+            error = f"{r['error_relativo_max']:.1e}" if r['error_relativo_max'] is not None else '-'
+            aceleracion = f"{r['aceleracion']:.2f}x" if 'aceleracion' in r else '-'
+            self.stdout.write(
+                f"{r['evento']:<24}{r['variante']:<28}{r['tiempo_min_s']:>11.4f}{r['pico_memoria_mb']:>11.1f}"
+                f"{r['tamano_salida_bytes'] / 1e6:>13.2f}{error:>11}{aceleracion:>8}"
+            )
+
+        with open(options['salida'], 'w', encoding='utf-8') as f:
+            json.dump(reporte, f, indent=2, ensure_ascii=False)
+        self.stdout.write(self.style.SUCCESS(f"Resultados guardados en {options['salida']}"))
@@ -0,0 +1,88 @@
+# core/management/commands/empaquetar_capturas.py
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from core.influx_client import influx_service, encode_packed_samples
+
+class Command(BaseCommand):
+    help = ('Convierte las capturas guardadas en InfluxDB como un punto por muestra al formato '
+            'empaquetado (un registro por captura). Opcionalmente borra los puntos originales')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--desde', help='Inicio de la ventana (ISO 8601, p. ej. 2025-10-01)')
+        parser.add_argument('--hasta', help='Fin de la ventana (ISO 8601)')
+        parser.add_argument('--event-ids', nargs='+', default=None, help='event_id a convertir (en lugar de una ventana)')
+        parser.add_argument('--lote', type=int, default=200, help='Eventos por consulta/escritura')
+        parser.add_argument('--borrar-puntos', action='store_true',
+                            help='Borra los puntos individuales después de escribir y verificar la captura empaquetada')
+        parser.add_argument('--dry-run', action='store_true', help='Solo muestra cuántos eventos se convertirían')
+
+    def handle(self, *args, **options):
+        if options['event_ids']:
+            event_ids = options['event_ids']
+        elif options['desde'] and options['hasta']:
+            start_ns = pd.Timestamp(options['desde'], tz='UTC').value
+            stop_ns = pd.Timestamp(options['hasta'], tz='UTC').value
+            event_ids = influx_service.list_event_ids(start_ns, stop_ns)
+        else:
+            raise CommandError("Indique --event-ids o una ventana con --desde y --hasta.")
+
+        self.stdout.write(self.style.NOTICE(f"{len(event_ids)} eventos con puntos individuales en el rango."))
+        if options['dry_run']:
+            return
+
+        convertidos = omitidos = errores = 0
+        for i in range(0, len(event_ids), options['lote']):
+            lote = event_ids[i:i + options['lote']]
+            start_ns, stop_ns = influx_service.events_window(lote)
+
+            ya_empaquetados = influx_service.get_packed_captures(lote, start_ns, stop_ns)
+            pendientes = [e for e in lote if e not in ya_empaquetados]
+            omitidos += len(lote) - len(pendientes)
+            if not pendientes:
+                continue
+            puntos = influx_service.get_point_captures(pendientes, start_ns, stop_ns)
+            tags = influx_service.get_event_tags(pendientes, start_ns, stop_ns)
+
+            capturas = []
+            for event_id in pendientes:
+                if event_id not in puntos:
+                    errores += 1
+                    self.stdout.write(self.style.ERROR(f"  {event_id}: sin puntos"))
+                    continue
+                timestamps, valores = puntos[event_id]
+                try:
+                    encode_packed_samples(valores)  # Valida que se pueda empaquetar sin pérdidas
+                except ValueError as e:
+                    errores += 1
+                    self.stdout.write(self.style.ERROR(f"  {event_id}: {e}"))
+                    continue
+                ns = timestamps.astype(np.int64)
+                periodo = int(np.median(np.diff(ns))) if len(ns) > 1 else settings.CAPTURE_SAMPLING_PERIOD_NS
+                capturas.append({
+                    'event_id': event_id,
+                    'samples': valores.astype(np.uint16),
+                    'start_ns': int(ns[0]),
+                    'sampling_period_ns': periodo,
+                    **tags.get(event_id, {}),
+                })
+            influx_service.write_captures(capturas, mode='packed')
+
+            if options['borrar_puntos'] and capturas:
+                verificados = influx_service.get_packed_captures([c['event_id'] for c in capturas], start_ns, stop_ns)
+                for captura in capturas:
+                    event_id = captura['event_id']
+                    if event_id not in verificados or not np.array_equal(verificados[event_id][1], puntos[event_id][1]):
+                        errores += 1
+                        self.stdout.write(self.style.ERROR(f"  {event_id}: la captura empaquetada no coincide; se conservan los puntos"))
+                        continue
+                    timestamps = puntos[event_id][0].astype(np.int64)
+                    influx_service.delete_points(event_id, int(timestamps[0]), int(timestamps[-1]) + 1)
+            convertidos += len(capturas)
+            self.stdout.write(f"  Lote {i // options['lote'] + 1}: {len(capturas)} capturas empaquetadas")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Convertidos: {convertidos}, ya empaquetados: {omitidos}, errores: {errores}."
+        ))
@@ -0,0 +1,41 @@
+# core/management/commands/gateway_ingesta.py
+
+import asyncio
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from core.ingestion import IngestionGateway
+
+class Command(BaseCommand):
+    help = ('Inicia el gateway de ingesta que recibe las tramas crudas del STM32 (reenviadas por el ESP32) '
+            'por TCP y HTTP y las guarda en InfluxDB por lotes')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default=settings.INGESTION_HOST)
+        parser.add_argument('--puerto-tcp', type=int, default=settings.INGESTION_TCP_PORT)
+        parser.add_argument('--puerto-http', type=int, default=settings.INGESTION_HTTP_PORT)
+        parser.add_argument('--cola', type=int, default=settings.INGESTION_QUEUE_MAX_FRAMES,
+                            help='Tramas máximas en espera; al llenarse se frena a los equipos')
+        parser.add_argument('--lote', type=int, default=settings.INGESTION_BATCH_SIZE, help='Capturas por escritura')
+        parser.add_argument('--intervalo', type=float, default=settings.INGESTION_FLUSH_INTERVAL_S,
+                            help='Espera máxima (s) antes de escribir un lote incompleto')
+        parser.add_argument('--escritores', type=int, default=settings.INGESTION_WRITERS,
+                            help='Escrituras a InfluxDB en paralelo')
+        parser.add_argument('--reporte', type=float, default=10.0, help='Intervalo (s) del resumen en consola; 0 lo desactiva')
+
+    def handle(self, *args, **options):
+        gateway = IngestionGateway(
+            queue_size=options['cola'],
+            batch_size=options['lote'],
+            flush_interval=options['intervalo'],
+            writers=options['escritores'],
+            location=settings.INGESTION_DEFAULT_LOCATION,
+        )
+        self.stdout.write(self.style.NOTICE(
+            f"Gateway de ingesta en {options['host']} (TCP {options['puerto_tcp']}, HTTP {options['puerto_http']})"
+        ))
+        try:
+            asyncio.run(gateway.serve(options['host'], options['puerto_tcp'], options['puerto_http'],
+                                      report_interval=options['reporte']))
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f"Gateway detenido. {gateway.get_stats()}"))
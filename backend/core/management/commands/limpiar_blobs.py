@@ -0,0 +1,44 @@
+# core/management/commands/limpiar_blobs.py
+
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from core.blobstore import get_blob_store
+from core.spectrogram_storage import referenced_blob_refs
+
+class Command(BaseCommand):
+    help = ('Borra del almacén de blobs los arreglos que ya no referencia ningún Espectrograma: los de filas '
+            'borradas o reprocesadas y los de transacciones que no se confirmaron')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--antiguedad', type=int, default=None,
+                            help='Edad mínima en segundos de un arreglo para borrarlo '
+                                 '(por defecto settings.SPECTROGRAM_BLOB_GC_MIN_AGE_S)')
+        parser.add_argument('--dry-run', action='store_true', help='Solo muestra cuántos arreglos se borrarían')
+
+    def handle(self, *args, **options):
+        store = get_blob_store()
+        if store is None:
+            raise CommandError("settings.SPECTROGRAM_STORAGE no está configurado.")
+        antiguedad = options['antiguedad']
+        if antiguedad is None:
+            antiguedad = settings.SPECTROGRAM_BLOB_GC_MIN_AGE_S
+        limite = time.time() - antiguedad
+
+        # Las referencias se leen antes de listar el almacén: lo que se guarde después es más
+        # reciente que el límite, y volver a guardar un contenido existente renueva su fecha
+        en_uso = referenced_blob_refs()
+        huerfanos = [ref for ref, fecha in store.list_refs() if ref not in en_uso and fecha < limite]
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(
+                f"Dry-run: se borrarían {len(huerfanos)} arreglos ({len(en_uso)} referenciados)."))
+            return
+
+        borrados = 0
+        for ref in huerfanos:
+            fecha = store.modified_at(ref)
+            if fecha is None or fecha >= limite:  # Otra tarea lo volvió a guardar mientras tanto
+                continue
+            store.delete(ref)
+            borrados += 1
+        self.stdout.write(self.style.SUCCESS(f"Borrados: {borrados} arreglos sin referencias."))
@@ -0,0 +1,87 @@
+# core/management/commands/migrar_espectrogramas.py
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from core.models import Espectrograma
+from core.spectrogram_format import (
+    ENCODINGS, FORMAT_NAME, available_codecs, decode_spectrogram, encode_spectrogram, is_compact_format
+)
+
+class Command(BaseCommand):
+    help = ('Reescribe los espectrogramas guardados con pickle (o con otra codificación) '
+            'en el formato binario compacto')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--encoding', choices=ENCODINGS, default='complex64',
+                            help="Codificación destino. Por defecto 'complex64', sin pérdidas; las demás "
+                                 "guardan solo la magnitud y descartan la fase de forma irreversible")
+        parser.add_argument('--codec', default=None, help=f'Códec de compresión ({", ".join(available_codecs())})')
+        parser.add_argument('--recodificar', action='store_true',
+                            help='Reescribe también las filas que ya están en formato compacto con otra codificación')
+        parser.add_argument('--limite', type=int, default=None, help='Número máximo de filas a migrar')
+        parser.add_argument('--dry-run', action='store_true', help='Solo muestra cuántas filas se migrarían')
+
+    def handle(self, *args, **options):
+        encoding = options['encoding']
+        codec = options['codec'] or settings.SPECTROGRAM_CODEC
+        if codec and codec not in available_codecs():
+            raise CommandError(f"Códec '{codec}' no disponible. Disponibles: {available_codecs()}")
+
+        if encoding != 'complex64':
+            self.stdout.write(self.style.WARNING(
+                f"'{encoding}' guarda solo la magnitud: la fase de los espectrogramas migrados se pierde."))
+
+        # Solo se recorren las PK: cada blob se carga de uno en uno para no agotar la memoria.
+        # Los que ya están en el almacén de blobs no se tocan (ver mover_espectrogramas_a_blobs).
+        # Las ya migradas se descartan antes de aplicar --limite, para que cada corrida avance.
+        en_linea = Espectrograma.objects.filter(blob_ref__isnull=True)
+        ya_migradas = en_linea.filter(metadata_json__format=FORMAT_NAME)
+        if options['recodificar']:
+            ya_migradas = ya_migradas.filter(metadata_json__encoding=encoding)
+        ya_migradas = set(ya_migradas.values_list('pk', flat=True))
+        pks = [pk for pk in en_linea.order_by('pk').values_list('pk', flat=True) if pk not in ya_migradas]
+        if options['limite']:
+            pks = pks[:options['limite']]
+        self.stdout.write(self.style.NOTICE(
+            f"Migrando {len(pks)} espectrogramas ({len(ya_migradas)} ya migrados; codificación destino: {encoding})..."))
+
+        migrados = errores = bytes_antes = bytes_despues = 0
+        omitidos = len(ya_migradas)
+        for pk in pks:
+            metadata = Espectrograma.objects.filter(pk=pk).values_list('metadata_json', flat=True).first()
+            if is_compact_format(metadata) and (not options['recodificar'] or metadata.get('encoding') == encoding):
+                omitidos += 1
+                continue
+            if is_compact_format(metadata) and metadata.get('encoding') != 'complex64' and encoding == 'complex64':
+                # La fase ya se perdió: pasarlo a complex64 solo etiquetaría la magnitud como compleja
+                omitidos += 1
+                self.stdout.write(self.style.WARNING(
+                    f"  Muestra {pk}: está en '{metadata.get('encoding')}' (solo magnitud); no se convierte a complex64."))
+                continue
+            if options['dry_run']:
+                migrados += 1
+                continue
+            try:
+                with transaction.atomic():
+                    espectrograma = Espectrograma.objects.select_for_update().get(pk=pk)
+                    data = bytes(espectrograma.data_espectrograma)
+                    matriz = decode_spectrogram(data, espectrograma.metadata_json)
+                    nuevo_blob, header = encode_spectrogram(
+                        matriz, encoding=encoding, codec=codec, db_range=settings.SPECTROGRAM_DB_RANGE)
+                    Espectrograma.objects.filter(pk=pk).update(data_espectrograma=nuevo_blob, metadata_json=header)
+                migrados += 1
+                bytes_antes += len(data)
+                bytes_despues += len(nuevo_blob)
+                self.stdout.write(f"  Muestra {pk}: {len(data) / 1e6:.2f} MB -> {len(nuevo_blob) / 1e6:.2f} MB")
+            except Exception as e:
+                errores += 1
+                self.stdout.write(self.style.ERROR(f"  Muestra {pk}: error al migrar ({e})"))
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(f"Dry-run: se migrarían {migrados} filas ({omitidos} ya migradas)."))
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"Migrados: {migrados}, omitidos: {omitidos}, errores: {errores}. "
+            f"Tamaño total: {bytes_antes / 1e6:.2f} MB -> {bytes_despues / 1e6:.2f} MB"
+        ))
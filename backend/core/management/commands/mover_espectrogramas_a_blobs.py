@@ -0,0 +1,58 @@
+# core/management/commands/mover_espectrogramas_a_blobs.py
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from core.analysis.stockwell import MST_FS
+from core.blobstore import get_blob_store
+from core.models import Espectrograma
+from core.spectrogram_format import decode_array, decode_spectrogram, is_compact_format, read_stored_array
+from core.spectrogram_storage import pyramid_fields, spectrogram_fields, stored_blob_fields
+
+class Command(BaseCommand):
+    help = ('Mueve los espectrogramas guardados en línea (BYTEA) al almacén de blobs configurado '
+            'en settings.SPECTROGRAM_STORAGE, dejando en la tabla solo la referencia, y genera su pirámide de teselas')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limite', type=int, default=None, help='Número máximo de filas a mover')
+        parser.add_argument('--dry-run', action='store_true', help='Solo muestra cuántas filas se moverían')
+
+    def handle(self, *args, **options):
+        store = get_blob_store()
+        if store is None:
+            raise CommandError("settings.SPECTROGRAM_STORAGE no está configurado.")
+
+        # Solo se recorren las PK: cada fila se carga de una en una para no agotar la memoria
+        pks = list(Espectrograma.objects.filter(blob_ref__isnull=True).order_by('pk').values_list('pk', flat=True))
+        if options['limite']:
+            pks = pks[:options['limite']]
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(f"Dry-run: se moverían {len(pks)} espectrogramas."))
+            return
+        self.stdout.write(self.style.NOTICE(f"Moviendo {len(pks)} espectrogramas a {type(store).__name__}..."))
+
+        movidos = errores = 0
+        for pk in pks:
+            try:
+                with transaction.atomic():
+                    espectrograma = Espectrograma.objects.select_for_update().get(pk=pk)
+                    header = espectrograma.metadata_json
+                    if is_compact_format(header):
+                        # Se mueve el arreglo codificado tal cual: conserva su codificación y no se
+                        # recuantiza (una fila en magnitud nunca pasa a etiquetarse como complex64)
+                        stored = read_stored_array(espectrograma.data_espectrograma, header)
+                        campos = stored_blob_fields(stored, header, store)
+                        matriz = decode_array(stored, header)
+                    else:
+                        # Pickle legado: la matriz es complex64 y se guarda sin pérdidas. Para
+                        # cambiar la codificación está migrar_espectrogramas --recodificar
+                        matriz = decode_spectrogram(espectrograma.data_espectrograma, header)
+                        campos = spectrogram_fields(matriz, store=store, encoding='complex64')
+                    campos.update(pyramid_fields(matriz, MST_FS, store=store))
+                    Espectrograma.objects.filter(pk=pk).update(**campos)
+                movidos += 1
+                self.stdout.write(f"  Muestra {pk}: {campos['blob_ref']}")
+            except Exception as e:
+                errores += 1
+                self.stdout.write(self.style.ERROR(f"  Muestra {pk}: error al mover ({e})"))
+
+        self.stdout.write(self.style.SUCCESS(f"Movidos: {movidos}, errores: {errores}."))
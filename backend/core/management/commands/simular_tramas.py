@@ -0,0 +1,82 @@
+# core/management/commands/simular_tramas.py
+
+import asyncio
+import json
+import time
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from core.analysis.synthetic import EVENT_TYPES, generate_event
+from core.capture_frames import build_frame
+
+class Command(BaseCommand):
+    help = ('Simula varios equipos que envían tramas crudas del STM32 al gateway de ingesta '
+            '(TCP o HTTP) y mide la tasa sostenida')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--puerto', type=int, default=None, help='Por defecto el puerto TCP o HTTP de settings')
+        parser.add_argument('--http', action='store_true', help='Envía por POST /frames en lugar de TCP')
+        parser.add_argument('--dispositivos', type=int, default=20, help='Equipos simulados en paralelo')
+        parser.add_argument('--tramas', type=int, default=100, help='Tramas por equipo')
+        parser.add_argument('--tasa', type=float, default=0.0, help='Tramas/s por equipo; 0 = lo más rápido posible')
+        parser.add_argument('--corruptas', type=float, default=0.0, help='Fracción de tramas con checksum alterado')
+
+    def handle(self, *args, **options):
+        puerto = options['puerto'] or (settings.INGESTION_HTTP_PORT if options['http'] else settings.INGESTION_TCP_PORT)
+        # Un juego de tramas por tipo de evento, reutilizado por todos los equipos
+        tramas = [build_frame(generate_event(tipo, seed=i)) for i, tipo in enumerate(EVENT_TYPES)]
+        enviar = self._enviar_http if options['http'] else self._enviar_tcp
+
+        async def simular():
+            rng = np.random.default_rng(0)
+            inicio = time.perf_counter()
+            enviadas = await asyncio.gather(*(
+                enviar(options['host'], puerto, f"SIM_{n:03d}", tramas, options, rng)
+                for n in range(options['dispositivos'])
+            ))
+            return sum(enviadas), time.perf_counter() - inicio
+
+        total, duracion = asyncio.run(simular())
+        self.stdout.write(self.style.SUCCESS(
+            f"{total} tramas enviadas en {duracion:.2f} s ({total / duracion:.1f} tramas/s, "
+            f"{total * len(tramas[0]) / duracion / 1024 ** 2:.1f} MB/s) desde {options['dispositivos']} equipos."
+        ))
+
+    @staticmethod
+    def _trama(tramas, i, options, rng):
+        trama = tramas[i % len(tramas)]
+        if options['corruptas'] and rng.random() < options['corruptas']:
+            trama = trama[:-2] + bytes([trama[-2] ^ 0xFF, trama[-1]])
+        return trama
+
+    async def _enviar_tcp(self, host, puerto, device_id, tramas, options, rng):
+        reader, writer = await asyncio.open_connection(host, puerto)
+        writer.write(f"DEVICE {device_id} Laboratorio_A\n".encode('ascii'))
+        for i in range(options['tramas']):
+            writer.write(self._trama(tramas, i, options, rng))
+            await writer.drain()  # Se bloquea cuando el gateway aplica contrapresión
+            if options['tasa']:
+                await asyncio.sleep(1 / options['tasa'])
+        writer.close()
+        await writer.wait_closed()
+        return options['tramas']
+
+    async def _enviar_http(self, host, puerto, device_id, tramas, options, rng):
+        reader, writer = await asyncio.open_connection(host, puerto)
+        for i in range(options['tramas']):
+            body = self._trama(tramas, i, options, rng)
+            writer.write(
+                f"POST /frames HTTP/1.1\r\nHost: {host}\r\nX-Device-Id: {device_id}\r\n"
+                f"Content-Type: application/octet-stream\r\nContent-Length: {len(body)}\r\n\r\n".encode('latin-1')
+                + body)
+            await writer.drain()
+            head = await reader.readuntil(b'\r\n\r\n')
+            length = next(int(line.split(b':', 1)[1]) for line in head.split(b'\r\n')
+                          if line.lower().startswith(b'content-length'))
+            json.loads(await reader.readexactly(length))
+            if options['tasa']:
+                await asyncio.sleep(1 / options['tasa'])
+        writer.close()
+        await writer.wait_closed()
+        return options['tramas']
@@ -0,0 +1,231 @@
+# core/metrics.py
+
+"""
+Métricas por etapa del pipeline de procesamiento (captura, normalización, MST,
+características, serialización y cada escritura en PostgreSQL).
+
+Cada etapa medida con `medir` deja:
+- Contadores e histogramas con el formato de texto de Prometheus, servidos en
+  /metrics: duración, bytes manejados, memoria pico (solo donde se pide) y
+  errores, con la etiqueta `etapa`; y Muestras terminadas por resultado.
+- Un registro JSON por etapa en el logger 'core.metricas', con la Muestra o
+  el tramo al que corresponde.
+
+Los valores se acumulan en un hash de Redis (por defecto el de
+CELERY_BROKER_URL) para que /metrics sume lo de todos los workers; sin Redis
+quedan solo en la memoria del proceso.
+"""
+
+import json
+import logging
+import math
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import redis
+except ImportError:  # Dependencia opcional: sin ella las métricas son locales al proceso
+    redis = None
+
+logger = logging.getLogger('core.metricas')
+
+# Solo un bloque a la vez puede encender y apagar tracemalloc en el proceso
+_traza_lock = threading.Lock()
+
+_REDIS_KEY = 'pqs:metrics'
+_REDIS_RETRY_S = 30 # Tras un error de conexión, Redis se omite durante este tiempo
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BYTES_BUCKETS = tuple(1024 * 4 ** i for i in range(11))  # 1 KiB .. 1 GiB
+
+# nombre -> (tipo, ayuda, límites de los buckets si es histograma)
+CATALOGO = {
+    'pqs_etapa_duracion_segundos': ('histogram', 'Duración de cada etapa del procesamiento.', DURATION_BUCKETS),
+    'pqs_etapa_bytes': ('histogram', 'Bytes de la carga manejada en cada etapa.', BYTES_BUCKETS),
+    'pqs_etapa_memoria_pico_bytes': ('histogram', 'Memoria pico asignada durante la etapa (tracemalloc).',
+                                     BYTES_BUCKETS),
+    'pqs_etapa_errores_total': ('counter', 'Etapas terminadas con una excepción.', None),
+    'pqs_muestras_total': ('counter', 'Muestras terminadas por resultado.', None),
+}
+
+
+def _etiquetas(labels):
+    return ','.join(f'{k}="{_escapar(v)}"' for k, v in sorted(labels.items()))
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _numero(valor):
+    return str(int(valor)) if float(valor).is_integer() else repr(float(valor))
+
+
+class Metrics:
+    """
+    Registro de contadores e histogramas. Los campos se guardan como
+    'nombre|etiquetas|sufijo' (sufijo: vacío en contadores; 'le=x', 'sum' o
+    'count' en histogramas, con buckets no acumulados que se suman al generar
+    el texto).
+    """
+
+    def __init__(self, redis_url=None, trace_memory=False):
+        self._valores = {}
+        self._lock = threading.Lock()
+        self._redis = None
+        self._redis_retry_at = 0.0
+        self.redis_url = redis_url
+        self.trace_memory = trace_memory
+
+    def configure(self, redis_url=None, trace_memory=None):
+        """Ajusta la URL de Redis (cadena vacía la desactiva) y si se mide la memoria pico."""
+        with self._lock:
+            if redis_url is not None:
+                self.redis_url = redis_url or None
+                self._redis = None
+            if trace_memory is not None:
+                self.trace_memory = trace_memory
+            self._valores.clear()
+
+    @property
+    def redis(self):
+        if not self.redis_url or redis is None or time.monotonic() < self._redis_retry_at:
+            return None
+        if self._redis is None:
+            self._redis = redis.Redis.from_url(self.redis_url, socket_timeout=1, socket_connect_timeout=1)
+        return self._redis
+
+    def _redis_failed(self, error, action):
+        print(f"Advertencia: métricas en Redis no disponibles al {action} ({error}); "
+              f"se reintentará en {_REDIS_RETRY_S} s.")
+        self._redis_retry_at = time.monotonic() + _REDIS_RETRY_S
+
+    def _sumar(self, incrementos):
+        with self._lock:
+            for campo, valor in incrementos.items():
+                self._valores[campo] = self._valores.get(campo, 0.0) + valor
+        client = self.redis
+        if client is not None:
+            try:
+                pipe = client.pipeline(transaction=False)
+                for campo, valor in incrementos.items():
+                    pipe.hincrbyfloat(_REDIS_KEY, campo, valor)
+                pipe.execute()
+            except redis.RedisError as e:
+                self._redis_failed(e, 'escribir')
+
+    def inc(self, name, value=1, **labels):
+        """Suma `value` al contador `name`."""
+        self._sumar({f"{name}|{_etiquetas(labels)}|": value})
+
+    def observe(self, name, value, **labels):
+        """Registra una observación en el histograma `name`."""
+        buckets = CATALOGO[name][2]
+        le = next((b for b in buckets if value <= b), math.inf)
+        prefijo = f"{name}|{_etiquetas(labels)}|"
+        self._sumar({prefijo + f"le={le}": 1, prefijo + 'sum': value, prefijo + 'count': 1})
+
+    def values(self):
+        """Valores acumulados: los de Redis (todos los workers) si está disponible, si no los locales."""
+        client = self.redis
+        if client is not None:
+            try:
+                return {k.decode(): float(v) for k, v in client.hgetall(_REDIS_KEY).items()}
+            except redis.RedisError as e:
+                self._redis_failed(e, 'leer')
+        with self._lock:
+            return dict(self._valores)
+
+    def reset(self):
+        """Borra las métricas acumuladas (locales y de Redis)."""
+        with self._lock:
+            self._valores.clear()
+        client = self.redis
+        if client is not None:
+            try:
+                client.delete(_REDIS_KEY)
+            except redis.RedisError as e:
+                self._redis_failed(e, 'borrar')
+
+    def render(self):
+        """Texto de exposición de Prometheus (versión 0.0.4)."""
+        series = {}
+        for campo, valor in self.values().items():
+            name, labels, sufijo = campo.split('|', 2)
+            series.setdefault(name, {}).setdefault(labels, {})[sufijo] = valor
+
+        lineas = []
+        for name, (tipo, ayuda, buckets) in CATALOGO.items():
+            lineas.append(f"# HELP {name} {ayuda}")
+            lineas.append(f"# TYPE {name} {tipo}")
+            for labels, valores in sorted(series.get(name, {}).items()):
+                if tipo == 'counter':
+                    lineas.append(f"{name}{{{labels}}} {_numero(valores.get('', 0))}")
+                    continue
+                acumulado = 0.0
+                for le in (*buckets, math.inf):
+                    acumulado += valores.get(f"le={le}", 0.0)
+                    etiqueta = '+Inf' if le == math.inf else _numero(le)
+                    sep = ',' if labels else ''
+                    lineas.append(f'{name}_bucket{{{labels}{sep}le="{etiqueta}"}} {_numero(acumulado)}')
+                lineas.append(f"{name}_sum{{{labels}}} {_numero(valores.get('sum', 0))}")
+                lineas.append(f"{name}_count{{{labels}}} {_numero(valores.get('count', 0))}")
+        return '\n'.join(lineas) + '\n'
+
+
+metrics = Metrics()
+
+
+def registrar_etapa(etapa, duracion_s, ok=True, bytes=None, memoria_pico=None, **contexto):
+    """Registra una etapa ya medida: métricas y una línea JSON en el logger 'core.metricas'."""
+    metrics.observe('pqs_etapa_duracion_segundos', duracion_s, etapa=etapa)
+    if bytes is not None:
+        metrics.observe('pqs_etapa_bytes', bytes, etapa=etapa)
+    if memoria_pico is not None:
+        metrics.observe('pqs_etapa_memoria_pico_bytes', memoria_pico, etapa=etapa)
+    if not ok:
+        metrics.inc('pqs_etapa_errores_total', etapa=etapa)
+    logger.info(json.dumps({
+        'evento': 'etapa', 'etapa': etapa, 'duracion_s': round(duracion_s, 6), 'bytes': bytes,
+        'memoria_pico_bytes': memoria_pico, 'ok': ok, **contexto,
+    }, default=str))
+
+
+@contextmanager
+def medir(etapa, memoria=False, **contexto):
+    """
+    Mide el bloque como la etapa `etapa`. Entrega un diccionario donde el bloque
+    puede dejar 'bytes' (tamaño de la carga manejada) y 'duracion_s', si una
+    parte del bloque se registra aparte como otra etapa. Con `memoria=True` y
+    settings.METRICS_TRACE_MEMORY se mide además la memoria pico con
+    tracemalloc, lo que encarece las asignaciones mientras dura el bloque.
+    `contexto` (p. ej. muestra_id) solo va al registro JSON.
+
+    tracemalloc es global al proceso: solo lo enciende un bloque a la vez (los
+    demás se registran sin memoria), y aun así el pico incluye lo que asignen otros hilos mientras dura
+    el bloque, por lo que solo es fiable en workers prefork.
+    """
+    registro = {'bytes': None, 'duracion_s': None}
+    trazar = memoria and metrics.trace_memory and _traza_lock.acquire(blocking=False)
+    if trazar and tracemalloc.is_tracing():  # Lo usa otro código del proceso; no se toca
+        _traza_lock.release()
+        trazar = False
+    if trazar:
+        tracemalloc.start()
+    ok = True
+    inicio = time.perf_counter()
+    try:
+        yield registro
+    except BaseException:
+        ok = False
+        raise
+    finally:
+        duracion = registro['duracion_s'] if registro['duracion_s'] is not None else time.perf_counter() - inicio
+        pico = None
+        if trazar:
+            pico = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            _traza_lock.release()
+        registrar_etapa(etapa, duracion, ok=ok, bytes=registro['bytes'], memoria_pico=pico, **contexto)
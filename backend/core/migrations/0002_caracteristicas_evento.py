@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CaracteristicasEvento',
+            fields=[
+                ('muestra', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='caracteristicas', serialize=False, to='core.muestra')),
+                ('version', models.PositiveSmallIntegerField()),
+                ('vector', models.JSONField()),
+                ('nombres', models.JSONField()),
+                ('thd', models.FloatField(blank=True, null=True)),
+                ('tiempo_desviacion_max_s', models.FloatField(blank=True, null=True)),
+                ('desviacion_max_relativa', models.FloatField(blank=True, null=True)),
+                ('fecha_calculo', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'caracteristicas_eventos',
+                'indexes': [models.Index(fields=['thd'], name='idx_caract_thd'), models.Index(fields=['desviacion_max_relativa'], name='idx_caract_desv_max')],
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_caracteristicas_evento'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='espectrograma',
+            name='blob_ref',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='espectrograma',
+            name='checksum',
+            field=models.CharField(blank=True, max_length=80, null=True),
+        ),
+        migrations.AddField(
+            model_name='espectrograma',
+            name='dtype',
+            field=models.CharField(blank=True, max_length=16, null=True),
+        ),
+        migrations.AddField(
+            model_name='espectrograma',
+            name='shape',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='espectrograma',
+            name='data_espectrograma',
+            field=models.BinaryField(null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_espectrograma_blob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='espectrograma',
+            name='piramide',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:36
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_espectrograma_piramide'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrabajoProcesamiento',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('filtros', models.JSONField()),
+                ('muestra_ids', models.JSONField()),
+                ('total', models.IntegerField()),
+                ('tramos', models.IntegerField()),
+                ('resumen', models.JSONField(blank=True, null=True)),
+                ('fecha_inicio', models.DateTimeField(auto_now_add=True)),
+                ('fecha_fin', models.DateTimeField(blank=True, null=True)),
+                ('usuario_creacion', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'trabajos_procesamiento',
+            },
+        ),
+    ]
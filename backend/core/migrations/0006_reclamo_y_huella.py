@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_trabajo_procesamiento'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='espectrograma',
+            name='huella',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='muestra',
+            name='reclamo_expira',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='muestra',
+            name='reclamo_token',
+            field=models.UUIDField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='muestra',
+            name='estado_procesamiento',
+            field=models.CharField(choices=[('pendiente', 'Pendiente'), ('en_proceso', 'En Proceso'), ('procesado', 'Procesado'), ('error', 'Error')], default='pendiente', max_length=20),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_reclamo_y_huella'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trabajoprocesamiento',
+            name='errores',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='trabajoprocesamiento',
+            name='fallidas',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='trabajoprocesamiento',
+            name='hechas',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='trabajoprocesamiento',
+            name='omitidas',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='trabajoprocesamiento',
+            name='tramos_terminados',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_trabajo_avance'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='muestra',
+            name='lote_ingesta',
+            field=models.UUIDField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -1,3 +1,4 @@
+import uuid
 from django.db import models
 from django.contrib.auth.models import AbstractUser # Usaremos el modelo de User de Django para Usuarios
 
@@ -47,10 +48,15 @@ class Muestra(models.Model):
     origen_hardware = models.CharField(max_length=50, blank=True, null=True) # blank=True permite que sea vacío en formularios
     estado_procesamiento_choices = [
         ('pendiente', 'Pendiente'),
+        ('en_proceso', 'En Proceso'),
         ('procesado', 'Procesado'),
         ('error', 'Error'),
     ]
     estado_procesamiento = models.CharField(max_length=20, choices=estado_procesamiento_choices, default='pendiente', null=False)
+    # Reclamo de la muestra por un worker mientras está 'en_proceso' (ver core/tasks.py, reclamar_muestras)
+    reclamo_token = models.UUIDField(null=True, blank=True)
+    reclamo_expira = models.DateTimeField(null=True, blank=True) # Pasado este instante otro worker puede reclamarla
+    lote_ingesta = models.UUIDField(null=True, blank=True, editable=False) # Inserción masiva del gateway que creó la fila (ver core/ingestion.py)
     fecha_procesamiento = models.DateTimeField(null=True, blank=True) # null=True y blank=True para campos opcionales
     fecha_creacion = models.DateTimeField(auto_now_add=True) # Se establece automáticamente al crear el objeto
     usuario_creacion = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True) # Si el usuario se borra, el campo se pone a NULL
@@ -69,8 +75,14 @@ class Muestra(models.Model):
 
 class Espectrograma(models.Model):
     muestra = models.OneToOneField(Muestra, on_delete=models.CASCADE, primary_key=True) # OneToOneField implica que el ID de la Muestra es la PK aquí
-    data_espectrograma = models.BinaryField(null=False) # BYTEA en PostgreSQL
+    data_espectrograma = models.BinaryField(null=True) # BYTEA en PostgreSQL; vacío si está en el almacén de blobs
     metadata_json = models.JSONField(null=True, blank=True) # JSONB en PostgreSQL
+    blob_ref = models.CharField(max_length=255, null=True, blank=True) # Referencia en el almacén de blobs (core/blobstore.py)
+    shape = models.JSONField(null=True, blank=True) # Forma del arreglo guardado
+    dtype = models.CharField(max_length=16, null=True, blank=True) # dtype del arreglo guardado (p. ej. '<f2')
+    checksum = models.CharField(max_length=80, null=True, blank=True) # 'sha256:<hex>' del contenido guardado
+    piramide = models.JSONField(null=True, blank=True) # Niveles de teselas de magnitud para visualización con zoom
+    huella = models.CharField(max_length=64, null=True, blank=True) # sha256 de la captura y los parámetros con que se calculó
     fecha_generacion = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -145,4 +157,50 @@ class Clasificacion(models.Model):
         ]
 
     def __str__(self):
-        return f"Clasificación para Muestra {self.muestra.event_id}: Manual={self.clase_manual}, Modelo={self.clase_modelo}"
\ No newline at end of file
+        return f"Clasificación para Muestra {self.muestra.event_id}: Manual={self.clase_manual}, Modelo={self.clase_modelo}"
+
+class CaracteristicasEvento(models.Model):
+    muestra = models.OneToOneField(Muestra, on_delete=models.CASCADE, primary_key=True, related_name='caracteristicas')
+    version = models.PositiveSmallIntegerField(null=False) # Versión del vector (core/analysis/features.py)
+    vector = models.JSONField(null=False) # Lista de floats de longitud fija (JSONB en PostgreSQL)
+    nombres = models.JSONField(null=False) # Nombre de cada posición del vector
+    # Copias de algunas características como columnas para poder filtrar y ordenar en SQL
+    thd = models.FloatField(null=True, blank=True)
+    tiempo_desviacion_max_s = models.FloatField(null=True, blank=True)
+    desviacion_max_relativa = models.FloatField(null=True, blank=True)
+    fecha_calculo = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'caracteristicas_eventos'
+        indexes = [
+            models.Index(fields=['thd'], name='idx_caract_thd'),
+            models.Index(fields=['desviacion_max_relativa'], name='idx_caract_desv_max'),
+        ]
+
+    def __str__(self):
+        return f"Características (v{self.version}) de Muestra {self.muestra.event_id}"
+
+
+class TrabajoProcesamiento(models.Model):
+    # Procesamiento masivo lanzado desde /api/muestras/process-pending/ (un grupo de tareas procesar_lote_task)
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    filtros = models.JSONField(null=False) # Filtros con los que se seleccionaron las muestras
+    muestra_ids = models.JSONField(null=False) # IDs de las muestras incluidas
+    total = models.IntegerField(null=False)
+    tramos = models.IntegerField(null=False) # Número de tareas en que se repartió
+    resumen = models.JSONField(null=True, blank=True) # Conteos y errores al terminar
+    # Avance acumulado por las tareas al terminar cada tramo (el estado se consulta sin recorrer muestra_ids)
+    hechas = models.IntegerField(default=0)
+    fallidas = models.IntegerField(default=0)
+    omitidas = models.IntegerField(default=0)
+    tramos_terminados = models.IntegerField(default=0)
+    errores = models.JSONField(default=list, blank=True) # Primeros errores (hasta 100) mientras está en curso
+    fecha_inicio = models.DateTimeField(auto_now_add=True)
+    fecha_fin = models.DateTimeField(null=True, blank=True)
+    usuario_creacion = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+
+    class Meta:
+        db_table = 'trabajos_procesamiento'
+
+    def __str__(self):
+        return f"Trabajo {self.id} ({self.total} muestras)"
@@ -0,0 +1,162 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+class RenderCache:
+    """
+    Caché de imágenes renderizadas acotada por tamaño total en bytes, con
+    desalojo del elemento usado hace más tiempo (LRU).
+
+    Si se configura un directorio, cada imagen se guarda como archivo y todos los
+    procesos del servidor en un mismo host la comparten; el orden LRU se lleva por
+    la fecha de modificación, que se actualiza en cada acierto. Sin directorio,
+    las imágenes se conservan solo en la memoria del proceso.
+
+    Con directorio, cada proceso lleva un total de bytes estimado: se obtiene
+    recorriendo el directorio la primera vez y luego se suma lo que el proceso
+    escribe. Solo cuando supera max_bytes se vuelve a recorrer (con el total
+    real, incluidos los archivos de otros procesos) y se desaloja hasta el 90 %.
+    """
+
+    _LOW_WATER = 0.9 # Fracción de max_bytes que queda tras desalojar, para no recorrer en cada escritura
+
+    def __init__(self, max_bytes=256 * 1024 ** 2, directory=None):
+        self._entries = OrderedDict()
+        self._size = 0
+        self._disk_size = None # Bytes estimados en el directorio; None hasta el primer recorrido
+        self._lock = threading.Lock()
+        self._evict_lock = threading.Lock()
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+
+    def configure(self, max_bytes=None, directory=None):
+        """Ajusta el tamaño máximo y/o el directorio de persistencia. Vacía la caché en memoria."""
+        with self._lock:
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+            if directory is not None:
+                self.directory = str(directory)
+                self._disk_size = None
+            self._entries.clear()
+            self._size = 0
+
+    @staticmethod
+    def make_key(*parts):
+        """Clave estable (hex) a partir de valores serializables a JSON."""
+        return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        """Contenido guardado para `key`, o None."""
+        if not self.directory:
+            with self._lock:
+                data = self._entries.get(key)
+                if data is not None:
+                    self._entries.move_to_end(key)
+        else:
+            data = None
+            path = self._path(key)
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+                os.utime(path)  # Marca el uso para el orden LRU
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return data
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes:
+            return  # Nunca cabría: no se desaloja todo por una sola imagen
+        with self._lock:
+            if not self.directory:
+                if key in self._entries:
+                    self._size -= len(self._entries.pop(key))
+                self._entries[key] = data
+                self._size += len(data)
+                while self._size > self.max_bytes:
+                    _, evicted = self._entries.popitem(last=False)
+                    self._size -= len(evicted)
+                return
+
+        # Con directorio, la escritura (atómica por os.replace) no toma el lock
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            previous = os.stat(path).st_size
+        except FileNotFoundError:
+            previous = 0
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+        with self._lock:
+            if self._disk_size is not None:
+                self._disk_size += len(data) - previous
+            evict = self._disk_size is None or self._disk_size > self.max_bytes
+        if evict:
+            self._evict_files()
+
+    def _evict_files(self):
+        """
+        Recorre el directorio y, si pasa de max_bytes, borra los archivos menos
+        usados hasta el 90 %. Actualiza el total estimado con el real. Si otro
+        hilo ya está desalojando, no hace nada.
+        """
+        if not self._evict_lock.acquire(blocking=False):
+            return
+        try:
+            total = self._scan_and_evict()
+        finally:
+            self._evict_lock.release()
+        with self._lock:
+            self._disk_size = total
+
+    def _scan_and_evict(self):
+        files = []
+        total = 0
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue  # Otro proceso lo desalojó
+                files.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        if total <= self.max_bytes:
+            return total
+        files.sort()
+        for _, size, path in files:
+            if total <= self.max_bytes * self._LOW_WATER:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        return total
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+# Caché de imágenes de espectrogramas del endpoint de renderizado (se configura en CoreConfig.ready)
+render_cache = RenderCache()
@@ -0,0 +1,155 @@
+# core/rendering.py
+
+"""
+Renderizado en el servidor de espectrogramas como imagen (mapa de calor de la
+magnitud), para que los clientes no tengan que descargar la matriz completa.
+
+La imagen se arma a partir del nivel más grueso de la pirámide de teselas que
+todavía tiene al menos la resolución pedida, leyendo solo las teselas de la
+ventana. PNG se codifica sin dependencias; WebP requiere Pillow.
+"""
+
+import io
+import struct
+import zlib
+import numpy as np
+
+from .analysis.pyramid import magnitude_to_db_u8, read_window
+from .spectrogram_storage import load_spectrogram, open_pyramid_level
+
+try:
+    from PIL import Image
+except ImportError:  # Dependencia opcional: solo necesaria para WebP
+    Image = None
+
+IMAGE_FORMATS = ('png', 'webp')
+SCALES = ('db', 'lineal')
+MAX_IMAGE_SIDE = 4096
+
+# Puntos de control de cada mapa de colores (se interpolan a 256 niveles)
+_COLORMAP_ANCHORS = {
+    'viridis': ('440154', '482878', '3e4989', '31688e', '26828e', '1f9e89', '35b779', '6ece58', 'b5de2b', 'fde725'),
+    'magma': ('000004', '180f3d', '440f76', '721f81', '9e2f7f', 'cd4071', 'f1605d', 'fd9668', 'feca8d', 'fcfdbf'),
+    'inferno': ('000004', '1b0c41', '4a0c6b', '781c6d', 'a52c60', 'cf4446', 'ed6925', 'fb9b06', 'f7d13d', 'fcffa4'),
+    'jet': ('00007f', '0000ff', '007fff', '00ffff', '7fff7f', 'ffff00', 'ff7f00', 'ff0000', '7f0000'),
+    'gray': ('000000', 'ffffff'),
+}
+COLORMAPS = tuple(_COLORMAP_ANCHORS)
+
+
+def colormap_lut(name):
+    """Tabla (256, 3) uint8 del mapa de colores."""
+    if name not in _COLORMAP_ANCHORS:
+        raise ValueError(f"Mapa de colores '{name}' no válido. Opciones: {COLORMAPS}")
+    anchors = np.array([[int(c[i:i + 2], 16) for i in (0, 2, 4)] for c in _COLORMAP_ANCHORS[name]], dtype=np.float64)
+    positions = np.linspace(0, 1, len(anchors))
+    x = np.linspace(0, 1, 256)
+    return np.rint(np.stack([np.interp(x, positions, anchors[:, ch]) for ch in range(3)], axis=1)).astype(np.uint8)
+
+
+def _intensity_lut(db_range, db_min, scale):
+    """
+    Tabla que lleva cada nivel uint8 de la pirámide (dB relativos al pico, ver
+    magnitude_to_db_u8) a un índice 0-255 del mapa de colores.
+    """
+    db = np.arange(256) * (db_range / 255) - db_range
+    if scale == 'db':
+        intensity = np.clip((db - db_min) / -db_min, 0, 1)
+    else:
+        intensity = 10 ** (db / 20)
+    intensity[0] = 0.0  # Por debajo del rango
+    return np.rint(intensity * 255).astype(np.uint8)
+
+
+def encode_png(rgb):
+    """Codifica una imagen (alto, ancho, 3) uint8 como PNG RGB de 8 bits."""
+    height, width, _ = rgb.shape
+    raw = np.hstack([np.zeros((height, 1), dtype=np.uint8), rgb.reshape(height, width * 3)])  # Filtro 0 por fila
+
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw.tobytes(), 6))
+            + chunk(b'IEND', b''))
+
+
+def encode_image(rgb, formato):
+    if formato == 'png':
+        return encode_png(rgb)
+    if Image is None:
+        raise ValueError("El formato 'webp' requiere Pillow, que no está instalado.")
+    buffer = io.BytesIO()
+    Image.fromarray(rgb, mode='RGB').save(buffer, format='WEBP', quality=85)
+    return buffer.getvalue()
+
+
+def _choose_level(niveles, f_range, t_range, width, height):
+    """Nivel más grueso cuya ventana conserva al menos `height` filas y `width` columnas."""
+    elegido = 0
+    for descripcion in niveles:
+        rows = (f_range[1] - f_range[0]) / descripcion['df_hz']
+        cols = (t_range[1] - t_range[0]) / descripcion['dt_s']
+        if rows >= height and cols >= width:
+            elegido = descripcion['nivel']
+    return elegido
+
+
+def _window_indices(start, stop, step, size):
+    first = min(max(int(np.floor(start / step)), 0), size - 1)
+    last = min(max(int(np.ceil(stop / step)), first + 1), size)
+    return first, last
+
+
+def render_spectrogram(espectrograma, fs, width=800, height=400, f_min=None, f_max=None, t_min=None, t_max=None,
+                       db_min=-80.0, scale='db', colormap='viridis', formato='png', db_range=120.0):
+    """
+    Renderiza la magnitud del espectrograma en la ventana pedida como imagen de
+    `width` x `height` (frecuencias bajas abajo). `scale='db'` muestra de `db_min`
+    a 0 dB relativos al pico; 'lineal' muestra la magnitud relativa.
+    Sin pirámide de teselas, la matriz se decodifica completa (más lento).
+    Retorna los bytes de la imagen.
+    """
+    if formato not in IMAGE_FORMATS:
+        raise ValueError(f"Formato '{formato}' no válido. Opciones: {IMAGE_FORMATS}")
+    if scale not in SCALES:
+        raise ValueError(f"Escala '{scale}' no válida. Opciones: {SCALES}")
+    if not (0 < width <= MAX_IMAGE_SIDE and 0 < height <= MAX_IMAGE_SIDE):
+        raise ValueError(f"El tamaño debe estar entre 1 y {MAX_IMAGE_SIDE} píxeles por lado.")
+    if not db_min < 0:  # También rechaza nan
+        raise ValueError("db_min debe ser negativo.")
+    lut = colormap_lut(colormap)
+
+    piramide = espectrograma.piramide
+    if piramide:
+        base = piramide['niveles'][0]
+        db_range = piramide['db_range']
+        df, dt, (n_rows, n_cols) = base['df_hz'], base['dt_s'], base['shape']
+    else:
+        level, _ = magnitude_to_db_u8(load_spectrogram(espectrograma), db_range=db_range)
+        n_rows, n_cols = level.shape
+        df, dt = fs / n_cols, 1 / fs  # Matriz completa: una columna por muestra
+    f_range = (f_min if f_min is not None else 0.0, f_max if f_max is not None else n_rows * df)
+    t_range = (t_min if t_min is not None else 0.0, t_max if t_max is not None else n_cols * dt)
+    if f_range[1] <= f_range[0] or t_range[1] <= t_range[0]:
+        raise ValueError("La ventana de tiempo o frecuencia está vacía.")
+
+    if piramide:
+        nivel = _choose_level(piramide['niveles'], f_range, t_range, width, height)
+        tiles, descripcion = open_pyramid_level(espectrograma, nivel)
+        rows, cols = descripcion['shape']
+        r0, r1 = _window_indices(*f_range, descripcion['df_hz'], rows)
+        c0, c1 = _window_indices(*t_range, descripcion['dt_s'], cols)
+        window = read_window(tiles, r0, r1, c0, c1)
+    else:
+        r0, r1 = _window_indices(*f_range, df, n_rows)
+        c0, c1 = _window_indices(*t_range, dt, n_cols)
+        window = level[r0:r1, c0:c1]
+
+    # Remuestreo al tamaño pedido por vecino más cercano y volteo vertical
+    row_index = ((np.arange(height)[::-1] + 0.5) * window.shape[0] / height).astype(int)
+    col_index = ((np.arange(width) + 0.5) * window.shape[1] / width).astype(int)
+    pixels = window[np.ix_(row_index, col_index)]
+    rgb = lut[_intensity_lut(db_range, db_min, scale)[pixels]]
+    return encode_image(np.ascontiguousarray(rgb), formato)
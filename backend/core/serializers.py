@@ -1,7 +1,7 @@
 # core/serializers.py
 
 from rest_framework import serializers
-from .models import Muestra, Espectrograma, Anotacion, Clasificacion, User
+from .models import Muestra, Espectrograma, Anotacion, Clasificacion, User, CaracteristicasEvento
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -15,15 +15,18 @@ class MuestraSerializer(serializers.ModelSerializer):
     class Meta:
         model = Muestra
         fields = '__all__' # Incluye todos los campos del modelo Muestra
-        read_only_fields = ('id', 'fecha_creacion', 'fecha_procesamiento', 'usuario_creacion')
+        read_only_fields = ('id', 'fecha_creacion', 'fecha_procesamiento', 'usuario_creacion',
+                            'reclamo_token', 'reclamo_expira')
 
 class EspectrogramaSerializer(serializers.ModelSerializer):
-    # Para evitar enviar la gran cantidad de datos binarios por defecto
-    # a menos que se solicite específicamente, podríamos no incluirlo en el listado
-    # Pero para empezar, lo incluiremos.
+    # Solo metadatos: los datos binarios se descargan por streaming desde
+    # /api/espectrogramas/{id}/download/ para no cargarlos ni codificarlos en JSON.
+    event_id = serializers.CharField(source='muestra.event_id', read_only=True)
+
     class Meta:
         model = Espectrograma
-        fields = '__all__'
+        fields = ('muestra', 'event_id', 'metadata_json', 'blob_ref', 'shape', 'dtype', 'checksum',
+                  'piramide', 'huella', 'fecha_generacion')
         read_only_fields = ('muestra',)
 
 class AnotacionSerializer(serializers.ModelSerializer):
@@ -40,4 +43,12 @@ class ClasificacionSerializer(serializers.ModelSerializer):
     class Meta:
         model = Clasificacion
         fields = '__all__'
-        read_only_fields = ('fecha_clasificacion',)
\ No newline at end of file
+        read_only_fields = ('fecha_clasificacion',)
+
+class CaracteristicasEventoSerializer(serializers.ModelSerializer):
+    event_id = serializers.CharField(source='muestra.event_id', read_only=True)
+
+    class Meta:
+        model = CaracteristicasEvento
+        fields = '__all__'
+        read_only_fields = ('muestra', 'fecha_calculo')
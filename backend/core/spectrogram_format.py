@@ -0,0 +1,213 @@
+# core/spectrogram_format.py
+
+"""
+Formato binario compacto y versionado para los espectrogramas (matrices MST).
+
+El blob guardado en Espectrograma.data_espectrograma es:
+    MAGIC (4 bytes) + versión (1 byte) + payload comprimido
+y el encabezado autodescriptivo necesario para decodificarlo se guarda en
+Espectrograma.metadata_json (forma, codificación, códec, escala, etc.).
+
+Codificaciones disponibles:
+- 'complex64': matriz compleja sin pérdidas.
+- 'mag_f16':   magnitud normalizada al pico en float16.
+- 'db_u8' / 'db_u16': magnitud en dB relativa al pico, recortada a `db_range`
+  dB y cuantizada uniformemente a uint8 / uint16.
+
+Antes de comprimir, los bytes de cada elemento se reordenan por plano
+(byte shuffle, como en Blosc/HDF5): los bytes altos de valores vecinos se
+parecen entre sí y el compresor los aprovecha mucho mejor.
+
+Los espectrogramas guardados antes de este formato (pickle de la matriz
+complex64) se siguen pudiendo leer con `decode_spectrogram`.
+
+Cuando se usa el almacén de blobs (ver core/blobstore.py), el arreglo
+codificado se guarda sin comprimir como .npy para poder abrirlo con memmap;
+el encabezado es el mismo, con 'storage': 'blob' y sin códec.
+"""
+
+import pickle
+import zlib
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:  # Dependencia opcional: se usa zlib si no está instalada
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+MAGIC = b'PQSG'
+FORMAT_NAME = 'pqsg'
+FORMAT_VERSION = 1
+
+ENCODINGS = ('complex64', 'mag_f16', 'db_u8', 'db_u16')
+DEFAULT_DB_RANGE = 120.0
+
+# Tipo almacenado (little-endian explícito) y tipo decodificado de cada codificación
+_STORED_DTYPES = {
+    'complex64': np.dtype('<c8'),
+    'mag_f16': np.dtype('<f2'),
+    'db_u8': np.dtype('<u1'),
+    'db_u16': np.dtype('<u2'),
+}
+_DECODED_DTYPES = {
+    'complex64': np.dtype(np.complex64),
+    'mag_f16': np.dtype(np.float32),
+    'db_u8': np.dtype(np.float32),
+    'db_u16': np.dtype(np.float32),
+}
+
+
+def available_codecs():
+    """Códecs de compresión disponibles en este entorno, del preferido al de respaldo."""
+    codecs = []
+    if zstandard is not None:
+        codecs.append('zstd')
+    if lz4 is not None:
+        codecs.append('lz4')
+    codecs.append('zlib')
+    return codecs
+
+
+def _compress(data, codec):
+    if codec == 'zstd' and zstandard is not None:
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    if codec == 'lz4' and lz4 is not None:
+        return lz4.frame.compress(data)
+    if codec == 'zlib':
+        return zlib.compress(data, 1)  # Nivel 1: prioriza velocidad sobre tasa de compresión
+    raise ValueError(f"Códec '{codec}' no disponible. Disponibles: {available_codecs()}")
+
+
+def _decompress(data, codec):
+    if codec == 'zstd' and zstandard is not None:
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == 'lz4' and lz4 is not None:
+        return lz4.frame.decompress(data)
+    if codec == 'zlib':
+        return zlib.decompress(data)
+    raise ValueError(f"Códec '{codec}' no disponible. Disponibles: {available_codecs()}")
+
+
+def _shuffle(raw, itemsize):
+    """Agrupa el byte i de todos los elementos (byte shuffle)."""
+    if itemsize == 1:
+        return raw
+    return np.frombuffer(raw, dtype=np.uint8).reshape(-1, itemsize).T.tobytes()
+
+
+def _unshuffle(raw, itemsize):
+    if itemsize == 1:
+        return raw
+    return np.frombuffer(raw, dtype=np.uint8).reshape(itemsize, -1).T.tobytes()
+
+
+def encode_array(matrix, encoding='mag_f16', db_range=DEFAULT_DB_RANGE):
+    """
+    Aplica la codificación a la matriz MST sin comprimir.
+    Retorna (arreglo codificado, parámetros necesarios para decodificarlo).
+    """
+    if encoding not in ENCODINGS:
+        raise ValueError(f"Codificación '{encoding}' no válida. Opciones: {ENCODINGS}")
+    matrix = np.asarray(matrix)
+    if encoding == 'complex64':
+        return matrix.astype(_STORED_DTYPES[encoding], copy=False), {}
+
+    magnitude = np.abs(matrix).astype(np.float32, copy=False)
+    peak = float(magnitude.max()) if magnitude.size else 0.0
+    scale = peak if peak > 0 else 1.0
+    magnitude /= scale  # En sitio: np.abs ya creó una copia
+    if encoding == 'mag_f16':
+        return magnitude.astype(_STORED_DTYPES[encoding]), {'scale': scale}
+
+    levels = np.iinfo(_STORED_DTYPES[encoding]).max
+    with np.errstate(divide='ignore'):
+        db = 20 * np.log10(magnitude, out=magnitude)  # -inf para magnitud cero
+    np.clip(db, -db_range, 0.0, out=db)
+    db += db_range
+    db *= levels / db_range
+    return np.rint(db).astype(_STORED_DTYPES[encoding]), {'scale': scale, 'db_range': float(db_range)}
+
+
+def decode_array(stored, header):
+    """
+    Convierte un arreglo codificado (o una porción de él) de vuelta a valores:
+    complex64 para 'complex64' y magnitud float32 para el resto.
+    """
+    encoding = header['encoding']
+    if encoding == 'complex64':
+        return np.asarray(stored, dtype=np.complex64)
+    if encoding == 'mag_f16':
+        return np.asarray(stored, dtype=np.float32) * np.float32(header['scale'])
+
+    levels = np.iinfo(_STORED_DTYPES[encoding]).max
+    db_range = header['db_range']
+    stored = np.asarray(stored)
+    db = stored.astype(np.float32) * np.float32(db_range / levels) - np.float32(db_range)
+    magnitude = np.float32(header['scale']) * np.power(np.float32(10), db / np.float32(20))
+    magnitude[stored == 0] = 0.0  # El nivel mínimo representa "por debajo del rango"
+    return magnitude
+
+
+def encode_spectrogram(matrix, encoding='mag_f16', codec=None, db_range=DEFAULT_DB_RANGE):
+    """
+    Serializa una matriz MST en el formato compacto.
+    Retorna (bytes para data_espectrograma, encabezado para metadata_json).
+    """
+    codec = codec or available_codecs()[0]
+    stored, params = encode_array(matrix, encoding=encoding, db_range=db_range)
+    payload = _compress(_shuffle(np.ascontiguousarray(stored).tobytes(), stored.itemsize), codec)
+    header = build_header(stored, encoding, params, codec=codec, shuffle=stored.itemsize > 1,
+                          compressed_bytes=len(payload))
+    return MAGIC + bytes([FORMAT_VERSION]) + payload, header
+
+
+def build_header(stored, encoding, params, **extra):
+    """Encabezado autodescriptivo para un arreglo codificado con `encode_array`."""
+    return {
+        'format': FORMAT_NAME,
+        'version': FORMAT_VERSION,
+        'shape': list(stored.shape),
+        'dtype': _DECODED_DTYPES[encoding].name,
+        'encoding': encoding,
+        'stored_dtype': stored.dtype.str,
+        **extra,
+        **params,
+    }
+
+
+def is_compact_format(metadata):
+    return bool(metadata) and metadata.get('format') == FORMAT_NAME
+
+
+def decode_spectrogram(data, metadata):
+    """
+    Lee el contenido de data_espectrograma y lo decodifica a un arreglo NumPy.
+    Si metadata_json no describe el formato compacto, se asume el pickle legado.
+    """
+    if not is_compact_format(metadata):
+        return pickle.loads(bytes(data))
+    return decode_array(read_stored_array(data, metadata), metadata)
+
+
+def read_stored_array(data, metadata):
+    """
+    Descomprime el contenido de data_espectrograma y retorna el arreglo aún
+    codificado (sin pasar por `decode_array`).
+    """
+    data = bytes(data)  # BinaryField puede devolver memoryview
+
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError("El blob no tiene la firma del formato compacto de espectrogramas.")
+    version = data[len(MAGIC)]
+    if version > FORMAT_VERSION:
+        raise ValueError(f"Versión de formato {version} no soportada (máxima {FORMAT_VERSION}).")
+    stored_dtype = np.dtype(metadata['stored_dtype'])
+    raw = _decompress(data[len(MAGIC) + 1:], metadata['codec'])
+    if metadata.get('shuffle'):
+        raw = _unshuffle(raw, stored_dtype.itemsize)
+    return np.frombuffer(raw, dtype=stored_dtype).reshape(metadata['shape'])
@@ -0,0 +1,251 @@
+# core/spectrogram_storage.py
+
+"""
+Lectura y escritura de espectrogramas independiente de dónde se guardan:
+en línea en Espectrograma.data_espectrograma (formato compacto comprimido) o
+en el almacén de blobs configurado en settings.SPECTROGRAM_STORAGE, en cuyo
+caso la tabla solo guarda la referencia, la forma, el dtype y el checksum.
+"""
+
+import hashlib
+import os
+import tempfile
+import time
+import numpy as np
+from django.conf import settings
+
+from .analysis.pyramid import build_pyramid
+from .blobstore import get_blob_store
+from .models import Espectrograma
+from .spectrogram_format import (
+    build_header, decode_array, decode_spectrogram, encode_array, encode_spectrogram,
+    is_compact_format, read_stored_array,
+)
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:  # Dependencia opcional: solo necesaria para descargas en formato Arrow
+    pyarrow = None
+
+DOWNLOAD_FORMATS = ('npy', 'arrow')
+
+
+def spectrogram_fields(matrix, store=None, encoding=None):
+    """
+    Codifica la matriz MST según la configuración (o con `encoding`) y la
+    guarda en el almacén de blobs si hay uno configurado. Retorna los campos de
+    Espectrograma a guardar (para usar como `defaults` de update_or_create).
+    """
+    store = store if store is not None else get_blob_store()
+    encoding = encoding or settings.SPECTROGRAM_ENCODING
+    if store is None:
+        data, header = encode_spectrogram(
+            matrix,
+            encoding=encoding,
+            codec=settings.SPECTROGRAM_CODEC,
+            db_range=settings.SPECTROGRAM_DB_RANGE,
+        )
+        return {
+            'data_espectrograma': data,
+            'metadata_json': header,
+            'blob_ref': None,
+            'shape': header['shape'],
+            'dtype': header['stored_dtype'],
+            'checksum': f"sha256:{hashlib.sha256(data).hexdigest()}",
+        }
+
+    stored, params = encode_array(matrix, encoding=encoding, db_range=settings.SPECTROGRAM_DB_RANGE)
+    return _blob_fields(stored, encoding, params, store)
+
+
+def stored_blob_fields(stored, header, store):
+    """
+    Guarda en el almacén de blobs un arreglo ya codificado (p. ej. el de
+    `read_stored_array`) tal cual, con su codificación y parámetros: sin
+    recuantizarlo ni convertir magnitud en complex64. Retorna los campos de
+    Espectrograma, como `spectrogram_fields`.
+    """
+    params = {clave: header[clave] for clave in ('scale', 'db_range') if clave in header}
+    return _blob_fields(stored, header['encoding'], params, store)
+
+
+def _blob_fields(stored, encoding, params, store):
+    ref, checksum = store.put_array(stored)
+    header = build_header(stored, encoding, params, storage='blob')
+    return {
+        'data_espectrograma': None,
+        'metadata_json': header,
+        'blob_ref': ref,
+        'shape': header['shape'],
+        'dtype': header['stored_dtype'],
+        'checksum': checksum,
+    }
+
+
+def pyramid_fields(matrix, fs, store=None):
+    """
+    Construye la pirámide de teselas de magnitud (ver core/analysis/pyramid.py)
+    y guarda cada nivel en el almacén de blobs. Retorna {'piramide': descripción}
+    para Espectrograma; la descripción es None si no hay almacén configurado o
+    si settings.SPECTROGRAM_TILE_SIZE es None.
+    """
+    store = store if store is not None else get_blob_store()
+    tile_size = settings.SPECTROGRAM_TILE_SIZE
+    if store is None or not tile_size:
+        return {'piramide': None}
+
+    n_samples = matrix.shape[1]  # La MST completa tiene una columna por muestra
+    levels, scale = build_pyramid(matrix, tile_size=tile_size, db_range=settings.SPECTROGRAM_DB_RANGE)
+    niveles = []
+    for nivel, (tiles, shape) in enumerate(levels):
+        ref, checksum = store.put_array(tiles)
+        niveles.append({
+            'nivel': nivel,
+            'shape': list(shape),
+            'teselas': list(tiles.shape[:2]),
+            'df_hz': fs / n_samples * 2 ** nivel,  # Ancho en frecuencia de cada fila del nivel
+            'dt_s': 2 ** nivel / fs,  # Duración de cada columna del nivel
+            'blob_ref': ref,
+            'checksum': checksum,
+        })
+    return {'piramide': {
+        'tile_size': tile_size,
+        'encoding': 'db_u8',
+        'db_range': float(settings.SPECTROGRAM_DB_RANGE),
+        'scale': scale,
+        'niveles': niveles,
+    }}
+
+
+def referenced_blob_refs():
+    """Referencias del almacén de blobs en uso: el arreglo y los niveles de la pirámide de cada Espectrograma."""
+    refs = set()
+    filas = Espectrograma.objects.values_list('blob_ref', 'piramide').iterator(chunk_size=2000)
+    for blob_ref, piramide in filas:
+        if blob_ref:
+            refs.add(blob_ref)
+        refs.update(nivel['blob_ref'] for nivel in (piramide or {}).get('niveles', []))
+    return refs
+
+
+def open_pyramid_level(espectrograma, nivel):
+    """
+    Retorna (memmap de teselas (teselas_f, teselas_t, tile, tile), descripción
+    del nivel), o None si el espectrograma no tiene pirámide o no existe el nivel.
+    """
+    piramide = espectrograma.piramide
+    if not piramide or not 0 <= nivel < len(piramide['niveles']):
+        return None
+    descripcion = piramide['niveles'][nivel]
+    return get_blob_store().open_array(descripcion['blob_ref'], mmap=True), descripcion
+
+
+def open_stored_spectrogram(espectrograma, mmap=True):
+    """
+    Retorna (arreglo codificado, encabezado). Si el espectrograma está en el
+    almacén de blobs el arreglo es un numpy.memmap de solo lectura: recortarlo
+    y pasar la porción a `decode_array` no carga la matriz completa.
+    Para los guardados en línea se descomprime el contenido de la columna.
+    """
+    header = espectrograma.metadata_json
+    if espectrograma.blob_ref:
+        return get_blob_store().open_array(espectrograma.blob_ref, mmap=mmap), header
+    if not is_compact_format(header):
+        # Pickle legado: la matriz complex64 es su propia codificación
+        matrix = decode_spectrogram(espectrograma.data_espectrograma, header)
+        return matrix, {'encoding': 'complex64', 'shape': list(matrix.shape)}
+    return read_stored_array(espectrograma.data_espectrograma, header), header
+
+
+def load_spectrogram(espectrograma):
+    """Matriz completa decodificada (complex64 o magnitud float32) de un Espectrograma."""
+    stored, header = open_stored_spectrogram(espectrograma, mmap=True)
+    return decode_array(stored, header)
+
+
+def available_download_formats():
+    """Formatos de descarga disponibles en este entorno ('arrow' requiere pyarrow)."""
+    return tuple(f for f in DOWNLOAD_FORMATS if f != 'arrow' or pyarrow is not None)
+
+
+def download_etag(espectrograma, formato):
+    """ETag de la descarga en `formato`, derivado del checksum guardado sin leer el arreglo."""
+    return f'"{_download_digest(espectrograma)}-{formato}"'
+
+
+def _download_digest(espectrograma):
+    checksum = espectrograma.checksum
+    if not checksum:  # Filas anteriores al almacén de blobs
+        checksum = f"sha256:{hashlib.sha256(bytes(espectrograma.data_espectrograma)).hexdigest()}"
+    return checksum.split(':', 1)[-1]
+
+
+def spectrogram_download(espectrograma, formato='npy'):
+    """
+    Prepara la descarga binaria del arreglo codificado de un espectrograma
+    (el mismo que describe metadata_json; se decodifica con `decode_array`).
+
+    - 'npy': si está en el almacén de blobs se sirve el archivo tal cual, sin
+      cargarlo en memoria.
+    - 'arrow': tensor Arrow en formato IPC (requiere pyarrow).
+
+    Lo que hay que armar (el .npy de un espectrograma en línea y los tensores
+    Arrow) se escribe una sola vez en settings.SPECTROGRAM_DOWNLOAD_CACHE_DIR,
+    con el checksum en el nombre, y las peticiones siguientes (incluidas las
+    parciales con Range) se sirven desde ese archivo. Comprobar If-None-Match
+    con `download_etag` antes de llamar a esta función evita leer el arreglo.
+
+    Retorna (función que abre el contenido, tamaño en bytes, ETag, content type,
+    nombre de archivo).
+    """
+    if formato not in available_download_formats():
+        raise ValueError(f"Formato '{formato}' no disponible. Opciones: {available_download_formats()}")
+
+    digest = _download_digest(espectrograma)
+    etag = f'"{digest}-{formato}"'
+    nombre = f"espectrograma_{espectrograma.pk}.{formato}"
+
+    if formato == 'npy' and espectrograma.blob_ref:
+        path = get_blob_store().local_path(espectrograma.blob_ref)
+        return (lambda: open(path, 'rb')), os.path.getsize(path), etag, 'application/octet-stream', nombre
+
+    path = os.path.join(str(settings.SPECTROGRAM_DOWNLOAD_CACHE_DIR), f"{digest}.{formato}")
+    try:
+        os.utime(path)  # Los archivos se retiran por antigüedad desde el último uso
+    except FileNotFoundError:
+        _write_download(path, formato, open_stored_spectrogram(espectrograma, mmap=True)[0])
+    content_type = 'application/octet-stream' if formato == 'npy' else 'application/vnd.apache.arrow.stream'
+    return (lambda: open(path, 'rb')), os.path.getsize(path), etag, content_type, nombre
+
+
+def _write_download(path, formato, stored):
+    directorio = os.path.dirname(path)
+    os.makedirs(directorio, exist_ok=True)
+    _purge_downloads(directorio, settings.SPECTROGRAM_DOWNLOAD_CACHE_MAX_AGE_S)
+    fd, tmp_path = tempfile.mkstemp(dir=directorio, suffix='.tmp')
+    os.close(fd)
+    try:
+        stored = np.ascontiguousarray(stored)
+        if formato == 'npy':
+            with open(tmp_path, 'wb') as f:
+                np.lib.format.write_array(f, stored, allow_pickle=False)
+        else:
+            with pyarrow.OSFile(tmp_path, 'wb') as sink:
+                pyarrow.ipc.write_tensor(pyarrow.Tensor.from_numpy(stored), sink)
+        os.replace(tmp_path, path)  # Atómico: otra petición nunca ve el archivo a medio escribir
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _purge_downloads(directorio, max_age_s):
+    """Borra las descargas armadas que no se usan desde hace más de `max_age_s` segundos."""
+    limite = time.time() - max_age_s
+    for name in os.listdir(directorio):
+        path = os.path.join(directorio, name)
+        try:
+            if os.stat(path).st_mtime < limite:
+                os.unlink(path)
+        except FileNotFoundError:
+            pass
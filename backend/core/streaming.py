@@ -0,0 +1,104 @@
+# core/streaming.py
+
+"""
+Respuestas binarias por streaming con soporte de peticiones HTTP Range y ETag,
+para que los clientes puedan reanudar descargas grandes y guardarlas en caché.
+"""
+
+import re
+from django.http import HttpResponse, StreamingHttpResponse
+
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def parse_range(header, size):
+    """
+    Interpreta un encabezado Range de un solo intervalo ('bytes=a-b', 'bytes=a-'
+    o 'bytes=-n'). Retorna (inicio, fin inclusive), None si no hay Range o no se
+    entiende (se responde el contenido completo), o 'invalido' si no es satisfacible.
+    """
+    if not header:
+        return None
+    match = _RANGE_RE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None  # Varios intervalos u otra unidad: se ignora, como permite el RFC 9110
+    start, end = match.groups()
+    if start == '':
+        length = int(end)
+        if length == 0:
+            return 'invalido'
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or end < start:
+        return 'invalido'
+    return start, end
+
+
+def _etag_matches(header, etag):
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    return etag in [valor.strip().removeprefix('W/') for valor in header.split(',')]
+
+
+def not_modified(request, etag):
+    """Respuesta 304 si If-None-Match coincide con `etag`; si no, None."""
+    if not _etag_matches(request.headers.get('If-None-Match'), etag):
+        return None
+    response = HttpResponse(status=304)
+    response['ETag'] = etag
+    return response
+
+
+def _iter_file(f, start, length, chunk_size=STREAM_CHUNK_SIZE):
+    try:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+def ranged_response(request, open_file, size, etag, content_type='application/octet-stream', filename=None):
+    """
+    Sirve por streaming el contenido de un archivo (binario, con seek) respetando
+    If-None-Match (304), Range (206 / 416) e If-Range.
+
+    `open_file` es una función sin argumentos que abre el archivo; solo se llama
+    si realmente hay que enviar contenido. `etag` debe ir entre comillas.
+    """
+    response = not_modified(request, etag)
+    if response is not None:
+        return response
+
+    byte_range = parse_range(request.headers.get('Range'), size)
+    if_range = request.headers.get('If-Range')
+    if byte_range is not None and if_range and if_range.strip() != etag:
+        byte_range = None  # El contenido cambió desde la descarga parcial: se envía completo
+
+    if byte_range == 'invalido':
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    start, end = byte_range if byte_range else (0, size - 1)
+    length = max(end - start + 1, 0)
+    response = StreamingHttpResponse(_iter_file(open_file(), start, length), content_type=content_type,
+                                     status=206 if byte_range else 200)
+    response['Content-Length'] = str(length)
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    if byte_range:
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    if filename:
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
@@ -1,13 +1,166 @@
 # core/tasks.py
 
+import hashlib
+import json
+import uuid
+from datetime import timedelta
 import numpy as np
-import pickle
+import pandas as pd
+from django.conf import settings
 from django.utils import timezone
-from celery import shared_task
+from celery import chain, shared_task
+from django.db import transaction
+from django.db.models import Q
+
+from .waveform_cache import waveform_cache
+from .models import Muestra, Espectrograma, Clasificacion, CaracteristicasEvento, TrabajoProcesamiento
+from .analysis.stockwell import mst_processing, mst_processing_batch, MST_FS, MST_P_ORDER, MST_ALPHA
+from .analysis.features import extract_features, FEATURE_VERSION
+from .spectrogram_storage import pyramid_fields, spectrogram_fields
+from .blobstore import get_blob_store, get_staging_store
+from .metrics import medir, metrics, registrar_etapa
+
+def huella_procesamiento(valores):
+    """
+    sha256 de la captura cruda y de los parámetros que determinan el resultado
+    (MST, codificación del espectrograma, pirámide y versión de las características).
+    Si coincide con la del espectrograma guardado, reprocesar daría lo mismo.
+    """
+    parametros = {
+        'fs': MST_FS, 'p': MST_P_ORDER, 'alpha': MST_ALPHA, 'precision': settings.MST_PRECISION,
+        'encoding': settings.SPECTROGRAM_ENCODING, 'db_range': settings.SPECTROGRAM_DB_RANGE,
+        'tile_size': settings.SPECTROGRAM_TILE_SIZE, 'features': FEATURE_VERSION,
+    }
+    huella = hashlib.sha256(json.dumps(parametros, sort_keys=True).encode('utf-8'))
+    huella.update(np.ascontiguousarray(valores, dtype='<f8').tobytes())
+    return huella.hexdigest()
+
+
+def reclamar_muestras(muestra_ids, token=None):
+    """
+    Reclama muestras para procesarlas con un UPDATE condicional atómico: solo se
+    toman las que están 'pendiente' o 'error', o 'en_proceso' con el reclamo
+    vencido (worker caído). Pasan a 'en_proceso' con un token propio y vencen a
+    los settings.PROCESS_LEASE_S segundos. Retorna el conjunto de IDs reclamados.
+    """
+    ahora = timezone.now()
+    token = token or uuid.uuid4()
+    Muestra.objects.filter(id__in=muestra_ids).filter(
+        Q(estado_procesamiento__in=('pendiente', 'error'))
+        | Q(estado_procesamiento='en_proceso', reclamo_expira__lt=ahora)
+    ).update(
+        estado_procesamiento='en_proceso',
+        reclamo_token=token,
+        reclamo_expira=ahora + timedelta(seconds=settings.PROCESS_LEASE_S),
+    )
+    return set(Muestra.objects.filter(id__in=muestra_ids, reclamo_token=token).values_list('id', flat=True))
+
+
+def renovar_reclamo(muestra_id, token):
+    """Extiende el reclamo si sigue siendo de `token`. Retorna False si se perdió (venció y otro worker la tomó)."""
+    return Muestra.objects.filter(id=muestra_id, estado_procesamiento='en_proceso', reclamo_token=token).update(
+        reclamo_expira=timezone.now() + timedelta(seconds=settings.PROCESS_LEASE_S)) == 1
+
+
+def conservar_reclamo(muestra_ids, token):
+    """
+    Dentro de una transacción, bloquea (SELECT ... FOR UPDATE) las Muestras que
+    siguen reclamadas con `token` y retorna sus IDs. Las que falten vencieron y
+    otro worker pudo tomarlas: sus resultados no deben escribirse.
+    """
+    return set(Muestra.objects.select_for_update().filter(
+        id__in=muestra_ids, estado_procesamiento='en_proceso', reclamo_token=token,
+    ).values_list('id', flat=True))
+
+
+def _liberar(muestra, estado):
+    muestra.estado_procesamiento = estado
+    muestra.reclamo_token = None
+    muestra.reclamo_expira = None
+
+
+def _marcar_error(muestra, token):
+    # Solo si el reclamo sigue siendo nuestro; si no, el estado es de otro worker
+    _liberar(muestra, 'error')
+    Muestra.objects.filter(id=muestra.id, reclamo_token=token).update(
+        estado_procesamiento='error', reclamo_token=None, reclamo_expira=None)
+    metrics.inc('pqs_muestras_total', resultado='error')
+
+
+def _reclamo_perdido(muestra_id):
+    print(f"[{timezone.now()}] Se perdió el reclamo de la Muestra ID {muestra_id} (venció y otro worker la tomó). "
+          f"Se descartan sus resultados.")
+    metrics.inc('pqs_muestras_total', resultado='omitido')
+
+
+def _calcular_mst(senales, lote=False, **contexto):
+    """
+    MST de una captura (o, con `lote`, de un arreglo de capturas) con los
+    parámetros de settings. Registra por separado las etapas 'normalizacion' y
+    'mst'; `contexto` va a los registros de métricas.
+    """
+    max_memory = settings.MST_MAX_MEMORY_MB * 1024 ** 2 if settings.MST_MAX_MEMORY_MB else None
+    procesar = mst_processing_batch if lote else mst_processing
+    tiempos = {}
+    with medir('mst', memoria=True, **contexto) as etapa:
+        matriz = procesar(senales, precision=settings.MST_PRECISION, max_memory=max_memory,
+                          workers=settings.MST_WORKERS, timings=tiempos)
+        etapa['bytes'] = matriz.nbytes
+        etapa['duracion_s'] = tiempos['mst']
+    registrar_etapa('normalizacion', tiempos['normalizacion'], bytes=np.asarray(senales).nbytes, **contexto)
+    return matriz
+
+
+def _capturas_por_mst():
+    """
+    Capturas por llamada a la MST en procesar_lote_task: settings.MST_BATCH_SIZE,
+    reducido para que las matrices de salida del lote (complex64, N/2 x N por
+    captura) quepan en MST_MAX_MEMORY_MB. Con 1 cada evento usa la ruta por bloques.
+    """
+    if not settings.MST_MAX_MEMORY_MB:
+        return settings.MST_BATCH_SIZE
+    n = settings.CAPTURE_NUM_SAMPLES
+    salida = (n // 2) * n * np.dtype(np.complex64).itemsize
+    return max(1, min(settings.MST_BATCH_SIZE, settings.MST_MAX_MEMORY_MB * 1024 ** 2 // salida))
+
+
+def _campos_evento(valores, matriz_espectrograma, store=None, **contexto):
+    """
+    Campos del Espectrograma (datos o referencia al blob, más la pirámide) y de
+    CaracteristicasEvento a partir de la captura y su MST. `store` es el almacén
+    de blobs donde se escriben los arreglos (por defecto el configurado).
+    `contexto` va a los registros de métricas.
+    """
+    with medir('caracteristicas', **contexto):
+        caracteristicas = extract_features(
+            valores, matriz_espectrograma, MST_FS,
+            samples_per_cycle=settings.CAPTURE_SAMPLES_PER_CYCLE,
+        )
+    # Codifica la matriz y, si hay almacén de blobs configurado, la escribe fuera de PostgreSQL
+    with medir('serializacion', **contexto) as etapa:
+        etapa['bytes'] = matriz_espectrograma.nbytes
+        campos_espectrograma = spectrogram_fields(matriz_espectrograma, store=store)
+        campos_espectrograma.update(pyramid_fields(matriz_espectrograma, MST_FS, store=store))
+    vector = dict(zip(caracteristicas['nombres'], caracteristicas['vector']))
+    campos_caracteristicas = {
+        'version': caracteristicas['version'],
+        'vector': caracteristicas['vector'],
+        'nombres': caracteristicas['nombres'],
+        'thd': vector['thd'],
+        'tiempo_desviacion_max_s': vector['tiempo_desviacion_max_s'],
+        'desviacion_max_relativa': vector['desviacion_max_relativa'],
+    }
+    return campos_espectrograma, campos_caracteristicas
+
+
+def _actualizar_muestra(muestra, timestamps, valores):
+    """Completa la Muestra con los datos reales de la captura y la marca como procesada."""
+    muestra.timestamp_inicio = pd.Timestamp(timestamps[0], tz='UTC').to_pydatetime()
+    muestra.duracion_ms = int((timestamps[-1] - timestamps[0]) / np.timedelta64(1, 'ms'))
+    muestra.num_puntos = len(valores)
+    _liberar(muestra, 'procesado')
+    muestra.fecha_procesamiento = timezone.now()
 
-from .influx_client import influx_service
-from .models import Muestra, Espectrograma, Clasificacion
-from .analysis.stockwell import mst_processing
 
 @shared_task
 def procesar_evento_completo_task(muestra_id: int): # <<-- CAMBIO 1: Recibe muestra_id (entero)
@@ -19,16 +172,26 @@ def procesar_evento_completo_task(muestra_id: int): # <<-- CAMBIO 1: Recibe mues
     4. Guarda el espectrograma.
     5. Crea una entrada de Clasificacion inicial.
     6. Actualiza la Muestra a 'procesado'.
+
+    La muestra se reclama antes de empezar (ver `reclamar_muestras`), así que
+    un segundo envío o un reintento mientras otro worker la procesa no repite
+    el cálculo, y los resultados solo se escriben si el reclamo sigue vigente.
+    Si la captura y los parámetros no cambiaron desde el último espectrograma
+    (misma huella), no se recalcula la MST.
     """
+    token = uuid.uuid4()
     try:
-        # <<-- CAMBIO 2: Buscar la muestra por su ID al inicio
+        # <<-- CAMBIO 2: Reclamar la muestra por su ID al inicio
+        reclamada = muestra_id in reclamar_muestras([muestra_id], token=token)
         muestra = Muestra.objects.get(id=muestra_id)
         event_id = muestra.event_id
         print(f"[{timezone.now()}] Iniciando procesamiento ASÍNCRONO para Muestra ID: {muestra.id} (Event ID: {event_id})...")
 
-        # <<-- CAMBIO 3: La verificación ahora es sobre el estado de esta muestra específica
-        if muestra.estado_procesamiento == 'procesado':
-            print(f"[{timezone.now()}] La muestra con ID {muestra.id} ya está en estado 'procesado'. Omitiendo.")
+        # <<-- CAMBIO 3: Solo continúa el worker que la reclamó
+        if not reclamada:
+            print(f"[{timezone.now()}] La muestra con ID {muestra.id} está en estado '{muestra.estado_procesamiento}' "
+                  f"(procesada o en proceso en otro worker). Omitiendo.")
+            metrics.inc('pqs_muestras_total', resultado='omitido')
             return None
 
     except Muestra.DoesNotExist:
@@ -36,22 +199,35 @@ def procesar_evento_completo_task(muestra_id: int): # <<-- CAMBIO 1: Recibe mues
         return None
 
 
-    # 2. Obtener datos de la señal desde InfluxDB
+    # 2. Obtener datos de la señal (caché de capturas o InfluxDB)
     try:
-        puntos_signal = influx_service.get_signal_data(event_id, 'voltage_waveform')
-        if not puntos_signal or len(puntos_signal) < 5120:
+        with medir('captura', muestra_id=muestra.id) as etapa:
+            timestamps, valores = waveform_cache.get_signal_data(event_id, start=muestra.timestamp_inicio)
+            etapa['bytes'] = np.asarray(valores).nbytes
+        if len(valores) < settings.CAPTURE_NUM_SAMPLES:
             print(f"[{timezone.now()}] No se encontraron suficientes datos para el event_id '{event_id}'.")
-            muestra.estado_procesamiento = 'error' # Marcar como error
-            muestra.save()
+            _marcar_error(muestra, token)
             return None
     except Exception as e:
         print(f"[{timezone.now()}] Error al obtener datos de InfluxDB para '{event_id}': {e}")
-        muestra.estado_procesamiento = 'error' # Marcar como error
-        muestra.save()
+        _marcar_error(muestra, token)
         return None
 
-    # Separar timestamps y valores
-    timestamps, valores = zip(*puntos_signal)
+    # 3. Omitir la MST si el espectrograma guardado ya corresponde a esta captura y parámetros
+    huella = huella_procesamiento(valores)
+    if (Espectrograma.objects.filter(muestra=muestra, huella=huella).exists()
+            and CaracteristicasEvento.objects.filter(muestra=muestra).exists()):
+        print(f"[{timezone.now()}] El espectrograma de la Muestra ID {muestra.id} ya corresponde a esta captura "
+              f"y parámetros. Se reutiliza.")
+        with transaction.atomic():
+            if not conservar_reclamo([muestra.id], token):
+                _reclamo_perdido(muestra.id)
+                return None
+            Clasificacion.objects.get_or_create(muestra=muestra)
+            _actualizar_muestra(muestra, timestamps, valores)
+            muestra.save()
+        metrics.inc('pqs_muestras_total', resultado='reutilizado')
+        return {'status': 'success', 'muestra_id': muestra.id, 'event_id': event_id, 'reutilizado': True}
 
     # <<-- CAMBIO 4: ELIMINAR el bloque "Crear el objeto Muestra en PostgreSQL"
     # Ya no creamos la muestra, la estamos actualizando.
@@ -59,47 +235,485 @@ def procesar_evento_completo_task(muestra_id: int): # <<-- CAMBIO 1: Recibe mues
     # 4. Calcular la Transformada de Stockwell
     try:
         print(f"[{timezone.now()}] Calculando la Transformada de Stockwell...")
-        matriz_espectrograma = mst_processing(valores)
-        espectrograma_bytes = pickle.dumps(matriz_espectrograma)
+        matriz_espectrograma = _calcular_mst(valores, muestra_id=muestra.id)
+        # Vector de características compacto, calculado mientras la MST está en memoria
+        campos_espectrograma, campos_caracteristicas = _campos_evento(valores, matriz_espectrograma,
+                                                                      muestra_id=muestra.id)
+        campos_espectrograma['huella'] = huella
 
     except Exception as e:
         print(f"[{timezone.now()}] Error al calcular la Transformada de Stockwell: {e}")
-        muestra.estado_procesamiento = 'error' # Marcar como error
-        muestra.save()
+        _marcar_error(muestra, token)
         return None
 
-    # 5. Guardar el Espectrograma en PostgreSQL
+    # 5-7. Guardar Espectrograma, características, Clasificacion inicial y estado en una transacción,
+    # solo si el reclamo sigue siendo nuestro
     try:
         print(f"[{timezone.now()}] Guardando el espectrograma en PostgreSQL...")
-        Espectrograma.objects.update_or_create( # Usar update_or_create para evitar duplicados si se re-ejecuta
-            muestra=muestra,
-            defaults={
-                'data_espectrograma': espectrograma_bytes,
-                'metadata_json': {
-                    'shape': [matriz_espectrograma.shape[0], matriz_espectrograma.shape[1]],
-                    'dtype': str(matriz_espectrograma.dtype)
-                }
-            }
-        )
+        with transaction.atomic():
+            if not conservar_reclamo([muestra.id], token):
+                _reclamo_perdido(muestra.id)
+                return None
+            with medir('bd_espectrograma', muestra_id=muestra.id) as etapa:
+                etapa['bytes'] = len(campos_espectrograma['data_espectrograma'] or b'')
+                Espectrograma.objects.update_or_create( # Usar update_or_create para evitar duplicados si se re-ejecuta
+                    muestra=muestra,
+                    defaults=campos_espectrograma, # Datos o referencia al blob, más el encabezado del formato
+                )
+            with medir('bd_caracteristicas', muestra_id=muestra.id):
+                CaracteristicasEvento.objects.update_or_create(
+                    muestra=muestra,
+                    defaults=campos_caracteristicas,
+                )
+            with medir('bd_clasificacion', muestra_id=muestra.id):
+                Clasificacion.objects.update_or_create( # Usar update_or_create
+                    muestra=muestra,
+                    defaults={'estado_clasificacion': 'pendiente'}
+                )
+            _actualizar_muestra(muestra, timestamps, valores)
+            with medir('bd_muestra', muestra_id=muestra.id):
+                muestra.save()
     except Exception as e:
         print(f"[{timezone.now()}] Error al guardar el Espectrograma en PostgreSQL: {e}")
-        muestra.estado_procesamiento = 'error'
-        muestra.save()
+        _marcar_error(muestra, token)
         return None
+    metrics.inc('pqs_muestras_total', resultado='procesado')
 
-    # 6. Crear una entrada de Clasificacion inicial
-    Clasificacion.objects.update_or_create( # Usar update_or_create
-        muestra=muestra,
-        defaults={'estado_clasificacion': 'pendiente'}
-    )
+    print(f"[{timezone.now()}] ✅ Procesamiento ASÍNCRONO de la Muestra ID '{muestra.id}' completado exitosamente.")
+    return {'status': 'success', 'muestra_id': muestra.id, 'event_id': event_id}
 
-    # 7. Actualizar el estado de la muestra a 'procesado'
-    muestra.timestamp_inicio = timestamps[0]
-    muestra.duracion_ms = int((timestamps[-1] - timestamps[0]).total_seconds() * 1000)
-    muestra.num_puntos = len(valores)
-    muestra.estado_procesamiento = 'procesado'
-    muestra.fecha_procesamiento = timezone.now()
-    muestra.save()
 
-    print(f"[{timezone.now()}] ✅ Procesamiento ASÍNCRONO de la Muestra ID '{muestra.id}' completado exitosamente.")
-    return {'status': 'success', 'muestra_id': muestra.id, 'event_id': event_id}
\ No newline at end of file
+_CAMPOS_ESPECTROGRAMA = ['data_espectrograma', 'metadata_json', 'blob_ref', 'shape', 'dtype', 'checksum', 'piramide',
+                         'huella']
+_CAMPOS_CARACTERISTICAS = ['version', 'vector', 'nombres', 'thd', 'tiempo_desviacion_max_s', 'desviacion_max_relativa']
+_CAMPOS_MUESTRA = ['timestamp_inicio', 'duracion_ms', 'num_puntos', 'estado_procesamiento', 'fecha_procesamiento',
+                   'reclamo_token', 'reclamo_expira']
+
+
+def _guardar_tramo(procesadas, fallidas, reutilizadas, token):
+    """
+    Escribe en una sola transacción los resultados de un tramo: espectrogramas,
+    características y clasificaciones iniciales con bulk_create (actualizando las
+    filas que ya existan) y el estado de las Muestras con bulk_update.
+    `procesadas` es una lista de (muestra, campos_espectrograma, campos_caracteristicas);
+    `reutilizadas`, las Muestras cuyo espectrograma guardado ya era válido.
+    Solo se escriben las Muestras cuyo reclamo sigue siendo de `token`; retorna
+    el conjunto de IDs cuyo reclamo se perdió. Los arreglos que ya se guardaron
+    en el almacén de blobs para filas que no se escriben (reclamo perdido o
+    transacción revertida) quedan sin referencia y los retira limpiar_blobs.
+    """
+    with transaction.atomic():
+        todas = [m.id for m, _, _ in procesadas] + [m.id for m in fallidas] + [m.id for m in reutilizadas]
+        vigentes = conservar_reclamo(todas, token)
+        procesadas = [p for p in procesadas if p[0].id in vigentes]
+        fallidas = [m for m in fallidas if m.id in vigentes]
+        reutilizadas = [m for m in reutilizadas if m.id in vigentes]
+        muestras = [m for m, _, _ in procesadas] + fallidas + reutilizadas
+        if reutilizadas:
+            Clasificacion.objects.bulk_create([Clasificacion(muestra=m) for m in reutilizadas], ignore_conflicts=True)
+        if procesadas:
+            with medir('bd_espectrograma', muestras=len(procesadas)) as etapa:
+                etapa['bytes'] = sum(len(campos['data_espectrograma'] or b'') for _, campos, _ in procesadas)
+                Espectrograma.objects.bulk_create(
+                    [Espectrograma(muestra=m, **campos) for m, campos, _ in procesadas],
+                    update_conflicts=True, unique_fields=['muestra'], update_fields=_CAMPOS_ESPECTROGRAMA,
+                )
+            with medir('bd_caracteristicas', muestras=len(procesadas)):
+                CaracteristicasEvento.objects.bulk_create(
+                    [CaracteristicasEvento(muestra=m, **campos) for m, _, campos in procesadas],
+                    update_conflicts=True, unique_fields=['muestra'], update_fields=_CAMPOS_CARACTERISTICAS,
+                )
+            with medir('bd_clasificacion', muestras=len(procesadas)):
+                Clasificacion.objects.bulk_create(
+                    [Clasificacion(muestra=m, estado_clasificacion='pendiente') for m, _, _ in procesadas],
+                    update_conflicts=True, unique_fields=['muestra'], update_fields=['estado_clasificacion'],
+                )
+        with medir('bd_muestra', muestras=len(muestras)):
+            Muestra.objects.bulk_update(muestras, _CAMPOS_MUESTRA)
+    return set(todas) - vigentes
+
+
+_MAX_ERRORES_TRABAJO = 100 # Errores que se guardan en el TrabajoProcesamiento mientras está en curso
+
+
+def _registrar_avance(trabajo_id, resultado, reportado, fin=False):
+    """
+    Suma al TrabajoProcesamiento `trabajo_id` lo que avanzó el lote desde el
+    último reporte. `reportado` guarda lo ya sumado y se actualiza; con `fin`
+    cuenta además el tramo del chord como terminado.
+    """
+    nuevos = {clave: len(resultado[clave]) - reportado.get(clave, 0) for clave in ('procesadas', 'fallidas', 'omitidas')}
+    if not fin and not any(nuevos.values()):
+        return
+    with transaction.atomic():
+        trabajo = TrabajoProcesamiento.objects.select_for_update().filter(id=trabajo_id).first()
+        if trabajo is None:
+            return
+        trabajo.hechas += nuevos['procesadas']
+        trabajo.fallidas += nuevos['fallidas']
+        trabajo.omitidas += nuevos['omitidas']
+        trabajo.tramos_terminados += int(fin)
+        faltan = _MAX_ERRORES_TRABAJO - len(trabajo.errores)
+        if faltan > 0:
+            trabajo.errores += resultado['fallidas'][reportado.get('fallidas', 0):][:faltan]
+        trabajo.save(update_fields=['hechas', 'fallidas', 'omitidas', 'tramos_terminados', 'errores'])
+    reportado.update({clave: len(resultado[clave]) for clave in nuevos})
+
+
+@shared_task
+def procesar_lote_task(muestra_ids, trabajo_id=None):
+    """
+    Tarea de Celery que procesa muchas Muestras de una vez (p. ej. para reprocesar
+    el histórico). Equivale a ejecutar procesar_evento_completo_task por cada ID,
+    pero las capturas se traen en bloque (caché + pocas consultas a InfluxDB), la
+    MST se calcula por lotes de hasta settings.MST_BATCH_SIZE capturas y los resultados
+    se escriben por tramos de settings.PROCESS_BATCH_CHUNK_SIZE Muestras, con una
+    transacción y unas pocas consultas por tramo.
+
+    Un error en un evento no detiene el lote: la Muestra queda en 'error' y el
+    evento aparece en 'fallidas' con el motivo. Las Muestras de cada tramo se
+    reclaman al empezar el tramo (ver `reclamar_muestras`), así que el reclamo
+    solo tiene que cubrir un tramo; las que ya están procesadas o en proceso en
+    otro worker, y las que pierden el reclamo antes de guardarse, aparecen en
+    'omitidas'. Las que ya tenían un espectrograma con la misma huella no pasan
+    por la MST y se listan además en 'reutilizadas'.
+
+    Con `trabajo_id` (process-pending), el avance se suma al TrabajoProcesamiento
+    al terminar cada tramo.
+    """
+    muestras = {m.id: m for m in Muestra.objects.filter(id__in=muestra_ids)}
+    resultado = {'procesadas': [], 'reutilizadas': [], 'omitidas': [], 'fallidas': []}
+
+    def fallo(muestra_id, motivo):
+        print(f"[{timezone.now()}] Error en la Muestra ID {muestra_id}: {motivo}")
+        resultado['fallidas'].append({'muestra_id': muestra_id, 'error': motivo})
+
+    pendientes = []
+    for muestra_id in dict.fromkeys(muestra_ids):
+        muestra = muestras.get(muestra_id)
+        if muestra is None:
+            fallo(muestra_id, 'No existe la Muestra.')
+        elif muestra.estado_procesamiento == 'procesado':
+            resultado['omitidas'].append(muestra_id)
+        else:
+            pendientes.append(muestra)
+    print(f"[{timezone.now()}] Procesando lote de {len(pendientes)} muestras "
+          f"({len(resultado['omitidas'])} ya procesadas)...")
+
+    tamano_tramo = settings.PROCESS_BATCH_CHUNK_SIZE
+    reportado = {}
+    for inicio in range(0, len(pendientes), tamano_tramo):
+        if trabajo_id:
+            _registrar_avance(trabajo_id, resultado, reportado)
+        # Un reclamo por tramo: vence a los PROCESS_LEASE_S de empezar el tramo, no el lote
+        token = uuid.uuid4()
+        tramo = pendientes[inicio:inicio + tamano_tramo]
+        reclamadas = reclamar_muestras([m.id for m in tramo], token=token)
+        resultado['omitidas'].extend(m.id for m in tramo if m.id not in reclamadas)
+        tramo = [m for m in tramo if m.id in reclamadas]
+        if not tramo:
+            continue
+        procesadas, fallidas, reutilizadas = [], [], []
+
+        def marcar_error(muestra, motivo):
+            _liberar(muestra, 'error')
+            fallidas.append(muestra)
+            fallo(muestra.id, motivo)
+
+        # 1. Capturas del tramo (caché de capturas o InfluxDB, en bloque)
+        try:
+            with medir('captura', muestras=len(tramo)) as etapa:
+                capturas = waveform_cache.get_signals_data(
+                    [m.event_id for m in tramo], starts={m.event_id: m.timestamp_inicio for m in tramo})
+                etapa['bytes'] = sum(np.asarray(valores).nbytes for _, valores in capturas.values())
+        except Exception as e:
+            capturas = {}
+            print(f"[{timezone.now()}] Error al obtener datos de InfluxDB para el tramo: {e}")
+        completas = []
+        huellas = {}
+        for muestra in tramo:
+            captura = capturas.get(muestra.event_id)
+            if captura is None or len(captura[1]) < settings.CAPTURE_NUM_SAMPLES:
+                marcar_error(muestra, f"No se encontraron suficientes datos para el event_id '{muestra.event_id}'.")
+            else:
+                completas.append(muestra)
+                huellas[muestra.id] = huella_procesamiento(captura[1])
+
+        # Las que ya tienen espectrograma y características de la misma captura y parámetros no se recalculan
+        vigentes = set(Espectrograma.objects.filter(muestra_id__in=huellas, muestra__caracteristicas__isnull=False)
+                       .values_list('muestra_id', 'huella'))
+        for muestra in [m for m in completas if (m.id, huellas[m.id]) in vigentes]:
+            completas.remove(muestra)
+            _actualizar_muestra(muestra, *capturas[muestra.event_id])
+            reutilizadas.append(muestra)
+
+        # 2. MST por lotes; si un lote falla, se reintenta evento por evento para aislar el error
+        # (un evento a la vez si el presupuesto de memoria no alcanza para varias matrices de salida)
+        por_mst = _capturas_por_mst()
+        for j in range(0, len(completas), por_mst):
+            lote = completas[j:j + por_mst]
+            matrices = None
+            if len(lote) > 1:
+                senales = np.stack([capturas[m.event_id][1][:settings.CAPTURE_NUM_SAMPLES] for m in lote])
+                try:
+                    matrices = _calcular_mst(senales, lote=True, muestras=len(lote))
+                except Exception as e:
+                    print(f"[{timezone.now()}] Error en la MST del lote, se reintenta por evento: {e}")
+            for k, muestra in enumerate(lote):
+                timestamps, valores = capturas[muestra.event_id]
+                try:
+                    matriz = matrices[k] if matrices is not None else _calcular_mst(valores, muestra_id=muestra.id)
+                    campos_espectrograma, campos_caracteristicas = _campos_evento(valores, matriz, muestra_id=muestra.id)
+                    campos_espectrograma['huella'] = huellas[muestra.id]
+                except Exception as e:
+                    marcar_error(muestra, f"Error al calcular la Transformada de Stockwell: {e}")
+                    continue
+                finally:
+                    matriz = None # Libera la matriz antes de calcular la siguiente
+                _actualizar_muestra(muestra, timestamps, valores)
+                procesadas.append((muestra, campos_espectrograma, campos_caracteristicas))
+            del matrices
+
+        # 3. Escritura del tramo en una transacción
+        try:
+            with medir('bd_tramo', muestras=len(tramo)):
+                perdidas = _guardar_tramo(procesadas, fallidas, reutilizadas, token)
+        except Exception as e:
+            guardadas = [m for m, _, _ in procesadas] + reutilizadas
+            for muestra in guardadas:
+                fallo(muestra.id, f"Error al guardar en PostgreSQL: {e}")
+            Muestra.objects.filter(id__in=[m.id for m in guardadas + fallidas], reclamo_token=token).update(
+                estado_procesamiento='error', reclamo_token=None, reclamo_expira=None)
+            continue
+        if perdidas:
+            print(f"[{timezone.now()}] Se perdió el reclamo de {len(perdidas)} muestras del tramo "
+                  f"(vencieron y otro worker las tomó). Se descartan sus resultados.")
+            resultado['omitidas'].extend(sorted(perdidas))
+            resultado['fallidas'] = [f for f in resultado['fallidas'] if f['muestra_id'] not in perdidas]
+        resultado['procesadas'].extend(m.id for m, _, _ in procesadas if m.id not in perdidas)
+        resultado['procesadas'].extend(m.id for m in reutilizadas if m.id not in perdidas)
+        resultado['reutilizadas'].extend(m.id for m in reutilizadas if m.id not in perdidas)
+
+    print(f"[{timezone.now()}] ✅ Lote terminado: {len(resultado['procesadas'])} procesadas, "
+          f"{len(resultado['fallidas'])} con error, {len(resultado['omitidas'])} omitidas.")
+    if trabajo_id:
+        _registrar_avance(trabajo_id, resultado, reportado, fin=True)
+    for estado, cantidad in (('procesado', len(resultado['procesadas']) - len(resultado['reutilizadas'])),
+                             ('reutilizado', len(resultado['reutilizadas'])),
+                             ('omitido', len(resultado['omitidas'])), ('error', len(resultado['fallidas']))):
+        if cantidad:
+            metrics.inc('pqs_muestras_total', cantidad, resultado=estado)
+    return resultado
+
+
+@shared_task
+def finalizar_trabajo_task(resultados, trabajo_id):
+    """
+    Callback del chord de un TrabajoProcesamiento: recibe los resultados de todos
+    sus procesar_lote_task y guarda el resumen y la hora de término.
+    """
+    resumen = {'procesadas': 0, 'omitidas': 0, 'fallidas': 0, 'errores': []}
+    for resultado in resultados:
+        resumen['procesadas'] += len(resultado['procesadas'])
+        resumen['omitidas'] += len(resultado['omitidas'])
+        resumen['fallidas'] += len(resultado['fallidas'])
+        resumen['errores'].extend(resultado['fallidas'])
+    TrabajoProcesamiento.objects.filter(id=trabajo_id).update(resumen=resumen, fecha_fin=timezone.now())
+    print(f"[{timezone.now()}] Trabajo {trabajo_id} terminado: {resumen['procesadas']} procesadas, "
+          f"{resumen['fallidas']} con error, {resumen['omitidas']} omitidas.")
+    return {'trabajo_id': str(trabajo_id), **{k: v for k, v in resumen.items() if k != 'errores'}}
+
+
+@shared_task
+def trabajo_fallido_task(request, exc, traceback, trabajo_id):
+    """
+    Errback del chord de un TrabajoProcesamiento: si alguna tarea procesar_lote_task
+    falla (p. ej. la base de datos no responde), el callback no se ejecuta. Aquí se
+    cierra el trabajo con lo que las tareas alcanzaron a registrar y el error.
+    """
+    trabajo = TrabajoProcesamiento.objects.filter(id=trabajo_id, fecha_fin__isnull=True).first()
+    if trabajo is None:  # Ya cerrado (el errback puede llegar más de una vez)
+        return
+    resumen = {'procesadas': trabajo.hechas, 'omitidas': trabajo.omitidas, 'fallidas': trabajo.fallidas,
+               'errores': trabajo.errores, 'error': f"{type(exc).__name__}: {exc}"}
+    TrabajoProcesamiento.objects.filter(id=trabajo_id, fecha_fin__isnull=True).update(
+        resumen=resumen, fecha_fin=timezone.now())
+    print(f"[{timezone.now()}] Trabajo {trabajo_id} terminado con fallas: {resumen['error']}")
+
+
+# --- Pipeline por etapas ---
+# obtener_captura_task (E/S) -> calcular_mst_task (CPU) -> guardar_resultados_task (E/S), cada una en su cola
+# (settings.CELERY_TASK_ROUTES). Entre etapas solo viaja un manifiesto pequeño en JSON; la captura y los
+# arreglos del espectrograma quedan en el área temporal local (settings.PIPELINE_STAGING_DIR), así que las
+# tres colas deben atenderse en el mismo host o con ese directorio compartido. Es opcional
+# (settings.PROCESS_STAGED_PIPELINE): sin workers en esas colas las tareas nunca se ejecutarían.
+
+def firma_procesamiento(muestra_id):
+    """Firma de Celery que procesa una Muestra: la cadena por etapas o la tarea única, según settings."""
+    if settings.PROCESS_STAGED_PIPELINE:
+        return chain(obtener_captura_task.s(muestra_id), calcular_mst_task.s(), guardar_resultados_task.s())
+    return procesar_evento_completo_task.s(muestra_id)
+
+
+def _descartar(manifiesto):
+    """Borra del área temporal los arreglos que aún referencia el manifiesto."""
+    staging = get_staging_store()
+    refs = [manifiesto.get('captura_ref'), manifiesto.get('datos_ref')]
+    espectrograma = manifiesto.get('espectrograma') or {}
+    refs.append(espectrograma.get('blob_ref'))
+    refs.extend(nivel['blob_ref'] for nivel in (espectrograma.get('piramide') or {}).get('niveles', []))
+    for ref in refs:
+        if ref:
+            staging.delete(ref)
+
+
+def _fallo_etapa(manifiesto, etapa, error):
+    print(f"[{timezone.now()}] Error en la etapa '{etapa}' de la Muestra ID {manifiesto['muestra_id']}: {error}")
+    _descartar(manifiesto)
+    Muestra.objects.filter(id=manifiesto['muestra_id'], reclamo_token=manifiesto['token']).update(
+        estado_procesamiento='error', reclamo_token=None, reclamo_expira=None)
+    metrics.inc('pqs_muestras_total', resultado='error')
+
+
+@shared_task
+def obtener_captura_task(muestra_id):
+    """
+    Etapa 1 (E/S): reclama la Muestra, trae la captura (caché o InfluxDB) y la
+    deja en el área temporal. Si el espectrograma guardado ya corresponde a la
+    misma captura y parámetros, termina aquí. Retorna el manifiesto para la
+    siguiente etapa, o None si no hay nada que calcular.
+    """
+    get_staging_store().purge(settings.PIPELINE_STAGING_MAX_AGE_S)
+    token = uuid.uuid4()
+    if muestra_id not in reclamar_muestras([muestra_id], token=token):
+        print(f"[{timezone.now()}] La Muestra ID {muestra_id} no existe, ya está procesada o en proceso en otro worker. Omitiendo.")
+        metrics.inc('pqs_muestras_total', resultado='omitido')
+        return None
+    muestra = Muestra.objects.get(id=muestra_id)
+    manifiesto = {'muestra_id': muestra_id, 'token': str(token), 'event_id': muestra.event_id}
+    try:
+        with medir('captura', muestra_id=muestra_id) as etapa:
+            timestamps, valores = waveform_cache.get_signal_data(muestra.event_id, start=muestra.timestamp_inicio)
+            etapa['bytes'] = np.asarray(valores).nbytes
+        if len(valores) < settings.CAPTURE_NUM_SAMPLES:
+            raise ValueError(f"No se encontraron suficientes datos para el event_id '{muestra.event_id}'.")
+    except Exception as e:
+        _fallo_etapa(manifiesto, 'captura', e)
+        return None
+
+    huella = huella_procesamiento(valores)
+    if (Espectrograma.objects.filter(muestra=muestra, huella=huella).exists()
+            and CaracteristicasEvento.objects.filter(muestra=muestra).exists()):
+        print(f"[{timezone.now()}] El espectrograma de la Muestra ID {muestra_id} ya corresponde a esta captura "
+              f"y parámetros. Se reutiliza.")
+        with transaction.atomic():
+            if not conservar_reclamo([muestra_id], token):
+                _reclamo_perdido(muestra_id)
+                return None
+            Clasificacion.objects.get_or_create(muestra=muestra)
+            _actualizar_muestra(muestra, timestamps, valores)
+            muestra.save()
+        metrics.inc('pqs_muestras_total', resultado='reutilizado')
+        return None
+
+    manifiesto.update({
+        'captura_ref': get_staging_store().put_array(np.asarray(valores, dtype=np.float64))[0],
+        'huella': huella,
+        'timestamp_inicio_ns': int(timestamps[0].astype('datetime64[ns]').astype(np.int64)),
+        'duracion_ms': int((timestamps[-1] - timestamps[0]) / np.timedelta64(1, 'ms')),
+        'num_puntos': len(valores),
+    })
+    return manifiesto
+
+
+@shared_task
+def calcular_mst_task(manifiesto):
+    """
+    Etapa 2 (CPU): calcula la MST y las características, codifica el espectrograma
+    y la pirámide y los deja en el área temporal (o, si los espectrogramas se
+    guardan en línea, los bytes comprimidos). Retorna el manifiesto ampliado.
+    """
+    if manifiesto is None:
+        return None
+    if not renovar_reclamo(manifiesto['muestra_id'], manifiesto['token']):
+        print(f"[{timezone.now()}] Se perdió el reclamo de la Muestra ID {manifiesto['muestra_id']}. Omitiendo.")
+        _descartar(manifiesto)
+        return None
+    staging = get_staging_store()
+    try:
+        valores = staging.open_array(manifiesto['captura_ref'], mmap=False)
+        matriz_espectrograma = _calcular_mst(valores, muestra_id=manifiesto['muestra_id'])
+        # Con almacén de blobs configurado, los arreglos van primero al área temporal
+        destino = staging if get_blob_store() is not None else None
+        campos_espectrograma, campos_caracteristicas = _campos_evento(valores, matriz_espectrograma, store=destino,
+                                                                      muestra_id=manifiesto['muestra_id'])
+        del matriz_espectrograma
+        datos = campos_espectrograma.pop('data_espectrograma')
+        manifiesto['datos_ref'] = staging.put_array(np.frombuffer(datos, dtype=np.uint8))[0] if datos else None
+    except Exception as e:
+        _fallo_etapa(manifiesto, 'mst', e)
+        return None
+    staging.delete(manifiesto.pop('captura_ref'))
+    manifiesto['espectrograma'] = campos_espectrograma
+    manifiesto['caracteristicas'] = campos_caracteristicas
+    return manifiesto
+
+
+@shared_task
+def guardar_resultados_task(manifiesto):
+    """
+    Etapa 3 (E/S): pasa los arreglos del área temporal al almacén definitivo y
+    escribe Espectrograma, CaracteristicasEvento, Clasificacion y el estado de la
+    Muestra en una transacción.
+    """
+    if manifiesto is None:
+        return None
+    muestra_id = manifiesto['muestra_id']
+    if not renovar_reclamo(muestra_id, manifiesto['token']):
+        print(f"[{timezone.now()}] Se perdió el reclamo de la Muestra ID {muestra_id}. Omitiendo.")
+        _descartar(manifiesto)
+        return None
+    staging = get_staging_store()
+    try:
+        campos_espectrograma = dict(manifiesto['espectrograma'], huella=manifiesto['huella'])
+        if manifiesto.get('datos_ref'):
+            campos_espectrograma['data_espectrograma'] = staging.open_array(manifiesto['datos_ref'], mmap=False).tobytes()
+        else:
+            campos_espectrograma['data_espectrograma'] = None
+        store = get_blob_store()
+        with medir('promocion_blobs', muestra_id=muestra_id):
+            if campos_espectrograma.get('blob_ref'):
+                campos_espectrograma['blob_ref'], campos_espectrograma['checksum'] = staging.promote(
+                    campos_espectrograma['blob_ref'], campos_espectrograma['checksum'], store)
+            for nivel in (campos_espectrograma.get('piramide') or {}).get('niveles', []):
+                nivel['blob_ref'], nivel['checksum'] = staging.promote(nivel['blob_ref'], nivel['checksum'], store)
+
+        with transaction.atomic():
+            # Se vuelve a comprobar el reclamo con la fila bloqueada: pudo vencer durante la promoción
+            if not conservar_reclamo([muestra_id], manifiesto['token']):
+                _descartar(manifiesto)
+                _reclamo_perdido(muestra_id)
+                return None
+            muestra = Muestra.objects.get(id=muestra_id)
+            with medir('bd_espectrograma', muestra_id=muestra_id) as etapa:
+                etapa['bytes'] = len(campos_espectrograma['data_espectrograma'] or b'')
+                Espectrograma.objects.update_or_create(muestra=muestra, defaults=campos_espectrograma)
+            with medir('bd_caracteristicas', muestra_id=muestra_id):
+                CaracteristicasEvento.objects.update_or_create(muestra=muestra, defaults=manifiesto['caracteristicas'])
+            with medir('bd_clasificacion', muestra_id=muestra_id):
+                Clasificacion.objects.update_or_create(muestra=muestra, defaults={'estado_clasificacion': 'pendiente'})
+            muestra.timestamp_inicio = pd.Timestamp(manifiesto['timestamp_inicio_ns'], tz='UTC').to_pydatetime(warn=False)
+            muestra.duracion_ms = manifiesto['duracion_ms']
+            muestra.num_puntos = manifiesto['num_puntos']
+            _liberar(muestra, 'procesado')
+            muestra.fecha_procesamiento = timezone.now()
+            with medir('bd_muestra', muestra_id=muestra_id):
+                muestra.save()
+    except Exception as e:
+        _fallo_etapa(manifiesto, 'guardado', e)
+        return None
+    if manifiesto.get('datos_ref'):
+        staging.delete(manifiesto['datos_ref'])
+    metrics.inc('pqs_muestras_total', resultado='procesado')
+    print(f"[{timezone.now()}] ✅ Procesamiento por etapas de la Muestra ID '{muestra_id}' completado exitosamente.")
+    return {'status': 'success', 'muestra_id': muestra_id, 'event_id': manifiesto['event_id']}
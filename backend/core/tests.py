@@ -1,3 +1,1786 @@
-from django.test import TestCase
+import asyncio
+import base64
+import io
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import time
+import tracemalloc
+import uuid
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+import redis
+from django.conf import settings
+from django.core.management import call_command
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import blobstore
+from .analysis.benchmark import _thread_counts
+from .analysis.features import ENERGY_BANDS_HZ, extract_features, feature_names
+from .analysis.pyramid import build_pyramid, magnitude_to_db_u8, read_window, tile_range
+from .analysis.stockwell import (
+    MST_ALPHA, MST_FS, MST_P_ORDER, kaiser_window_bank, kaiser_window_rows, modified_stockwell_transform,
+    modified_stockwell_transform_loop, mst_processing, mst_processing_batch, mst_to_memmap, normalize_signals,
+    window_bank_cache,
+)
+from .analysis.synthetic import EVENT_TYPES, F0, FS, NUM_SAMPLES, PRE_TRIGGER_CYCLES, generate_event, generate_event_set
+from .analysis.window_cache import WindowBankCache
+from .capture_frames import FRAME_HEADER, PACKET_LEN, PAYLOAD_LEN, build_frame, fletcher16, split_frames
+from .blobstore import DirectoryObjectStore, LocalBlobStore, StagingBlobStore
+from .ingestion import IngestionGateway, register_captures, store_captures
+from .influx_client import InfluxService, decode_packed_capture, encode_packed_samples
+from .metrics import Metrics, medir
+from .models import CaracteristicasEvento, Clasificacion, Espectrograma, Muestra, TrabajoProcesamiento
+from .render_cache import RenderCache, render_cache
+from .spectrogram_format import (
+    ENCODINGS, FORMAT_NAME, available_codecs, decode_array, decode_spectrogram, encode_array,
+    encode_spectrogram,
+)
+from .spectrogram_storage import pyramid_fields, spectrogram_fields
+from .streaming import parse_range, ranged_response
+from .tasks import (
+    _calcular_mst, _capturas_por_mst, _registrar_avance, calcular_mst_task, conservar_reclamo, finalizar_trabajo_task,
+    firma_procesamiento, guardar_resultados_task, huella_procesamiento, obtener_captura_task,
+    procesar_evento_completo_task, procesar_lote_task, reclamar_muestras, renovar_reclamo, trabajo_fallido_task,
+)
+from .waveform_cache import WaveformCache, pack_waveform, unpack_waveform
+
+
+def _senal(N=256, fs=MST_FS, seed=0):
+    """Fundamental de 60 Hz con un transitorio y ruido, como una captura normalizada."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(N) / fs
+    signal = np.sin(2 * np.pi * 60 * t) + 0.3 * np.sin(2 * np.pi * 1500 * t) * (t > t[N // 2])
+    return signal + 0.01 * rng.standard_normal(N)
+
+
+def _mst_referencia(signal, fs=MST_FS, p=MST_P_ORDER, alpha=MST_ALPHA):
+    with mock.patch('builtins.print'):
+        mst, _, _ = modified_stockwell_transform_loop(signal, fs, p=p, alpha=alpha)
+    return mst
+
+
+def _crear_muestra(estado='pendiente', **campos):
+    campos.setdefault('event_id', str(uuid.uuid4()))
+    return Muestra.objects.create(timestamp_inicio=timezone.now(), duracion_ms=166, frecuencia_muestreo_hz=MST_FS,
+                                  estado_procesamiento=estado, **campos)
+
+
+class _SinSalida:
+    """Silencia los print de progreso de la MST."""
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch('builtins.print')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class _BancoTemporal:
+    """Persiste los bancos de ventanas en un directorio temporal, no en MST_WINDOW_CACHE_DIR."""
+
+    def setUp(self):
+        super().setUp()
+        self.directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directorio, ignore_errors=True)
+        patcher = mock.patch.object(window_bank_cache, 'directory', self.directorio)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        window_bank_cache.clear()
+        self.addCleanup(window_bank_cache.clear)
+
+
+class _AlmacenTemporal:
+    """Almacén de blobs local en un directorio temporal (settings.SPECTROGRAM_STORAGE)."""
+
+    def setUp(self):
+        super().setUp()
+        self.raiz = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.raiz, ignore_errors=True)
+        almacen = override_settings(SPECTROGRAM_STORAGE={'BACKEND': 'core.blobstore.LocalBlobStore',
+                                                        'OPTIONS': {'root': f"{self.raiz}/blobs"}})
+        almacen.enable()
+        self.addCleanup(almacen.disable)
+        patcher = mock.patch.object(blobstore, '_store', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.store = blobstore.get_blob_store()
+
+
+class EventosSinteticosTests(SimpleTestCase):
+    """Capturas sintéticas de la suite de benchmarks."""
+
+    def test_conjunto_de_eventos(self):
+        eventos = generate_event_set()
+        self.assertEqual(tuple(eventos), EVENT_TYPES)
+        for evento, captura in eventos.items():
+            with self.subTest(evento=evento):
+                self.assertEqual(captura.shape, (NUM_SAMPLES,))
+                self.assertEqual(captura.dtype, np.uint16)
+
+    def test_reproducible(self):
+        np.testing.assert_array_equal(generate_event('sag', seed=3), generate_event('sag', seed=3))
+
+    def test_amplitud_durante_el_evento(self):
+        t = np.arange(NUM_SAMPLES) / FS
+        durante = (t >= PRE_TRIGGER_CYCLES / F0) & (t < (PRE_TRIGGER_CYCLES + 4) / F0)
+        normal = generate_event('normal', noise=0, as_adc=False)
+        for evento, relacion in (('sag', 0.5), ('swell', 1.4)):
+            with self.subTest(evento=evento):
+                senal = generate_event(evento, noise=0, as_adc=False)
+                rms = np.sqrt(np.mean(senal[durante] ** 2)) / np.sqrt(np.mean(normal[durante] ** 2))
+                self.assertAlmostEqual(rms, relacion, places=6)
+
+    def test_tipo_invalido(self):
+        with self.assertRaises(ValueError):
+            generate_event('flicker')
+
+
+class BenchmarkSuiteTests(_SinSalida, _BancoTemporal, SimpleTestCase):
+    """El comando benchmark_suite mide cada variante y guarda los resultados en JSON."""
+
+    def test_resultados_en_json(self):
+        salida = f"{self.directorio}/resultados.json"
+        call_command('benchmark_suite', eventos=['sag'], repeticiones=1, sin_lote=True, sin_serializacion=True,
+                     salida=salida, stdout=io.StringIO())
+        with open(salida, encoding='utf-8') as f:
+            reporte = json.load(f)
+
+        self.assertEqual(reporte['metadatos']['num_muestras'], NUM_SAMPLES)
+        self.assertEqual(reporte['metadatos']['repeticiones'], 1)
+        resultados = {r['variante']: r for r in reporte['resultados'] if r['evento'] == 'sag'}
+        self.assertIn('double', resultados)
+        self.assertIn('single', resultados)
+        for variante, r in resultados.items():
+            with self.subTest(variante=variante):
+                self.assertGreater(r['tiempo_min_s'], 0)
+                self.assertGreaterEqual(r['pico_memoria_mb'], 0)
+                self.assertGreater(r['tamano_salida_bytes'], 0)
+                self.assertLess(r['error_relativo_max'], 1e-5)
+        # La salida completa es complex64 de (N / 2, N)
+        self.assertEqual(resultados['double']['tamano_salida_bytes'], NUM_SAMPLES // 2 * NUM_SAMPLES * 8)
+
+
+class _MSTTestCase(_SinSalida, _BancoTemporal, SimpleTestCase):
+    """Base de las pruebas de la MST: señal de 256 puntos y su MST de referencia con bucle."""
+
+    def setUp(self):
+        super().setUp()
+        self.signal = _senal()
+        self.referencia = _mst_referencia(self.signal)
+
+    def mst(self, signal=None, **kwargs):
+        signal = self.signal if signal is None else signal
+        return modified_stockwell_transform(signal, MST_FS, p=MST_P_ORDER, alpha=MST_ALPHA, **kwargs)
+
+    def assertMSTClose(self, actual, esperada, rtol=1e-5):
+        np.testing.assert_allclose(actual, esperada, rtol=rtol, atol=rtol * np.abs(esperada).max())
+
+
+class MSTVectorizadaTests(_MSTTestCase):
+    """La MST vectorizada con banco de ventanas contra la implementación con bucle."""
+
+    def test_igual_al_bucle(self):
+        mst, freqs, t = self.mst(precision='double')
+        self.assertEqual(mst.dtype, np.complex64)
+        self.assertEqual(mst.shape, self.referencia.shape)
+        self.assertMSTClose(mst, self.referencia)
+        np.testing.assert_allclose(freqs, np.fft.fftfreq(256, 1 / MST_FS)[:128])
+        np.testing.assert_allclose(t, np.arange(256) / MST_FS)
+
+    def test_potencia_no_entera_igual_al_bucle(self):
+        referencia = _mst_referencia(self.signal, p=1.5)
+        mst, _, _ = modified_stockwell_transform(self.signal, MST_FS, p=1.5, alpha=MST_ALPHA, precision='double')
+        self.assertMSTClose(mst, referencia, rtol=1e-4)
+
+    def test_filas_del_banco(self):
+        banco = kaiser_window_bank(256, MST_FS, p=MST_P_ORDER, alpha=MST_ALPHA, block_rows=16)
+        self.assertEqual(banco.shape, (128, 256))
+        self.assertFalse(banco[0].any())  # La fila DC es cero
+        filas = np.array([1, 7, 100])
+        np.testing.assert_array_equal(kaiser_window_rows(filas, 256, MST_FS, p=MST_P_ORDER, alpha=MST_ALPHA),
+                                      banco[filas])
+
+    def test_banco_con_forma_incorrecta(self):
+        with self.assertRaises(ValueError):
+            self.mst(window_bank=np.zeros((10, 256)))
+
+    def test_lote_igual_a_cada_captura(self):
+        lote = np.stack([_senal(seed=k) for k in range(3)])
+        mst, _, _ = self.mst(lote)
+        self.assertEqual(mst.shape, (3, 128, 256))
+        for k in range(3):
+            individual, _, _ = self.mst(lote[k])
+            np.testing.assert_allclose(mst[k], individual, rtol=1e-6, atol=1e-6 * np.abs(individual).max())
+
+    def test_normalizacion_por_captura(self):
+        lote = np.stack([_senal(seed=0) * 3 + 5, _senal(seed=1)])
+        lote[1, 10] = np.nan
+        normalizadas = normalize_signals(lote)
+        self.assertTrue(np.isnan(lote[1, 10]))  # No modifica la entrada
+        sin_nan = lote[1].copy()
+        sin_nan[10] = 0.0
+        np.testing.assert_array_equal(normalizadas[1], normalize_signals(sin_nan)[0])
+        np.testing.assert_allclose(np.abs(normalizadas).max(axis=1), 1.0)
+        np.testing.assert_array_equal(normalize_signals(np.zeros(8)), np.zeros((1, 8)))
+
+    def test_pipeline_por_lotes(self):
+        lote = np.stack([_senal(seed=k) for k in range(2)])
+        timings = {}
+        mst = mst_processing_batch(lote, timings=timings)
+        self.assertEqual(set(timings), {'normalizacion', 'mst'})
+        for k in range(2):
+            individual = mst_processing(lote[k])
+            np.testing.assert_allclose(mst[k], individual, rtol=1e-6, atol=1e-6 * np.abs(individual).max())
+
+    def test_banda_y_decimacion(self):
+        completa, freqs_completas, t_completo = self.mst(precision='double')
+        mst, freqs, t = self.mst(precision='double', f_min=500, f_max=3000, decimation=4)
+        filas = (freqs_completas >= 500) & (freqs_completas <= 3000)
+        np.testing.assert_allclose(freqs, freqs_completas[filas])
+        np.testing.assert_allclose(t, t_completo[::4])
+        self.assertMSTClose(mst, completa[filas][:, ::4])
+
+    def test_banda_vacia_y_decimacion_invalida(self):
+        with self.assertRaises(ValueError):
+            self.mst(f_min=3000, f_max=2000)
+        with self.assertRaises(ValueError):
+            self.mst(decimation=3)
+
+    def test_precision_simple(self):
+        mst, _, _ = self.mst(precision='single')
+        self.assertEqual(mst.dtype, np.complex64)
+        self.assertMSTClose(mst, self.referencia)
+
+    def test_precision_por_defecto_es_doble(self):
+        np.testing.assert_array_equal(mst_processing(self.signal), mst_processing(self.signal, precision='double'))
+        lote = np.stack([self.signal, _senal(seed=1)])
+        np.testing.assert_array_equal(mst_processing_batch(lote), mst_processing_batch(lote, precision='double'))
+
+    def test_pipeline_usa_mst_precision(self):
+        for precision in ('single', 'double'):
+            with self.subTest(precision=precision), override_settings(MST_PRECISION=precision), \
+                    mock.patch('core.tasks.mst_processing', wraps=mst_processing) as procesar, \
+                    mock.patch('core.tasks.medir'), mock.patch('core.tasks.registrar_etapa'):
+                _calcular_mst(self.signal)
+                self.assertEqual(procesar.call_args.kwargs['precision'], precision)
+        with override_settings(MST_PRECISION='double'):
+            doble = huella_procesamiento(self.signal)
+        self.assertNotEqual(huella_procesamiento(self.signal), doble)
+
+    def test_por_bloques_igual_a_la_completa(self):
+        for precision, dtype in (('double', np.float64), ('single', np.float32)):
+            with self.subTest(precision=precision):
+                completa, _, _ = self.mst(precision=precision)
+                # Un presupuesto mínimo obliga a bloques de una sola fila
+                por_bloques, _, _ = self.mst(precision=precision, max_memory=1)
+                np.testing.assert_array_equal(por_bloques, completa)
+                # Con directorio, el banco se construye en disco y se lee mapeado
+                banco = window_bank_cache.get_bounded(256, MST_FS, p=MST_P_ORDER, alpha=MST_ALPHA, dtype=dtype)
+                self.assertIsInstance(banco, np.memmap)
+                np.testing.assert_array_equal(
+                    banco, kaiser_window_bank(256, MST_FS, p=MST_P_ORDER, alpha=MST_ALPHA, dtype=dtype))
+
+    def test_por_bloques_sin_directorio_calcula_las_ventanas(self):
+        completa, _, _ = self.mst(precision='single')
+        window_bank_cache.clear()
+        with mock.patch.object(window_bank_cache, 'directory', None):
+            self.assertIsNone(window_bank_cache.get_bounded(256, MST_FS, p=MST_P_ORDER, alpha=MST_ALPHA,
+                                                            dtype=np.float32))
+            por_bloques, _, _ = self.mst(precision='single', max_memory=1)
+        self.assertMSTClose(por_bloques, completa, rtol=1e-6)
+
+    def test_out_memmap(self):
+        completa, _, _ = self.mst()
+        path = f"{self.directorio}/mst.npy"
+        mst, _, _ = mst_to_memmap(self.signal, MST_FS, path, max_memory=1, p=MST_P_ORDER, alpha=MST_ALPHA)
+        self.assertIsInstance(mst, np.memmap)
+        np.testing.assert_array_equal(np.load(path, mmap_mode='r'), completa)
+
+    def test_out_con_forma_incorrecta(self):
+        with self.assertRaises(ValueError):
+            self.mst(out=np.empty((10, 256), dtype=np.complex64))
+
+    def test_varios_hilos(self):
+        completa, _, _ = self.mst()
+        for kwargs in ({'workers': 3}, {'workers': 2, 'max_memory': 2 ** 40}, {'workers': 0}):
+            with self.subTest(**kwargs):
+                mst, _, _ = self.mst(**kwargs)
+                self.assertMSTClose(mst, completa, rtol=1e-6)
+
+    def test_hilos_del_escalamiento(self):
+        for cpus, esperado in ((1, [1]), (2, [1, 2]), (6, [1, 2, 4, 6]), (8, [1, 2, 4, 8]), (None, [1])):
+            with self.subTest(cpus=cpus), mock.patch('os.cpu_count', return_value=cpus):
+                self.assertEqual(_thread_counts(), esperado)
+
+
+class CacheBancosTests(_BancoTemporal, SimpleTestCase):
+    """Caché LRU de bancos de ventanas persistida como .npy mapeados en memoria."""
+
+    def setUp(self):
+        super().setUp()
+        self.construidos = []
+
+    def builder(self, N, fs, **kwargs):
+        self.construidos.append((N, fs))
+        return kaiser_window_bank(N, fs, **kwargs)
+
+    def cache(self, **kwargs):
+        return WindowBankCache(builder=self.builder, **kwargs)
+
+    def test_memoria_lru(self):
+        cache = self.cache(max_entries=2)
+        primero = cache.get(64, MST_FS)
+        self.assertIs(cache.get(64, MST_FS), primero)
+        self.assertFalse(primero.flags.writeable)
+        cache.get(128, MST_FS)
+        cache.get(256, MST_FS)  # Desaloja el de N=64
+        cache.get(64, MST_FS)
+        self.assertEqual(self.construidos, [(64, MST_FS), (128, MST_FS), (256, MST_FS), (64, MST_FS)])
+
+    def test_persistido_se_comparte_entre_procesos(self):
+        banco = self.cache(directory=self.directorio).get(64, MST_FS, p=MST_P_ORDER, alpha=MST_ALPHA)
+        self.assertIsInstance(banco, np.memmap)
+        # Otra instancia (otro worker) lo abre del disco sin construirlo
+        otro = self.cache(directory=self.directorio).get(64, MST_FS, p=MST_P_ORDER, alpha=MST_ALPHA)
+        self.assertEqual(len(self.construidos), 1)
+        np.testing.assert_array_equal(otro, kaiser_window_bank(64, MST_FS, p=MST_P_ORDER, alpha=MST_ALPHA))
+        self.assertEqual([n for n in os.listdir(self.directorio) if n.endswith('.tmp')], [])
+
+    def test_archivo_corrupto_se_reconstruye(self):
+        cache = self.cache(directory=self.directorio)
+        cache.get(64, MST_FS)
+        path = cache._path(cache._key(64, MST_FS, 2, 1.0, np.float64))
+        with open(path, 'wb') as f:
+            f.write(b'basura')
+        with mock.patch('builtins.print'):
+            banco = self.cache(directory=self.directorio).get(64, MST_FS)
+        self.assertEqual(len(self.construidos), 2)
+        np.testing.assert_array_equal(banco, kaiser_window_bank(64, MST_FS))
+
+    def test_clave_incluye_parametros_y_dtype(self):
+        cache = self.cache(directory=self.directorio)
+        cache.get(64, MST_FS, p=1)
+        cache.get(64, MST_FS, p=2)
+        cache.get(64, MST_FS, p=2, dtype=np.float32)
+        self.assertEqual(len(self.construidos), 3)
+        self.assertEqual(len(os.listdir(self.directorio)), 3)
+
+
+class FormatoEspectrogramaTests(SimpleTestCase):
+    """Ida y vuelta del formato compacto de espectrogramas."""
+
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        self.matriz = (rng.standard_normal((32, 64)) + 1j * rng.standard_normal((32, 64))).astype(np.complex64)
+
+    def test_complex64_sin_perdidas(self):
+        for codec in available_codecs():
+            with self.subTest(codec=codec):
+                data, header = encode_spectrogram(self.matriz, encoding='complex64', codec=codec)
+                self.assertEqual(header['format'], FORMAT_NAME)
+                self.assertEqual(header['codec'], codec)
+                self.assertEqual(header['shape'], [32, 64])
+                np.testing.assert_array_equal(decode_spectrogram(data, header), self.matriz)
+
+    def test_codificaciones_de_magnitud(self):
+        magnitud = np.abs(self.matriz)
+        tolerancias = {'mag_f16': 1e-3, 'db_u16': 1e-3, 'db_u8': 0.06}
+        for encoding in ENCODINGS:
+            if encoding == 'complex64':
+                continue
+            with self.subTest(encoding=encoding):
+                data, header = encode_spectrogram(self.matriz, encoding=encoding, codec='zlib')
+                decodificada = decode_spectrogram(data, header)
+                self.assertEqual(decodificada.dtype, np.float32)
+                error = np.abs(decodificada - magnitud).max() / magnitud.max()
+                self.assertLess(error, tolerancias[encoding])
+
+    def test_porcion_del_arreglo_codificado(self):
+        stored, params = encode_array(self.matriz, encoding='mag_f16')
+        header = {'encoding': 'mag_f16', **params}
+        np.testing.assert_array_equal(decode_array(stored[4:8, 10:20], header),
+                                      decode_array(stored, header)[4:8, 10:20])
+
+    def test_pickle_legado(self):
+        np.testing.assert_array_equal(decode_spectrogram(pickle.dumps(self.matriz), None), self.matriz)
+
+    def test_firma_y_parametros_invalidos(self):
+        data, header = encode_spectrogram(self.matriz, codec='zlib')
+        with self.assertRaises(ValueError):
+            decode_spectrogram(b'XXXX' + data[4:], header)
+        with self.assertRaises(ValueError):
+            decode_spectrogram(data[:4] + bytes([99]) + data[5:], header)
+        with self.assertRaises(ValueError):
+            encode_spectrogram(self.matriz, encoding='float8')
+
+
+class MigrarEspectrogramasTests(TestCase):
+    """El comando migrar_espectrogramas reescribe los pickles en el formato compacto."""
+
+    def setUp(self):
+        self.matriz = (np.arange(12).reshape(3, 4) * (1 + 1j)).astype(np.complex64)
+        self.legado = Espectrograma.objects.create(muestra=_crear_muestra('procesado'),
+                                                   data_espectrograma=pickle.dumps(self.matriz))
+
+    def migrar(self, **opciones):
+        call_command('migrar_espectrogramas', codec='zlib', stdout=io.StringIO(), **opciones)
+        self.legado.refresh_from_db()
+
+    def test_dry_run_no_modifica(self):
+        self.migrar(dry_run=True)
+        self.assertIsNone(self.legado.metadata_json)
+
+    def test_migra_y_es_idempotente(self):
+        self.migrar()
+        self.assertEqual(self.legado.metadata_json['format'], FORMAT_NAME)
+        data = bytes(self.legado.data_espectrograma)
+        np.testing.assert_array_equal(decode_spectrogram(data, self.legado.metadata_json), self.matriz)
+        self.migrar()
+        self.assertEqual(bytes(self.legado.data_espectrograma), data)
+
+    def test_recodificar(self):
+        self.migrar()
+        self.migrar(encoding='mag_f16', recodificar=True)
+        self.assertEqual(self.legado.metadata_json['encoding'], 'mag_f16')
+        # La fase ya se perdió: no vuelve a complex64
+        self.migrar(encoding='complex64', recodificar=True)
+        self.assertEqual(self.legado.metadata_json['encoding'], 'mag_f16')
+
+
+class CaracteristicasTests(SimpleTestCase):
+    """Vector de características de eventos sintéticos."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.caracteristicas = {}
+        with mock.patch('builtins.print'):
+            for evento in ('normal', 'sag', 'harmonics'):
+                senal = generate_event(evento).astype(np.float64)
+                mst = mst_processing(senal, precision='single')
+                resultado = extract_features(senal, mst, FS, f0=F0)
+                cls.caracteristicas[evento] = dict(zip(resultado['nombres'], resultado['vector']))
+
+    def test_longitud_fija(self):
+        nombres = feature_names(NUM_SAMPLES // 512)
+        self.assertEqual(len(nombres), len(ENERGY_BANDS_HZ) + 1 + 2 * 10 + 3)
+        for evento, caracteristicas in self.caracteristicas.items():
+            with self.subTest(evento=evento):
+                self.assertEqual(list(caracteristicas), nombres)
+                fracciones = [caracteristicas[n] for n in nombres[:len(ENERGY_BANDS_HZ)]]
+                self.assertAlmostEqual(sum(fracciones), 1.0, places=6)
+
+    def test_thd(self):
+        self.assertLess(self.caracteristicas['normal']['thd'], 0.01)
+        self.assertGreater(self.caracteristicas['harmonics']['thd'], 0.1)
+
+    def test_caida_de_tension(self):
+        sag = self.caracteristicas['sag']
+        self.assertAlmostEqual(sag['rms_ciclo_3'] / sag['rms_ciclo_0'], 0.5, places=2)
+        # Con p=1 y alpha=0.05 la ventana de 60 Hz abarca varios ciclos y suaviza la caída
+        self.assertGreater(sag['desviacion_max_relativa'], 0.05)
+        self.assertLess(self.caracteristicas['normal']['desviacion_max_relativa'], 1e-3)
+        self.assertTrue(PRE_TRIGGER_CYCLES / F0 <= sag['tiempo_desviacion_max_s'] <= (PRE_TRIGGER_CYCLES + 4) / F0)
+
+
+class AlmacenBlobsTests(SimpleTestCase):
+    """Backends del almacén de arreglos direccionado por contenido."""
+
+    def setUp(self):
+        self.raiz = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.raiz, ignore_errors=True)
+        self.arreglo = np.arange(24, dtype=np.float16).reshape(4, 6)
+
+    def backends(self):
+        yield LocalBlobStore(f"{self.raiz}/local")
+        yield DirectoryObjectStore(f"{self.raiz}/bucket", f"{self.raiz}/cache")
+
+    def test_ida_y_vuelta_deduplicada(self):
+        for store in self.backends():
+            with self.subTest(backend=type(store).__name__):
+                ref, checksum = store.put_array(self.arreglo)
+                self.assertEqual(store.put_array(self.arreglo.copy()), (ref, checksum))
+                self.assertTrue(checksum.startswith('sha256:'))
+                leido = store.open_array(ref)
+                self.assertIsInstance(leido, np.memmap)
+                self.assertFalse(leido.flags.writeable)
+                np.testing.assert_array_equal(leido, self.arreglo)
+                self.assertEqual([r for r, _ in store.list_refs()], [ref])
+                self.assertIsNotNone(store.modified_at(ref))
+                store.delete(ref)
+                self.assertFalse(store.exists(ref))
+                self.assertIsNone(store.modified_at(ref))
+
+    def test_objeto_se_descarga_a_la_cache(self):
+        store = DirectoryObjectStore(f"{self.raiz}/bucket", f"{self.raiz}/cache")
+        ref, _ = store.put_array(self.arreglo)
+        shutil.rmtree(f"{self.raiz}/cache")
+        np.testing.assert_array_equal(store.open_array(ref), self.arreglo)
+
+    def test_area_temporal_promueve_y_purga(self):
+        staging = StagingBlobStore(f"{self.raiz}/staging")
+        store = LocalBlobStore(f"{self.raiz}/local")
+        ref, checksum = staging.put_array(self.arreglo)
+        self.assertNotEqual(staging.put_array(self.arreglo)[0], ref)  # Sin deduplicar
+        final_ref, final_checksum = staging.promote(ref, checksum, store)
+        self.assertEqual(final_checksum, checksum)
+        self.assertFalse(staging.exists(ref))
+        np.testing.assert_array_equal(store.open_array(final_ref), self.arreglo)
+        self.assertEqual(staging.purge(max_age_s=-1), 1)
+        self.assertEqual(os.listdir(f"{self.raiz}/staging"), [])
+
+
+class MoverYLimpiarBlobsTests(_AlmacenTemporal, TestCase):
+    """mover_espectrogramas_a_blobs conserva la codificación; limpiar_blobs borra solo los huérfanos."""
+
+    def setUp(self):
+        super().setUp()
+        rng = np.random.default_rng(2)
+        self.matriz = (rng.standard_normal((16, 32)) + 1j * rng.standard_normal((16, 32))).astype(np.complex64)
+
+    def crear(self, data, header=None):
+        return Espectrograma.objects.create(muestra=_crear_muestra('procesado'), data_espectrograma=data,
+                                            metadata_json=header)
+
+    def test_mover_conserva_la_codificacion(self):
+        magnitud = self.crear(*encode_spectrogram(self.matriz, encoding='mag_f16', codec='zlib'))
+        legado = self.crear(pickle.dumps(self.matriz))
+        call_command('mover_espectrogramas_a_blobs', stdout=io.StringIO())
+
+        magnitud.refresh_from_db()
+        self.assertIsNone(magnitud.data_espectrograma)
+        self.assertEqual(magnitud.metadata_json['encoding'], 'mag_f16')
+        esperada = decode_spectrogram(*encode_spectrogram(self.matriz, encoding='mag_f16', codec='zlib'))
+        np.testing.assert_array_equal(decode_array(self.store.open_array(magnitud.blob_ref), magnitud.metadata_json),
+                                      esperada)
+        legado.refresh_from_db()
+        self.assertEqual(legado.metadata_json['encoding'], 'complex64')
+        np.testing.assert_array_equal(self.store.open_array(legado.blob_ref), self.matriz)
+        self.assertTrue(legado.piramide['niveles'])
+
+    def test_limpiar_borra_solo_huerfanos(self):
+        conservado, borrado = self.crear(pickle.dumps(self.matriz)), self.crear(pickle.dumps(self.matriz * 2))
+        call_command('mover_espectrogramas_a_blobs', stdout=io.StringIO())
+        conservado.refresh_from_db()
+        borrado.refresh_from_db()
+        ref_borrado = borrado.blob_ref
+        borrado.delete()
+
+        call_command('limpiar_blobs', antiguedad=0, dry_run=True, stdout=io.StringIO())
+        self.assertTrue(self.store.exists(ref_borrado))
+        # Con la antigüedad por defecto los recién escritos no se tocan
+        call_command('limpiar_blobs', stdout=io.StringIO())
+        self.assertTrue(self.store.exists(ref_borrado))
+        call_command('limpiar_blobs', antiguedad=0, stdout=io.StringIO())
+        self.assertFalse(self.store.exists(ref_borrado))
+        self.assertTrue(self.store.exists(conservado.blob_ref))
+        for nivel in conservado.piramide['niveles']:
+            self.assertTrue(self.store.exists(nivel['blob_ref']))
+
+
+class PiramideTests(SimpleTestCase):
+    """Pirámide de teselas de magnitud para visualización con zoom."""
+
+    def setUp(self):
+        rng = np.random.default_rng(3)
+        self.matriz = (rng.standard_normal((40, 80)) + 1j * rng.standard_normal((40, 80))).astype(np.complex64)
+
+    def test_niveles(self):
+        niveles, escala = build_pyramid(self.matriz, tile_size=16)
+        self.assertAlmostEqual(escala, float(np.abs(self.matriz).max()), places=5)
+        self.assertEqual([forma for _, forma in niveles], [(40, 80), (20, 40), (10, 20), (5, 10)])
+        self.assertEqual([teselas.shape[:2] for teselas, _ in niveles], [(3, 5), (2, 3), (1, 2), (1, 1)])
+        # El máximo de cada bloque conserva el pico en todos los niveles
+        for teselas, _ in niveles:
+            self.assertEqual(teselas.max(), 255)
+
+    def test_ventana_desde_teselas(self):
+        nivel, _ = magnitude_to_db_u8(self.matriz)
+        niveles, _ = build_pyramid(self.matriz, tile_size=16)
+        teselas = niveles[0][0]
+        np.testing.assert_array_equal(read_window(teselas, 5, 37, 14, 70), nivel[5:37, 14:70])
+
+    def test_tile_range(self):
+        self.assertEqual(tile_range(None, None, 1.0, 16, 5), (0, 4))
+        self.assertEqual(tile_range(16, 40, 1.0, 16, 5), (1, 2))
+        self.assertEqual(tile_range(-100, 1e6, 1.0, 16, 5), (0, 4))
+
+
+@override_settings(SPECTROGRAM_TILE_SIZE=16)
+class TeselasViewTests(_AlmacenTemporal, TestCase):
+    """Endpoint /api/espectrogramas/{id}/tiles/."""
+
+    def setUp(self):
+        super().setUp()
+        matriz = np.random.default_rng(3).standard_normal((40, 80)).astype(np.complex64)
+        self.espectrograma = Espectrograma.objects.create(muestra=_crear_muestra('procesado'),
+                                                          **pyramid_fields(matriz, MST_FS))
+        self.url = f'/api/espectrogramas/{self.espectrograma.pk}/tiles/'
+        self.client = APIClient()
+
+    def test_nivel_mas_grueso_por_defecto(self):
+        respuesta = self.client.get(self.url)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta.data['nivel'], 3)
+        self.assertEqual(len(respuesta.data['teselas']), 1)
+
+    def test_ventana_en_unidades_fisicas(self):
+        descripcion = self.espectrograma.piramide['niveles'][0]
+        respuesta = self.client.get(self.url, {'nivel': 0, 'f_min': 0, 'f_max': 16 * descripcion['df_hz'],
+                                               't_min': 16 * descripcion['dt_s'], 't_max': 48 * descripcion['dt_s']})
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual([(t['fila'], t['columna']) for t in respuesta.data['teselas']], [(0, 1), (0, 2)])
+        self.assertEqual(len(base64.b64decode(respuesta.data['teselas'][0]['data'])), 16 * 16)
+
+    def test_parametros_no_validos(self):
+        for params in ({'nivel': 9}, {'nivel': 'x'}, {'t_max': 'nan'}, {'f_max': 'inf'}, {'t_min': '-1e400'}):
+            with self.subTest(**params):
+                self.assertEqual(self.client.get(self.url, params).status_code, 400)
+        with override_settings(SPECTROGRAM_MAX_TILES_PER_REQUEST=2):
+            self.assertEqual(self.client.get(self.url, {'nivel': 0}).status_code, 400)
+
+    def test_sin_piramide(self):
+        Espectrograma.objects.filter(pk=self.espectrograma.pk).update(piramide=None)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+
+class StreamingTests(SimpleTestCase):
+    """Range, If-None-Match e If-Range de las descargas por streaming."""
+
+    contenido = bytes(range(256)) * 4
+    etag = '"abc-npy"'
+
+    def responder(self, **headers):
+        request = RequestFactory().get('/descarga', **headers)
+        return ranged_response(request, lambda: io.BytesIO(self.contenido), len(self.contenido), self.etag)
+
+    def test_parse_range(self):
+        self.assertIsNone(parse_range(None, 100))
+        self.assertEqual(parse_range('bytes=0-9', 100), (0, 9))
+        self.assertEqual(parse_range('bytes=90-', 100), (90, 99))
+        self.assertEqual(parse_range('bytes=90-500', 100), (90, 99))
+        self.assertEqual(parse_range('bytes=-10', 100), (90, 99))
+        self.assertEqual(parse_range('bytes=-500', 100), (0, 99))
+        self.assertEqual(parse_range('bytes=100-', 100), 'invalido')
+        self.assertEqual(parse_range('bytes=9-0', 100), 'invalido')
+        self.assertEqual(parse_range('bytes=-0', 100), 'invalido')
+        # Varios intervalos u otra unidad se ignoran: se responde completo
+        self.assertIsNone(parse_range('bytes=0-1,5-6', 100))
+        self.assertIsNone(parse_range('items=0-1', 100))
+        self.assertIsNone(parse_range('bytes=-', 100))
+
+    def test_completo(self):
+        response = self.responder()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.contenido)
+        self.assertEqual(response['ETag'], self.etag)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+    def test_parcial(self):
+        response = self.responder(HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(self.contenido)}')
+        self.assertEqual(response['Content-Length'], '100')
+        self.assertEqual(b''.join(response.streaming_content), self.contenido[100:200])
+
+    def test_no_modificado(self):
+        for valor in (self.etag, f'"otro", W/{self.etag}', '*'):
+            with self.subTest(valor=valor):
+                response = self.responder(HTTP_IF_NONE_MATCH=valor)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response['ETag'], self.etag)
+        self.assertEqual(self.responder(HTTP_IF_NONE_MATCH='"otro"').status_code, 200)
+
+    def test_rango_no_satisfacible(self):
+        response = self.responder(HTTP_RANGE=f'bytes={len(self.contenido)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.contenido)}')
+
+    def test_if_range_con_otro_etag_envia_completo(self):
+        self.assertEqual(self.responder(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"viejo"').status_code, 200)
+        self.assertEqual(self.responder(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=self.etag).status_code, 206)
+
+
+class DescargaEspectrogramaTests(TestCase):
+    """Endpoint de descarga de espectrogramas guardados en línea."""
+
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directorio, ignore_errors=True)
+        ajustes = override_settings(SPECTROGRAM_DOWNLOAD_CACHE_DIR=self.directorio)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        muestra = _crear_muestra('procesado')
+        self.matriz = np.abs(np.random.default_rng(5).standard_normal((16, 32))).astype(np.float32)
+        data, header = encode_spectrogram(self.matriz, encoding='mag_f16', codec='zlib')
+        self.espectrograma = Espectrograma.objects.create(muestra=muestra, data_espectrograma=data,
+                                                          metadata_json=header, checksum='sha256:abc123')
+        self.url = f'/api/espectrogramas/{self.espectrograma.pk}/download/'
+        self.client = APIClient()
+
+    def test_descarga_y_304_sin_leer_el_arreglo(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], '"abc123-npy"')
+        stored = np.load(io.BytesIO(b''.join(response.streaming_content)))
+        np.testing.assert_allclose(decode_array(stored, self.espectrograma.metadata_json), self.matriz, rtol=1e-3)
+
+        with mock.patch('core.spectrogram_storage.open_stored_spectrogram') as abrir:
+            parcial = self.client.get(self.url, HTTP_RANGE='bytes=0-9')
+            no_modificado = self.client.get(self.url, HTTP_IF_NONE_MATCH='"abc123-npy"')
+        self.assertEqual(parcial.status_code, 206)
+        self.assertEqual(no_modificado.status_code, 304)
+        abrir.assert_not_called()  # El .npy se armó una vez y el 304 no toca el arreglo
+
+    def test_formatos(self):
+        self.assertEqual(self.client.get(self.url + '?formato=zip').status_code, 400)
+        with mock.patch('core.spectrogram_storage.pyarrow', None):
+            self.assertEqual(self.client.get(self.url + '?formato=arrow').status_code, 406)
+
+
+class DescargaDesdeBlobsTests(_AlmacenTemporal, TestCase):
+    """Los espectrogramas del almacén de blobs se sirven directamente desde su archivo .npy."""
+
+    def test_descarga_del_archivo(self):
+        matriz = np.abs(np.random.default_rng(5).standard_normal((16, 32))).astype(np.complex64)
+        espectrograma = Espectrograma.objects.create(muestra=_crear_muestra('procesado'),
+                                                     **spectrogram_fields(matriz, encoding='complex64'))
+        respuesta = APIClient().get(f'/api/espectrogramas/{espectrograma.pk}/download/')
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta['ETag'], f'"{espectrograma.checksum.removeprefix("sha256:")}-npy"')
+        with open(self.store.local_path(espectrograma.blob_ref), 'rb') as f:
+            self.assertEqual(b''.join(respuesta.streaming_content), f.read())
+
+
+class CacheRenderTests(SimpleTestCase):
+    """Caché LRU de imágenes acotada por bytes, en memoria o compartida en un directorio."""
+
+    def test_en_memoria(self):
+        cache = RenderCache(max_bytes=100)
+        cache.put('a', b'x' * 40)
+        cache.put('b', b'y' * 40)
+        self.assertEqual(cache.get('a'), b'x' * 40)  # 'a' pasa a ser la más reciente
+        cache.put('c', b'z' * 40)
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('a'))
+        cache.put('grande', b'g' * 101)  # Nunca cabría: no desaloja nada
+        self.assertIsNone(cache.get('grande'))
+        self.assertIsNotNone(cache.get('c'))
+        self.assertEqual((cache.hits, cache.misses), (3, 2))
+
+    def test_en_directorio(self):
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio, ignore_errors=True)
+        cache = RenderCache(max_bytes=100, directory=directorio)
+        cache.put('aa', b'x' * 40)
+        cache.put('bb', b'y' * 40)
+        ahora = time.time()
+        os.utime(cache._path('aa'), (ahora - 100, ahora - 100))
+        os.utime(cache._path('bb'), (ahora - 50, ahora - 50))
+        self.assertEqual(cache.get('aa'), b'x' * 40)  # El acierto renueva su fecha
+        cache.put('cc', b'z' * 40)
+        self.assertIsNone(cache.get('bb'))
+        # Otro proceso con el mismo directorio ve las imágenes
+        self.assertEqual(RenderCache(max_bytes=100, directory=directorio).get('cc'), b'z' * 40)
+
+
+@override_settings(SPECTROGRAM_TILE_SIZE=16)
+class RenderEspectrogramaTests(_AlmacenTemporal, TestCase):
+    """Endpoint /api/espectrogramas/{id}/render/."""
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(render_cache, 'directory', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        render_cache.clear()
+        self.addCleanup(render_cache.clear)
+        matriz = np.random.default_rng(4).standard_normal((40, 80)).astype(np.complex64)
+        self.espectrograma = Espectrograma.objects.create(
+            muestra=_crear_muestra('procesado'), checksum='sha256:abc',
+            **pyramid_fields(matriz, MST_FS))
+        self.url = f'/api/espectrogramas/{self.espectrograma.pk}/render/'
+        self.client = APIClient()
+
+    def test_png_y_cache(self):
+        respuesta = self.client.get(self.url, {'ancho': 30, 'alto': 20, 'colormap': 'magma'})
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta['Content-Type'], 'image/png')
+        self.assertTrue(respuesta.content.startswith(b'\x89PNG\r\n\x1a\n'))
+        self.assertEqual(respuesta.content[16:24], (30).to_bytes(4, 'big') + (20).to_bytes(4, 'big'))
+
+        with mock.patch('core.views.render_spectrogram') as renderizar:
+            repetida = self.client.get(self.url, {'ancho': 30, 'alto': 20, 'colormap': 'magma'})
+            no_modificada = self.client.get(self.url, {'ancho': 30, 'alto': 20, 'colormap': 'magma'},
+                                            HTTP_IF_NONE_MATCH=respuesta['ETag'])
+        renderizar.assert_not_called()
+        self.assertEqual(repetida.content, respuesta.content)
+        self.assertEqual(no_modificada.status_code, 304)
+
+    def test_parametros_no_finitos(self):
+        for params in ({'f_max': 'inf'}, {'t_max': '1e400'}, {'t_min': '-inf'}, {'f_min': 'nan'},
+                       {'db_min': 'nan'}, {'db_min': '-inf'}):
+            with self.subTest(**params):
+                self.assertEqual(self.client.get(self.url, params).status_code, 400)
+
+    def test_parametros_no_validos(self):
+        for params in ({'ancho': 'x'}, {'ancho': 0}, {'db_min': 5}, {'escala': 'log'}, {'colormap': 'rainbow'},
+                       {'formato': 'gif'}, {'f_min': 3000, 'f_max': 2000}):
+            with self.subTest(**params):
+                self.assertEqual(self.client.get(self.url, params).status_code, 400)
+
+
+class _ConsultasInflux:
+    """
+    query_api falso: registra las consultas Flux y responde con DataFrames
+    preparados, o con los que retorne `frames(consulta)` si es una función.
+    """
+
+    def __init__(self, frames=()):
+        self.frames = frames
+        self.consultas = []
+
+    def query_data_frame_stream(self, query, org=None):
+        self.consultas.append(query)
+        return iter(self.frames(query) if callable(self.frames) else self.frames)
+
+
+def _puntos(event_id, start_ns, n=NUM_SAMPLES, period_ns=32552, result='points'):
+    """DataFrame como los de InfluxDB con `n` puntos individuales de un evento (valor = índice)."""
+    return pd.DataFrame({
+        'result': result,
+        '_time': pd.to_datetime(start_ns + np.arange(n, dtype=np.int64) * period_ns, utc=True),
+        '_value': np.arange(n, dtype=np.float64),
+        'event_id': event_id,
+    })
+
+
+def _empaquetada(event_id, start_ns, samples, period_ns=32552):
+    """DataFrame como los de InfluxDB con una captura empaquetada."""
+    return pd.DataFrame({
+        'result': ['packed'],
+        '_time': pd.to_datetime([start_ns], utc=True),
+        'event_id': [event_id],
+        'payload': [encode_packed_samples(samples)],
+        'sampling_period_ns': [period_ns],
+    })
+
+
+class _InfluxTestCase(SimpleTestCase):
+    """InfluxService con un query_api falso (no requiere un servidor de InfluxDB)."""
+
+    inicio_ns = 1_700_000_000_000_000_000
+
+    def setUp(self):
+        super().setUp()
+        self.service = InfluxService()
+        self.consultas = _ConsultasInflux()
+        patcher = mock.patch.object(self.service, '_query_api', self.consultas)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class ConsultasInfluxTests(_InfluxTestCase):
+    """Consultas por evento acotadas en el tiempo y leídas por columnas."""
+
+    def test_rango_del_evento(self):
+        margen, duracion = 10 ** 9, NUM_SAMPLES * 32552
+        self.assertEqual(self.service._event_range(str(self.inicio_ns)),
+                         (self.inicio_ns - margen, self.inicio_ns + duracion + margen))
+        self.assertIsNone(self.service._event_range('evento-7'))
+        self.assertEqual(self.service._event_range('evento-7', start=pd.Timestamp(self.inicio_ns, tz='UTC'))[0],
+                         self.inicio_ns - margen)
+        self.assertEqual(self.service._range_clause(None, None), 'range(start: 0)')
+        self.assertEqual(self.service._range_clause(0, 10 ** 9),
+                         'range(start: 1970-01-01T00:00:00.000000000Z, stop: 1970-01-01T00:00:01.000000000Z)')
+
+    def test_captura_ordenada_y_recortada(self):
+        event_id = str(self.inicio_ns)
+        frame = _puntos(event_id, self.inicio_ns, n=NUM_SAMPLES + 10)
+        self.consultas.frames = [frame.iloc[::-1], pd.DataFrame()]
+        timestamps, valores = self.service.get_signal_data(event_id, 'voltage_waveform')
+        self.assertEqual(timestamps.dtype, np.dtype('datetime64[ns]'))
+        np.testing.assert_array_equal(valores, np.arange(NUM_SAMPLES))
+        self.assertEqual(int(timestamps[0].astype(np.int64)), self.inicio_ns)
+
+        consulta, = self.consultas.consultas
+        self.assertIn(self.service._range_clause(*self.service._event_range(event_id)), consulta)
+        self.assertIn(f'r.event_id =~ /^({event_id})$/', consulta)
+
+    def test_sin_rango_consulta_toda_la_historia(self):
+        with mock.patch('builtins.print'):
+            timestamps, valores = self.service.get_signal_data('evento-7', 'voltage_waveform')
+        self.assertEqual(len(valores), 0)
+        self.assertIn('range(start: 0)', self.consultas.consultas[0])
+
+
+class ConsultasInfluxPorLotesTests(_InfluxTestCase):
+    """Capturas de muchos eventos con pocas consultas."""
+
+    def test_agrupa_eventos_cercanos(self):
+        cercanos = [str(self.inicio_ns), str(self.inicio_ns + 10 * 10 ** 9)]
+        lejano = str(self.inicio_ns + 7 * 3600 * 10 ** 9)
+        self.consultas.frames = [
+            pd.concat([_puntos(e, int(e)) for e in cercanos + [lejano]]),
+            _puntos('legado', self.inicio_ns + 20 * 10 ** 9),
+        ]
+        inicio_legado = pd.Timestamp(self.inicio_ns + 20 * 10 ** 9, tz='UTC')
+        with mock.patch('builtins.print'):
+            capturas = self.service.get_signals_data(cercanos + [lejano, 'legado', 'sin-fecha', cercanos[0]],
+                                                     starts={'legado': inicio_legado})
+
+        # Un grupo con los dos cercanos y el legado, otro con el lejano y uno sin acotar
+        self.assertEqual(len(self.consultas.consultas), 3)
+        primera, segunda, sin_acotar = self.consultas.consultas
+        self.assertIn(f'/^({cercanos[0]}|{cercanos[1]}|legado)$/', primera)
+        self.assertIn(f'/^({lejano})$/', segunda)
+        self.assertIn('range(start: 0)', sin_acotar)
+        self.assertIn('/^(sin\\-fecha)$/', sin_acotar)
+        self.assertEqual(set(capturas), set(cercanos + [lejano, 'legado']))
+        lote = np.stack([valores for _, valores in capturas.values()])
+        self.assertEqual(lote.shape, (4, NUM_SAMPLES))
+
+    def test_ventana_sin_event_ids(self):
+        self.consultas.frames = [_puntos('a', self.inicio_ns), _puntos('b', self.inicio_ns + 10 ** 9)]
+        capturas = self.service.get_signals_data(start=pd.Timestamp(self.inicio_ns, tz='UTC'),
+                                                 stop=pd.Timestamp(self.inicio_ns + 60 * 10 ** 9, tz='UTC'))
+        self.assertEqual(set(capturas), {'a', 'b'})
+        self.assertNotIn('r.event_id =~', self.consultas.consultas[0])
+        with self.assertRaises(ValueError):
+            self.service.get_signals_data(start=pd.Timestamp(self.inicio_ns, tz='UTC'))
+
+
+class CapturaEmpaquetadaTests(_InfluxTestCase):
+    """
+    Capturas empaquetadas en InfluxDB. Las consultas Flux se verifican como
+    texto contra un query_api falso, no contra un servidor de InfluxDB.
+    """
+
+    def test_ida_y_vuelta(self):
+        muestras = np.arange(NUM_SAMPLES) % 4096
+        timestamps, valores = decode_packed_capture(encode_packed_samples(muestras), self.inicio_ns, 32552)
+        self.assertEqual(valores.dtype, np.float64)
+        np.testing.assert_array_equal(valores, muestras)
+        self.assertEqual(timestamps.dtype, np.dtype('datetime64[ns]'))
+        self.assertEqual(int(timestamps[0].astype(np.int64)), self.inicio_ns)
+        self.assertTrue(np.all(np.diff(timestamps.astype(np.int64)) == 32552))
+
+    def test_rechaza_valores_que_no_caben_en_uint16(self):
+        for muestras in ([0, 70000], [-1, 2], [0.5, 1]):
+            with self.subTest(muestras=muestras), self.assertRaises(ValueError):
+                encode_packed_samples(np.array(muestras))
+
+    def test_consulta_combinada(self):
+        consulta = self.service._captures_query('voltage_waveform', 'range(start: 0)', ['a'])
+        self.assertIn('r._measurement == "voltage_capture"', consulta)
+        self.assertIn('r._measurement == "voltage_waveform"', consulta)
+        self.assertIn('empaquetados = packed |> findColumn(fn: (key) => true, column: "event_id")', consulta)
+        self.assertIn('not contains(value: r.event_id, set: empaquetados)', consulta)
+        self.assertEqual(consulta.count('yield('), 2)
+        self.assertIn('yield(name: "packed")', consulta)
+        self.assertIn('yield(name: "points")', consulta)
+
+    def test_consultas_de_un_solo_formato(self):
+        self.service.get_packed_captures(['a'], 0, 10 ** 9)
+        self.service.get_point_captures(['a'], 0, 10 ** 9)
+        empaquetadas, puntos = self.consultas.consultas
+        self.assertIn('"voltage_capture"', empaquetadas)
+        self.assertNotIn('"voltage_waveform"', empaquetadas)
+        self.assertIn('"voltage_waveform"', puntos)
+        self.assertNotIn('"voltage_capture"', puntos)
+        self.assertNotIn('yield(', empaquetadas + puntos)
+
+    def test_lee_ambos_formatos(self):
+        empaquetado, por_puntos = str(self.inicio_ns), str(self.inicio_ns + 10 ** 9)
+        muestras = np.arange(NUM_SAMPLES) % 4096
+        self.consultas.frames = [_empaquetada(empaquetado, self.inicio_ns, muestras),
+                                 _puntos(por_puntos, int(por_puntos))]
+        capturas = self.service.get_signals_data([empaquetado, por_puntos])
+        self.assertEqual(len(self.consultas.consultas), 1)
+        np.testing.assert_array_equal(capturas[empaquetado][1], muestras)
+        np.testing.assert_array_equal(capturas[por_puntos][1], np.arange(NUM_SAMPLES))
+
+    def test_escritura_en_ambos_modos(self):
+        escritor = mock.Mock()
+        captura = {'event_id': 'a', 'samples': np.array([1, 2, 3], dtype=np.uint16), 'start_ns': self.inicio_ns,
+                   'location': 'Lab A'}
+        with mock.patch.object(self.service, '_write_api', escritor):
+            self.service.write_captures([captura], mode='packed')
+            self.service.write_captures([captura], mode='points')
+            with self.assertRaises(ValueError):
+                self.service.write_captures([captura], mode='csv')
+        empaquetada, = escritor.write.call_args_list[0].kwargs['record']
+        linea = empaquetada.to_line_protocol()
+        self.assertTrue(linea.startswith('voltage_capture,event_id=a,location=Lab\\ A '))
+        self.assertIn(f'payload="{encode_packed_samples([1, 2, 3])}"', linea)
+        puntos = escritor.write.call_args_list[1].kwargs['record']
+        self.assertEqual(puntos[1], f'voltage_waveform,event_id=a,location=Lab\\ A value=2 {self.inicio_ns + 32552}')
+
+    def test_comando_empaquetar_capturas(self):
+        event_ids = [str(self.inicio_ns), str(self.inicio_ns + 10 ** 9)]
+        escritas = {}
+
+        def responder(consulta):
+            if '"voltage_capture"' in consulta:
+                return [_empaquetada(e, int(e), escritas[e]) for e in event_ids if e in escritas]
+            return [_puntos(e, int(e)) for e in event_ids]
+
+        def escribir(capturas, mode=None):
+            self.assertEqual(mode, 'packed')
+            escritas.update((c['event_id'], c['samples']) for c in capturas)
+
+        self.consultas.frames = responder
+        with mock.patch('core.management.commands.empaquetar_capturas.influx_service', self.service), \
+                mock.patch.object(self.service, 'write_captures', side_effect=escribir) as escritura, \
+                mock.patch.object(self.service, 'delete_points') as borrar:
+            call_command('empaquetar_capturas', event_ids=event_ids, borrar_puntos=True, stdout=io.StringIO())
+            self.assertEqual(set(escritas), set(event_ids))
+            self.assertEqual(sorted(c.args for c in borrar.call_args_list), [
+                (e, int(e), int(e) + (NUM_SAMPLES - 1) * 32552 + 1) for e in event_ids])
+            # Una segunda corrida no vuelve a escribirlos
+            call_command('empaquetar_capturas', event_ids=event_ids, stdout=io.StringIO())
+            self.assertEqual(escritura.call_count, 1)
+
+
+class _RedisFalso:
+    """Lo mínimo de redis.Redis que usa la caché de capturas, en memoria."""
+
+    def __init__(self):
+        self.datos = {}
+        self.hashes = {}
+
+    def mget(self, keys):
+        return [self.datos.get(k) for k in keys]
+
+    def set(self, key, value, ex=None):
+        self.datos[key] = value
+
+    def delete(self, key):
+        self.datos.pop(key, None)
+
+    def hincrby(self, key, field, value):
+        campos = self.hashes.setdefault(key, {})
+        campos[field] = campos.get(field, 0) + value
+
+    def hmget(self, key, fields):
+        return [self.hashes.get(key, {}).get(f) for f in fields]
+
+    def pipeline(self, transaction=True):
+        redis_falso = self
+
+        class Pipeline:
+            def __getattr__(self, nombre):
+                return getattr(redis_falso, nombre)
+
+            def execute(self):
+                return []
+
+        return Pipeline()
+
+
+class CacheCapturasTests(SimpleTestCase):
+    """Caché de lectura de capturas delante de InfluxDB (LRU local y Redis)."""
+
+    inicio_ns = 1_700_000_000_000_000_000
+
+    def captura(self, desplazamiento=0, n=NUM_SAMPLES):
+        timestamps = (self.inicio_ns + desplazamiento + np.arange(n, dtype=np.int64) * 32552).astype('datetime64[ns]')
+        return timestamps, (np.arange(n) % 4096).astype(np.float64)
+
+    def cache(self, redis_falso=None, **kwargs):
+        cache = WaveformCache(redis_url='redis://falso' if redis_falso else None, **kwargs)
+        cache._redis = redis_falso
+        return cache
+
+    def test_formato_compacto(self):
+        timestamps, valores = self.captura()
+        datos = pack_waveform(timestamps, valores)
+        self.assertLess(len(datos), valores.size * 2 + 64)  # uint16 y tiempos como inicio + periodo
+        for original, leido in zip((timestamps, valores), unpack_waveform(datos)):
+            np.testing.assert_array_equal(leido, original)
+        # Valores no enteros y tiempos no uniformes se guardan completos
+        irregulares = timestamps[[0, 1, 5]], np.array([0.5, -1.0, 2.0])
+        for original, leido in zip(irregulares, unpack_waveform(pack_waveform(*irregulares))):
+            np.testing.assert_array_equal(leido, original)
+
+    def test_lectura_a_traves_de_la_cache(self):
+        cache = self.cache()
+        capturas = {'a': self.captura(), 'b': self.captura(10 ** 9), 'corta': self.captura(n=100)}
+        with mock.patch('core.waveform_cache.influx_service') as influx:
+            influx.get_signals_data.side_effect = lambda ids, **kwargs: {e: capturas[e] for e in ids}
+            cache.get_signals_data(['a', 'corta'])
+            resultado = cache.get_signals_data(['a', 'b', 'corta'])
+        # Solo se consultan los que faltan; las capturas incompletas no se guardan
+        self.assertEqual([c.args[0] for c in influx.get_signals_data.call_args_list], [['a', 'corta'], ['b', 'corta']])
+        np.testing.assert_array_equal(resultado['a'][1], capturas['a'][1])
+        estadisticas = cache.get_stats()
+        self.assertEqual((estadisticas['hits_local'], estadisticas['misses']), (1, 4))
+        self.assertEqual(estadisticas['entradas_locales'], 2)
+
+    def test_lru_acotada_por_bytes(self):
+        tamano = len(pack_waveform(*self.captura()))
+        cache = self.cache(max_bytes=2 * tamano)
+        for event_id in ('a', 'b', 'c'):
+            cache.put_many({event_id: self.captura()})
+        self.assertEqual(set(cache.get_many(['a', 'b', 'c'])), {'b', 'c'})
+
+    def test_redis_compartido_entre_procesos(self):
+        redis_falso = _RedisFalso()
+        self.cache(redis_falso).put_many({'a': self.captura()})
+        otro = self.cache(redis_falso)
+        self.assertIn('a', otro.get_many(['a']))
+        self.assertIn('a', otro.get_many(['a']))
+        estadisticas = otro.get_stats()
+        self.assertEqual(estadisticas['alcance'], 'global')
+        self.assertEqual((estadisticas['hits_redis'], estadisticas['hits_local']), (1, 1))
+        otro.invalidate('a')
+        self.assertEqual(self.cache(redis_falso).get_many(['a']), {})
+
+    def test_redis_caido(self):
+        redis_falso = mock.Mock()
+        redis_falso.mget.side_effect = redis.ConnectionError('sin conexión')
+        cache = self.cache(redis_falso)
+        cache.put_many({'a': self.captura()})
+        with mock.patch('builtins.print') as aviso:
+            self.assertEqual(cache.get_many(['b']), {})
+            self.assertIsNone(cache.redis)  # Se omite hasta el siguiente reintento
+            self.assertIn('a', cache.get_many(['a']))
+        aviso.assert_called_once()
+
+
+class TramasCapturaTests(SimpleTestCase):
+    """Fletcher-16 y separación de las tramas del STM32."""
+
+    @staticmethod
+    def checksum_firmware(data):
+        # Traducción directa de calculate_checksum() en esp32_paquet.c
+        sum1 = sum2 = 0
+        for byte in data:
+            sum1 = (sum1 + byte) % 255
+            sum2 = (sum2 + sum1) % 255
+        return (sum2 << 8) | sum1
+
+    def test_fletcher16_igual_al_firmware(self):
+        rng = np.random.default_rng(2)
+        for n in (1, 2, 255, 256, 1000):
+            data = rng.integers(0, 256, n, dtype=np.uint8).tobytes()
+            with self.subTest(n=n):
+                self.assertEqual(int(fletcher16(data)), self.checksum_firmware(data))
+        # Peor caso de la trama completa: todos los bytes en 0xFF
+        data = b'\xff' * PAYLOAD_LEN
+        self.assertEqual(int(fletcher16(data)), self.checksum_firmware(data))
+
+    def test_fletcher16_por_lotes(self):
+        rng = np.random.default_rng(3)
+        payloads = rng.integers(0, 256, (4, PAYLOAD_LEN), dtype=np.uint8)
+        esperados = [self.checksum_firmware(p.tobytes()) for p in payloads]
+        self.assertEqual(fletcher16(payloads).tolist(), esperados)
+
+    def test_build_y_split_frames(self):
+        rng = np.random.default_rng(4)
+        muestras = [rng.integers(0, 4096, PAYLOAD_LEN // 2) for _ in range(3)]
+        tramas = [build_frame(m) for m in muestras]
+        self.assertTrue(all(len(t) == PACKET_LEN and t.startswith(FRAME_HEADER) for t in tramas))
+
+        # Basura antes, entre y después de las tramas, una longitud inválida y una trama truncada
+        invalida = FRAME_HEADER + (PAYLOAD_LEN - 2).to_bytes(2, 'little')
+        data = b'xyz' + tramas[0] + invalida + tramas[1] + b'\x00\x01' + tramas[2] + tramas[0][:100]
+        frames, descartados = split_frames(data)
+        self.assertEqual(len(frames), 3)
+        for (payload, checksum), m in zip(frames, muestras):
+            np.testing.assert_array_equal(np.frombuffer(payload, dtype='<u2'), m)
+            self.assertEqual(checksum, int(fletcher16(payload)))
+        self.assertEqual(descartados, 3 + len(invalida) + 2 + 100)
+
+    def test_build_frame_numero_de_muestras(self):
+        with self.assertRaises(ValueError):
+            build_frame(np.zeros(10))
+
+
+class _EscritorFalso:
+    """Lo que usa el gateway de asyncio.StreamWriter; guarda lo escrito."""
+
+    def __init__(self):
+        self.datos = bytearray()
+
+    def write(self, data):
+        self.datos += data
+
+    async def drain(self):
+        pass
+
+    def get_extra_info(self, nombre):
+        return ('10.0.0.7', 5000) if nombre == 'peername' else None
+
+    def close(self):
+        pass
+
+
+class GatewayIngestaTests(TransactionTestCase):
+    """
+    Gateway de ingesta por HTTP hasta la base de datos, con el sink real
+    (store_captures): las Muestras se crean desde los hilos del pool de escritura.
+    """
+
+    def setUp(self):
+        rng = np.random.default_rng(6)
+        self.muestras = [rng.integers(0, 4096, PAYLOAD_LEN // 2) for _ in range(3)]
+        tramas = [build_frame(m) for m in self.muestras]
+        corrupta = bytearray(tramas[2])
+        corrupta[10] ^= 0xFF
+        self.cuerpo = tramas[0] + tramas[1] + b'basura' + bytes(corrupta)
+        for patcher in (mock.patch('core.ingestion.waveform_cache', WaveformCache()),
+                        mock.patch('core.ingestion.group')):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch('core.ingestion.influx_service')
+        self.influx = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def ingerir(self, gateway):
+        async def ejecutar():
+            gateway.queue = asyncio.Queue(maxsize=gateway.queue_size)
+            reader = asyncio.StreamReader(limit=2 * PACKET_LEN)
+            reader.feed_data(b'POST /frames HTTP/1.1\r\nContent-Length: %d\r\nX-Device-Id: stm32-1\r\n'
+                             b'Connection: close\r\n\r\n' % len(self.cuerpo) + self.cuerpo)
+            reader.feed_eof()
+            escritor = _EscritorFalso()
+            await gateway.handle_http(reader, escritor)
+            tarea = asyncio.create_task(gateway._writer_loop())
+            while not (gateway.stats['lotes_escritos'] or gateway.stats['errores_escritura']):
+                await asyncio.sleep(0.01)
+            tarea.cancel()
+            return bytes(escritor.datos)
+
+        respuesta = asyncio.run(ejecutar())
+        gateway._executor.shutdown()
+        return respuesta
+
+    def test_http_hasta_la_base_de_datos(self):
+        gateway = IngestionGateway(writers=1, flush_interval=0.05)
+        respuesta = self.ingerir(gateway)
+        self.assertTrue(respuesta.startswith(b'HTTP/1.1 202 Accepted'))
+        self.assertEqual(json.loads(respuesta.split(b'\r\n\r\n', 1)[1]), {'tramas': 3, 'bytes_descartados': 6})
+        self.assertEqual((gateway.stats['tramas_validas'], gateway.stats['checksum_invalido']), (2, 1))
+        self.assertEqual(gateway.stats['errores_escritura'], 0)
+
+        capturas, = [c.args[0] for c in self.influx.write_captures.call_args_list]
+        for captura, muestras in zip(capturas, self.muestras):
+            np.testing.assert_array_equal(captura['samples'], muestras)
+        filas = Muestra.objects.order_by('event_id')
+        self.assertEqual([m.event_id for m in filas], [c['event_id'] for c in capturas])
+        for muestra in filas:
+            self.assertEqual((muestra.estado_procesamiento, muestra.origen_hardware), ('pendiente', 'stm32-1'))
+            self.assertEqual(muestra.num_puntos, PAYLOAD_LEN // 2)
+
+    def test_conexiones_viejas_se_cierran_en_cada_lote(self):
+        with mock.patch('core.ingestion.close_old_connections') as cerrar:
+            gateway = IngestionGateway(sink=lambda capturas: cerrar.assert_called_once(), writers=1,
+                                       flush_interval=0.05)
+            self.ingerir(gateway)
+        self.assertEqual(gateway.stats['lotes_escritos'], 1)
+        self.assertEqual(cerrar.call_count, 2)
+
+
+class RegistroCapturasTests(TestCase):
+    """Las capturas recibidas crean sus Muestras y solo se encolan las insertadas por esta llamada."""
+
+    def setUp(self):
+        patcher = mock.patch('core.ingestion.group')
+        self.group = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def captura(event_id):
+        return {'event_id': event_id, 'samples': np.zeros(NUM_SAMPLES, dtype=np.uint16),
+                'start_ns': int(event_id), 'device_id': 'stm32-1'}
+
+    def encoladas(self):
+        generador = self.group.call_args.args[0]
+        return [firma.args[0] for firma in generador]
+
+    def test_crea_y_encola_las_nuevas(self):
+        existente = _crear_muestra(event_id='1700000000000000000')
+        capturas = [self.captura('1700000000000000000'), self.captura('1700000001000000000')]
+        ids = register_captures(capturas + [self.captura('1700000001000000000')])
+        nueva = Muestra.objects.get(event_id='1700000001000000000')
+        self.assertEqual(ids, [nueva.id])
+        self.assertEqual(self.encoladas(), [nueva.id])
+        self.assertIsNone(nueva.reclamo_token)
+        self.assertIsNotNone(nueva.lote_ingesta)
+        self.assertEqual(nueva.duracion_ms, (NUM_SAMPLES - 1) * 32552 // 1_000_000)
+        existente.refresh_from_db()
+        self.assertIsNone(existente.lote_ingesta)
+        self.assertEqual(register_captures(capturas), [])
+
+    def test_no_encola_las_que_inserto_otro_gateway(self):
+        bulk_create = Muestra.objects.bulk_create
+
+        def otro_gateway_primero(filas, **kwargs):
+            _crear_muestra(event_id='1700000000000000000', lote_ingesta=uuid.uuid4())
+            return bulk_create(filas, **kwargs)
+
+        with mock.patch.object(Muestra.objects, 'bulk_create', side_effect=otro_gateway_primero):
+            ids = register_captures([self.captura('1700000000000000000'), self.captura('1700000001000000000')])
+        self.assertEqual(ids, [Muestra.objects.get(event_id='1700000001000000000').id])
+
+    def test_sin_broker_quedan_pendientes(self):
+        self.group.return_value.apply_async.side_effect = ConnectionError('sin broker')
+        with self.assertLogs('core.ingestion', 'ERROR'):
+            self.assertEqual(register_captures([self.captura('1700000000000000000')]), [])
+        self.assertEqual(Muestra.objects.get().estado_procesamiento, 'pendiente')
+
+
+class CapturasPorMSTTests(SimpleTestCase):
+    """El lote de procesar_lote_task no rebasa el presupuesto de memoria con sus matrices de salida."""
+
+    def test_una_por_llamada_con_el_presupuesto_por_defecto(self):
+        # Cada matriz (2560, 5120) complex64 ocupa 100 MiB, más que los 64 MB del presupuesto
+        with self.settings(MST_MAX_MEMORY_MB=64, MST_BATCH_SIZE=4, CAPTURE_NUM_SAMPLES=5120):
+            self.assertEqual(_capturas_por_mst(), 1)
+
+    def test_lote_segun_presupuesto(self):
+        with self.settings(MST_BATCH_SIZE=4, CAPTURE_NUM_SAMPLES=5120):
+            for presupuesto, esperado in ((256, 2), (400, 4), (4096, 4), (None, 4)):
+                with self.subTest(presupuesto=presupuesto), self.settings(MST_MAX_MEMORY_MB=presupuesto):
+                    self.assertEqual(_capturas_por_mst(), esperado)
+
+
+@override_settings(CAPTURE_NUM_SAMPLES=1024, MST_MAX_MEMORY_MB=None, MST_BATCH_SIZE=4, PROCESS_BATCH_CHUNK_SIZE=16)
+class ProcesarLoteTests(_SinSalida, _BancoTemporal, _AlmacenTemporal, TestCase):
+    """procesar_lote_task: capturas en bloque, MST por lotes y escritura por tramos."""
+
+    def setUp(self):
+        super().setUp()
+        self.capturas = {}
+        patcher = mock.patch('core.tasks.waveform_cache')
+        self.cache = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache.get_signals_data.side_effect = lambda event_ids, starts=None: {
+            e: self.capturas[e] for e in event_ids if e in self.capturas}
+        patcher = mock.patch('core.metrics.logger')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def muestra(self, estado='pendiente', num_puntos=1024, seed=0):
+        muestra = _crear_muestra(estado)
+        timestamps = np.datetime64('2024-05-01T12:00:00', 'ns') + np.arange(num_puntos) * np.timedelta64(32552, 'ns')
+        self.capturas[muestra.event_id] = (timestamps, _senal(num_puntos, seed=seed) * 1000 + 2048)
+        return muestra
+
+    def test_procesa_el_lote(self):
+        a, b, c = self.muestra(seed=1), self.muestra(seed=2), self.muestra(seed=3)
+        corta, procesada = self.muestra(num_puntos=100), self.muestra('procesado')
+        with mock.patch('core.tasks.mst_processing_batch', wraps=mst_processing_batch) as por_lotes:
+            resultado = procesar_lote_task([a.id, b.id, corta.id, c.id, procesada.id, 999999, a.id])
+        por_lotes.assert_called_once()
+        self.assertEqual(por_lotes.call_args.args[0].shape, (3, 1024))
+        self.assertEqual(resultado['procesadas'], [a.id, b.id, c.id])
+        self.assertEqual(resultado['omitidas'], [procesada.id])
+        self.assertEqual([f['muestra_id'] for f in resultado['fallidas']], [999999, corta.id])
+        for muestra in (a, b, c):
+            muestra.refresh_from_db()
+            self.assertEqual(muestra.estado_procesamiento, 'procesado')
+            self.assertIsNone(muestra.reclamo_token)
+            self.assertEqual(muestra.num_puntos, 1024)
+            espectrograma = Espectrograma.objects.get(muestra=muestra)
+            self.assertEqual(espectrograma.huella, huella_procesamiento(self.capturas[muestra.event_id][1]))
+        self.assertEqual(CaracteristicasEvento.objects.count(), 3)
+        self.assertEqual(Clasificacion.objects.filter(estado_clasificacion='pendiente').count(), 3)
+        corta.refresh_from_db()
+        self.assertEqual(corta.estado_procesamiento, 'error')
+
+        # Con la misma captura y parámetros no se recalcula la MST
+        Muestra.objects.filter(id=b.id).update(estado_procesamiento='error')
+        with mock.patch('core.tasks.mst_processing') as mst:
+            resultado = procesar_lote_task([b.id])
+        mst.assert_not_called()
+        self.assertEqual(resultado['reutilizadas'], [b.id])
+        self.assertEqual(resultado['procesadas'], [b.id])
+
+    def test_matrices_segun_presupuesto(self):
+        # Cada matriz (512, 1024) complex64 ocupa 4 MiB: con 8 MB caben dos por llamada, con 1 MB una
+        muestras = [self.muestra(seed=k) for k in range(3)]
+        for presupuesto, lotes in ((8, [2]), (1, [])):
+            Muestra.objects.update(estado_procesamiento='pendiente')
+            Espectrograma.objects.all().delete()
+            with self.subTest(presupuesto=presupuesto), self.settings(MST_MAX_MEMORY_MB=presupuesto), \
+                    mock.patch('core.tasks.mst_processing_batch', wraps=mst_processing_batch) as por_lotes, \
+                    mock.patch('core.tasks.mst_processing', wraps=mst_processing) as por_evento:
+                resultado = procesar_lote_task([m.id for m in muestras])
+                self.assertEqual(resultado['procesadas'], [m.id for m in muestras])
+                self.assertEqual([c.args[0].shape[0] for c in por_lotes.call_args_list], lotes)
+                self.assertEqual(por_evento.call_count, 3 - sum(lotes))
+                self.assertEqual(por_evento.call_args.kwargs['max_memory'], presupuesto * 1024 ** 2)
+
+    def test_error_del_lote_se_reintenta_por_evento(self):
+        a, b = self.muestra(seed=1), self.muestra(seed=2)
+        def por_evento(senal, **kwargs):
+            if senal is self.capturas[a.event_id][1]:
+                raise ValueError('captura inválida')
+            return mst_processing(senal, **kwargs)
+
+        with mock.patch('core.tasks.mst_processing_batch', side_effect=MemoryError), \
+                mock.patch('core.tasks.mst_processing', side_effect=por_evento):
+            resultado = procesar_lote_task([a.id, b.id])
+        self.assertEqual(resultado['procesadas'], [b.id])
+        self.assertEqual(resultado['fallidas'][0]['muestra_id'], a.id)
+        self.assertIn('captura inválida', resultado['fallidas'][0]['error'])
+        self.assertFalse(Espectrograma.objects.filter(muestra=a).exists())
+
+
+class ProcesarPendientesTests(TestCase):
+    """/api/muestras/process-pending/: selección, reparto en tramos y avance del trabajo."""
+
+    def setUp(self):
+        self.client = APIClient()
+        patcher = mock.patch('core.views.chord')
+        self.chord = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def enviar(self, **datos):
+        return self.client.post('/api/muestras/process-pending/', datos, format='json')
+
+    def test_reparte_en_tramos(self):
+        ahora = timezone.now()
+        pendientes = [_crear_muestra() for _ in range(5)]
+        for k, muestra in enumerate(pendientes):
+            Muestra.objects.filter(id=muestra.id).update(timestamp_inicio=ahora - timedelta(minutes=10 - k))
+        vencida = _crear_muestra('en_proceso', reclamo_token=uuid.uuid4(), reclamo_expira=ahora - timedelta(seconds=1))
+        _crear_muestra('en_proceso', reclamo_token=uuid.uuid4(), reclamo_expira=ahora + timedelta(minutes=5))
+        _crear_muestra('procesado')
+        _crear_muestra('error')
+
+        respuesta = self.enviar(tamano_tramo=2)
+        self.assertEqual(respuesta.status_code, 202)
+        self.assertEqual((respuesta.data['total'], respuesta.data['tramos']), (6, 3))
+        trabajo = TrabajoProcesamiento.objects.get(id=respuesta.data['job_id'])
+        self.assertEqual(trabajo.muestra_ids, [m.id for m in pendientes] + [vencida.id])
+        firmas = list(self.chord.call_args.args[0])
+        self.assertEqual([f.args for f in firmas], [(trabajo.muestra_ids[i:i + 2], str(trabajo.id)) for i in (0, 2, 4)])
+        self.chord.return_value.assert_called_once()
+        self.assertTrue(respuesta.data['status_url'].endswith(f'/api/muestras/process-pending/{trabajo.id}/'))
+
+    def test_filtros(self):
+        ahora = timezone.now()
+        con_error = _crear_muestra('error', origen_hardware='stm32-1')
+        _crear_muestra('error', origen_hardware='stm32-2')
+        antigua = _crear_muestra('error', origen_hardware='stm32-1')
+        Muestra.objects.filter(id=antigua.id).update(timestamp_inicio=ahora - timedelta(days=2))
+        respuesta = self.enviar(estado='error', origen_hardware='stm32-1', desde=(ahora - timedelta(days=1)).isoformat())
+        self.assertEqual(TrabajoProcesamiento.objects.get(id=respuesta.data['job_id']).muestra_ids, [con_error.id])
+        respuesta = self.enviar(estado=['pendiente', 'error'], limite=2)
+        self.assertEqual(respuesta.data['total'], 2)
+
+    def test_parametros_invalidos(self):
+        for datos in ({'estado': 'procesado'}, {'limite': 'x'}, {'tamano_tramo': -1}, {'desde': 'ayer'}):
+            with self.subTest(datos=datos):
+                self.assertEqual(self.enviar(**datos).status_code, 400)
+        self.assertEqual(self.enviar().data['total'], 0)
+        self.chord.assert_not_called()
+
+    def test_sin_broker_no_deja_trabajo(self):
+        _crear_muestra()
+        self.chord.return_value.side_effect = ConnectionError('sin broker')
+        self.assertEqual(self.enviar().status_code, 500)
+        self.assertFalse(TrabajoProcesamiento.objects.exists())
+
+    def test_avance_y_cierre(self):
+        for _ in range(4):
+            _crear_muestra()
+        job_id = self.enviar(tamano_tramo=2).data['job_id']
+        url = f'/api/muestras/process-pending/{job_id}/'
+        self.assertEqual(self.client.get(url).data['estado'], 'en_curso')
+
+        resultado, reportado = {'procesadas': [1], 'omitidas': [], 'fallidas': []}, {}
+        _registrar_avance(job_id, resultado, reportado)
+        resultado['fallidas'].append({'muestra_id': 2, 'error': 'sin datos'})
+        _registrar_avance(job_id, resultado, reportado, fin=True)
+        estado = self.client.get(url).data
+        self.assertEqual((estado['hechas'], estado['fallidas'], estado['restantes']), (1, 1, 2))
+        self.assertEqual(estado['tramos_terminados'], 1)
+        self.assertEqual(estado['errores'], [{'muestra_id': 2, 'error': 'sin datos'}])
+        self.assertEqual(estado['estado'], 'en_curso')
+
+        with mock.patch('builtins.print'):
+            trabajo_fallido_task(None, OSError('sin base de datos'), None, job_id)
+        estado = self.client.get(url).data
+        self.assertEqual(estado['estado'], 'terminado')
+        self.assertEqual(estado['error'], 'OSError: sin base de datos')
+        self.assertEqual(self.client.get('/api/muestras/process-pending/00000000-0000-0000-0000-000000000000/')
+                         .status_code, 404)
+
+    def test_finalizar_resume_los_tramos(self):
+        _crear_muestra()
+        job_id = self.enviar().data['job_id']
+        resultados = [{'procesadas': [1, 2], 'omitidas': [3], 'fallidas': []},
+                      {'procesadas': [4], 'omitidas': [], 'fallidas': [{'muestra_id': 5, 'error': 'x'}]}]
+        with mock.patch('builtins.print'):
+            resumen = finalizar_trabajo_task(resultados, job_id)
+        self.assertEqual(resumen, {'trabajo_id': job_id, 'procesadas': 3, 'omitidas': 1, 'fallidas': 1})
+        trabajo = TrabajoProcesamiento.objects.get(id=job_id)
+        self.assertIsNotNone(trabajo.fecha_fin)
+        self.assertEqual(trabajo.resumen['errores'], [{'muestra_id': 5, 'error': 'x'}])
+
+
+class ReclamoMuestrasTests(TestCase):
+    """Reclamo de Muestras con UPDATE condicional y vencimiento."""
+
+    def test_reclama_pendientes_y_con_error(self):
+        pendiente, con_error, procesada = _crear_muestra(), _crear_muestra('error'), _crear_muestra('procesado')
+        token = uuid.uuid4()
+        reclamadas = reclamar_muestras([pendiente.id, con_error.id, procesada.id], token=token)
+        self.assertEqual(reclamadas, {pendiente.id, con_error.id})
+        pendiente.refresh_from_db()
+        self.assertEqual(pendiente.estado_procesamiento, 'en_proceso')
+        self.assertEqual(pendiente.reclamo_token, token)
+        self.assertGreater(pendiente.reclamo_expira, timezone.now())
+
+    def test_no_reclama_dos_veces(self):
+        muestra = _crear_muestra()
+        self.assertEqual(reclamar_muestras([muestra.id]), {muestra.id})
+        self.assertEqual(reclamar_muestras([muestra.id]), set())
+
+    def test_reclamo_vencido(self):
+        anterior = uuid.uuid4()
+        vencida = _crear_muestra('en_proceso', reclamo_token=anterior,
+                                 reclamo_expira=timezone.now() - timedelta(seconds=1))
+        vigente = _crear_muestra('en_proceso', reclamo_token=anterior,
+                                 reclamo_expira=timezone.now() + timedelta(minutes=5))
+        nuevo = uuid.uuid4()
+        self.assertEqual(reclamar_muestras([vencida.id, vigente.id], token=nuevo), {vencida.id})
+        # El worker anterior ya no puede renovar ni escribir la que perdió
+        self.assertFalse(renovar_reclamo(vencida.id, anterior))
+        self.assertTrue(renovar_reclamo(vencida.id, nuevo))
+        self.assertTrue(renovar_reclamo(vigente.id, anterior))
+        self.assertEqual(conservar_reclamo([vencida.id, vigente.id], anterior), {vigente.id})
+        self.assertEqual(conservar_reclamo([vencida.id, vigente.id], nuevo), {vencida.id})
+
+    @override_settings(PROCESS_LEASE_S=0)
+    def test_reclamo_sin_renovar_vence(self):
+        muestra = _crear_muestra()
+        primero = uuid.uuid4()
+        self.assertEqual(reclamar_muestras([muestra.id], token=primero), {muestra.id})
+        self.assertEqual(reclamar_muestras([muestra.id]), {muestra.id})
+        self.assertEqual(conservar_reclamo([muestra.id], primero), set())
+
+
+@override_settings(CAPTURE_NUM_SAMPLES=1024, MST_MAX_MEMORY_MB=None)
+class ProcesarEventoTests(_SinSalida, _BancoTemporal, _AlmacenTemporal, TestCase):
+    """procesar_evento_completo_task solo trabaja sobre Muestras que reclamó y no repite una MST vigente."""
+
+    def setUp(self):
+        super().setUp()
+        self.valores = _senal(1024) * 1000 + 2048
+        timestamps = np.datetime64('2024-05-01T12:00:00', 'ns') + np.arange(1024) * np.timedelta64(32552, 'ns')
+        patcher = mock.patch('core.tasks.waveform_cache')
+        patcher.start().get_signal_data.return_value = (timestamps, self.valores)
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch('core.metrics.logger')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_omite_la_que_procesa_otro_worker(self):
+        muestra = _crear_muestra('en_proceso', reclamo_token=uuid.uuid4(),
+                                 reclamo_expira=timezone.now() + timedelta(minutes=5))
+        with mock.patch('core.tasks.mst_processing') as mst:
+            self.assertIsNone(procesar_evento_completo_task(muestra.id))
+        mst.assert_not_called()
+        self.assertEqual(Muestra.objects.get(id=muestra.id).estado_procesamiento, 'en_proceso')
+
+    def test_reutiliza_el_espectrograma_vigente(self):
+        muestra = _crear_muestra()
+        self.assertEqual(procesar_evento_completo_task(muestra.id)['muestra_id'], muestra.id)
+        muestra.refresh_from_db()
+        self.assertEqual(muestra.estado_procesamiento, 'procesado')
+        self.assertIsNone(muestra.reclamo_token)
+        self.assertEqual(Espectrograma.objects.get(muestra=muestra).huella, huella_procesamiento(self.valores))
+
+        Muestra.objects.filter(id=muestra.id).update(estado_procesamiento='error')
+        with mock.patch('core.tasks.mst_processing') as mst:
+            self.assertTrue(procesar_evento_completo_task(muestra.id)['reutilizado'])
+        mst.assert_not_called()
+        # Otros parámetros cambian la huella y obligan a recalcular
+        Muestra.objects.filter(id=muestra.id).update(estado_procesamiento='error')
+        with self.settings(SPECTROGRAM_DB_RANGE=settings.SPECTROGRAM_DB_RANGE + 10):
+            self.assertNotIn('reutilizado', procesar_evento_completo_task(muestra.id))
+
+    def test_reclamo_perdido_no_escribe(self):
+        muestra = _crear_muestra()
+
+        def otro_worker(senal, **kwargs):
+            # El reclamo vence durante la MST y otro worker toma la muestra
+            Muestra.objects.filter(id=muestra.id).update(reclamo_token=uuid.uuid4())
+            return mst_processing(senal, **kwargs)
+
+        with mock.patch('core.tasks.mst_processing', side_effect=otro_worker):
+            self.assertIsNone(procesar_evento_completo_task(muestra.id))
+        self.assertFalse(Espectrograma.objects.filter(muestra=muestra).exists())
+        self.assertEqual(Muestra.objects.get(id=muestra.id).estado_procesamiento, 'en_proceso')
+
+
+@override_settings(CAPTURE_NUM_SAMPLES=1024, MST_MAX_MEMORY_MB=None)
+class PipelineEtapasTests(_SinSalida, _BancoTemporal, _AlmacenTemporal, TestCase):
+    """Pipeline por etapas: captura -> MST -> guardado con un manifiesto JSON y el área temporal."""
+
+    def setUp(self):
+        super().setUp()
+        area = override_settings(PIPELINE_STAGING_DIR=f"{self.raiz}/staging")
+        area.enable()
+        self.addCleanup(area.disable)
+        patcher = mock.patch.object(blobstore, '_staging', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.valores = _senal(1024) * 1000 + 2048
+        timestamps = np.datetime64('2024-05-01T12:00:00', 'ns') + np.arange(1024) * np.timedelta64(32552, 'ns')
+        patcher = mock.patch('core.tasks.waveform_cache')
+        patcher.start().get_signal_data.return_value = (timestamps, self.valores)
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch('core.metrics.logger')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def area_temporal(self):
+        return os.listdir(f"{self.raiz}/staging") if os.path.isdir(f"{self.raiz}/staging") else []
+
+    @staticmethod
+    def etapa(tarea, manifiesto):
+        # Entre colas el manifiesto viaja serializado en JSON
+        return tarea(json.loads(json.dumps(manifiesto)))
+
+    def test_firma_segun_settings(self):
+        self.assertEqual(firma_procesamiento(7).task, 'core.tasks.procesar_evento_completo_task')
+        with self.settings(PROCESS_STAGED_PIPELINE=True):
+            cadena = firma_procesamiento(7)
+        self.assertEqual([firma.task for firma in cadena.tasks],
+                         ['core.tasks.obtener_captura_task', 'core.tasks.calcular_mst_task',
+                          'core.tasks.guardar_resultados_task'])
+        self.assertEqual(cadena.tasks[0].args, (7,))
+
+    def test_cadena_completa(self):
+        muestra = _crear_muestra()
+        manifiesto = self.etapa(calcular_mst_task, obtener_captura_task(muestra.id))
+        self.assertNotIn('captura_ref', manifiesto)
+        self.assertTrue(self.area_temporal())
+        resultado = self.etapa(guardar_resultados_task, manifiesto)
+        self.assertEqual(resultado['muestra_id'], muestra.id)
+        self.assertEqual(self.area_temporal(), [])
+
+        muestra.refresh_from_db()
+        self.assertEqual((muestra.estado_procesamiento, muestra.num_puntos), ('procesado', 1024))
+        self.assertIsNone(muestra.reclamo_token)
+        espectrograma = Espectrograma.objects.get(muestra=muestra)
+        self.assertEqual(espectrograma.huella, huella_procesamiento(self.valores))
+        referencias = [espectrograma.blob_ref] + [n['blob_ref'] for n in espectrograma.piramide['niveles']]
+        for ref in filter(None, referencias):
+            self.assertTrue(self.store.exists(ref))
+        self.assertTrue(CaracteristicasEvento.objects.filter(muestra=muestra).exists())
+
+        # Con la misma captura y parámetros, la primera etapa termina la cadena
+        Muestra.objects.filter(id=muestra.id).update(estado_procesamiento='error')
+        self.assertIsNone(obtener_captura_task(muestra.id))
+        self.assertEqual(Muestra.objects.get(id=muestra.id).estado_procesamiento, 'procesado')
+
+    def test_error_en_la_mst(self):
+        muestra = _crear_muestra()
+        manifiesto = obtener_captura_task(muestra.id)
+        with mock.patch('core.tasks.mst_processing', side_effect=MemoryError):
+            self.assertIsNone(self.etapa(calcular_mst_task, manifiesto))
+        self.assertIsNone(guardar_resultados_task(None))
+        self.assertEqual(Muestra.objects.get(id=muestra.id).estado_procesamiento, 'error')
+        self.assertEqual(self.area_temporal(), [])
+
+    def test_reclamo_perdido_entre_etapas(self):
+        muestra = _crear_muestra()
+        manifiesto = self.etapa(calcular_mst_task, obtener_captura_task(muestra.id))
+        Muestra.objects.filter(id=muestra.id).update(reclamo_token=uuid.uuid4())
+        self.assertIsNone(self.etapa(guardar_resultados_task, manifiesto))
+        self.assertFalse(Espectrograma.objects.filter(muestra=muestra).exists())
+        self.assertEqual(self.area_temporal(), [])
+        self.assertEqual(os.listdir(self.store.root) if os.path.isdir(self.store.root) else [], [])
+
+
+class MetricasTests(SimpleTestCase):
+    """Texto de exposición de Prometheus de las métricas locales (sin Redis)."""
+
+    def setUp(self):
+        self.metrics = Metrics()
+
+    def test_contadores(self):
+        self.metrics.inc('pqs_muestras_total', resultado='procesado')
+        self.metrics.inc('pqs_muestras_total', 2, resultado='procesado')
+        self.metrics.inc('pqs_muestras_total', resultado='error')
+        texto = self.metrics.render()
+        self.assertIn('# TYPE pqs_muestras_total counter', texto)
+        self.assertIn('pqs_muestras_total{resultado="procesado"} 3\n', texto)
+        self.assertIn('pqs_muestras_total{resultado="error"} 1\n', texto)
+        self.assertTrue(texto.endswith('\n'))
+
+    def test_histograma_acumulado(self):
+        for valor in (0.003, 0.2, 0.2, 100):
+            self.metrics.observe('pqs_etapa_duracion_segundos', valor, etapa='mst')
+        lineas = self.metrics.render().splitlines()
+        self.assertIn('# TYPE pqs_etapa_duracion_segundos histogram', lineas)
+        self.assertIn('pqs_etapa_duracion_segundos_bucket{etapa="mst",le="0.005"} 1', lineas)
+        self.assertIn('pqs_etapa_duracion_segundos_bucket{etapa="mst",le="0.1"} 1', lineas)
+        self.assertIn('pqs_etapa_duracion_segundos_bucket{etapa="mst",le="0.25"} 3', lineas)
+        self.assertIn('pqs_etapa_duracion_segundos_bucket{etapa="mst",le="60"} 3', lineas)
+        self.assertIn('pqs_etapa_duracion_segundos_bucket{etapa="mst",le="+Inf"} 4', lineas)
+        self.assertIn('pqs_etapa_duracion_segundos_count{etapa="mst"} 4', lineas)
+        suma = next(l for l in lineas if l.startswith('pqs_etapa_duracion_segundos_sum{'))
+        self.assertAlmostEqual(float(suma.split()[-1]), 100.403)
+
+    def test_escapa_etiquetas(self):
+        self.metrics.inc('pqs_etapa_errores_total', etapa='a"b\\c\nd')
+        self.assertIn('pqs_etapa_errores_total{etapa="a\\"b\\\\c\\nd"} 1', self.metrics.render())
+
+    def test_medir_registra_errores_y_memoria(self):
+        self.metrics.configure(trace_memory=True)
+        with mock.patch('core.metrics.metrics', self.metrics), mock.patch('core.metrics.logger') as logger:
+            with self.assertRaises(RuntimeError), medir('mst', memoria=True, muestra_id=7) as etapa:
+                etapa['bytes'] = 2048
+                np.ones(100_000)
+                raise RuntimeError('fallo')
+        texto = self.metrics.render()
+        self.assertIn('pqs_etapa_errores_total{etapa="mst"} 1', texto)
+        self.assertIn('pqs_etapa_bytes_count{etapa="mst"} 1', texto)
+        self.assertIn('pqs_etapa_memoria_pico_bytes_count{etapa="mst"} 1', texto)
+        registro = json.loads(logger.info.call_args.args[0])
+        self.assertEqual((registro['etapa'], registro['ok'], registro['muestra_id']), ('mst', False, 7))
+        self.assertGreaterEqual(registro['memoria_pico_bytes'], 800_000)
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_no_apaga_tracemalloc_ajeno(self):
+        self.metrics.configure(trace_memory=True)
+        tracemalloc.start()
+        self.addCleanup(tracemalloc.stop)
+        with mock.patch('core.metrics.metrics', self.metrics), mock.patch('core.metrics.logger'):
+            with medir('mst', memoria=True):
+                pass
+        self.assertTrue(tracemalloc.is_tracing())
+        self.assertNotIn('pqs_etapa_memoria_pico_bytes_count', self.metrics.render())
+
+    def test_sin_redis_quedan_locales(self):
+        metricas = Metrics(redis_url='redis://127.0.0.1:1/0')
+        with mock.patch('builtins.print') as avisos:
+            metricas.inc('pqs_muestras_total', resultado='procesado')
+            metricas.inc('pqs_muestras_total', resultado='procesado')
+        # Tras el primer error Redis se omite durante un tiempo en lugar de reintentar en cada escritura
+        self.assertEqual(avisos.call_count, 1)
+        self.assertIn('pqs_muestras_total{resultado="procesado"} 2', metricas.render())
+
+    def test_endpoint(self):
+        with mock.patch('core.views.metrics', self.metrics):
+            self.metrics.inc('pqs_muestras_total', resultado='omitido')
+            respuesta = self.client.get('/metrics')
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertTrue(respuesta['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.assertIn(b'pqs_muestras_total{resultado="omitido"} 1', respuesta.content)
@@ -1,15 +1,34 @@
+import base64
+import math
+import pandas as pd
+from celery import chord
+from django.conf import settings
+from django.db.models import Q
+from django.http import HttpResponse
+from django.utils import timezone
 from django.shortcuts import render
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.pagination import LimitOffsetPagination
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated # Para proteger las vistas
-from .models import Muestra, Espectrograma, Anotacion, Clasificacion, User
+from .models import Muestra, Espectrograma, Anotacion, Clasificacion, User, CaracteristicasEvento, TrabajoProcesamiento
 from .serializers import (
     MuestraSerializer, EspectrogramaSerializer, AnotacionSerializer, 
-    ClasificacionSerializer, UserSerializer
+    ClasificacionSerializer, UserSerializer, CaracteristicasEventoSerializer
 )
 # from .services import procesar_evento_completo
-from .tasks import procesar_evento_completo_task # Importa la tarea de Celery
+from .tasks import firma_procesamiento, procesar_lote_task, finalizar_trabajo_task, trabajo_fallido_task # Tareas de Celery
+from .analysis.pyramid import tile_range
+from .spectrogram_storage import (
+    DOWNLOAD_FORMATS, available_download_formats, download_etag, open_pyramid_level, spectrogram_download,
+)
+from .streaming import not_modified, ranged_response
+from .analysis.stockwell import MST_FS
+from .render_cache import render_cache
+from .rendering import render_spectrogram
+from .waveform_cache import waveform_cache
+from .metrics import metrics
 import pickle
 import numpy as np
 
@@ -36,10 +55,14 @@ class MuestraViewSet(viewsets.ModelViewSet):
 
         if muestra.estado_procesamiento == 'procesado':
             return Response({'detail': f'La muestra {muestra.id} ya ha sido procesada.'}, status=status.HTTP_200_OK)
+        if muestra.estado_procesamiento == 'en_proceso' and muestra.reclamo_expira and muestra.reclamo_expira > timezone.now():
+            # La tarea también lo verifica al reclamarla; aquí se evita encolar trabajo que se omitiría
+            return Response({'detail': f'La muestra {muestra.id} ya se está procesando.'}, status=status.HTTP_200_OK)
 
         try:
             # Dispara la tarea de Celery de forma asíncrona
-            task_result = procesar_evento_completo_task.delay(muestra.id) # .delay() envía la tarea al broker
+            # Envía al broker la cadena por etapas o la tarea única (settings.PROCESS_STAGED_PIPELINE)
+            task_result = firma_procesamiento(muestra.id).apply_async()
 
             # Responde inmediatamente al frontend
             return Response({
@@ -50,6 +73,123 @@ class MuestraViewSet(viewsets.ModelViewSet):
         except Exception as e:
             return Response({'detail': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    @staticmethod
+    def _lista(valor):
+        if valor is None:
+            return None
+        return valor if isinstance(valor, list) else [valor]
+
+    @action(detail=False, methods=['post'], url_path='process-pending')
+    def process_pending(self, request):
+        """
+        Procesa en bloque las muestras que cumplen los filtros del cuerpo:
+        estado ('pendiente' por defecto y/o 'error'; siempre se incluyen las
+        'en_proceso' con el reclamo vencido), desde / hasta (ISO 8601,
+        sobre timestamp_inicio), origen_hardware (uno o varios), limite y
+        tamano_tramo (muestras por tarea).
+
+        Las muestras se reparten en tramos que se envían como un chord de
+        procesar_lote_task; se responde un único ID de trabajo cuyo avance se
+        consulta en /api/muestras/process-pending/{job_id}/.
+        """
+        datos = request.data
+        estados = self._lista(datos.get('estado')) or ['pendiente']
+        if not set(estados) <= {'pendiente', 'error'}:
+            return Response({'detail': "estado solo puede ser 'pendiente' y/o 'error'."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limite = int(datos['limite']) if datos.get('limite') is not None else None
+            tamano_tramo = int(datos.get('tamano_tramo') or settings.PROCESS_PENDING_CHUNK_SIZE)
+            ventana = {}
+            for clave, lookup in (('desde', 'timestamp_inicio__gte'), ('hasta', 'timestamp_inicio__lt')):
+                if datos.get(clave):
+                    instante = pd.Timestamp(datos[clave])
+                    ventana[lookup] = (instante if instante.tz else instante.tz_localize('UTC')).to_pydatetime()
+        except ValueError:
+            return Response({'detail': 'limite, tamano_tramo, desde o hasta no válidos.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if tamano_tramo < 1 or (limite is not None and limite < 1):
+            return Response({'detail': 'limite y tamano_tramo deben ser positivos.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        consulta = Muestra.objects.filter(
+            Q(estado_procesamiento__in=estados)
+            | Q(estado_procesamiento='en_proceso', reclamo_expira__lt=timezone.now()),
+            **ventana,
+        )
+        origenes = self._lista(datos.get('origen_hardware'))
+        if origenes:
+            consulta = consulta.filter(origen_hardware__in=origenes)
+        ids = list(consulta.order_by('timestamp_inicio').values_list('id', flat=True)[:limite])
+        if not ids:
+            return Response({'detail': 'No hay muestras que cumplan los filtros.', 'total': 0}, status=status.HTTP_200_OK)
+
+        filtros = {'estado': estados, 'desde': datos.get('desde'), 'hasta': datos.get('hasta'),
+                   'origen_hardware': origenes, 'limite': limite}
+        tramos = [ids[i:i + tamano_tramo] for i in range(0, len(ids), tamano_tramo)]
+        trabajo = TrabajoProcesamiento.objects.create(
+            filtros=filtros, muestra_ids=ids, total=len(ids), tramos=len(tramos),
+            usuario_creacion=request.user if request.user.is_authenticated else None,
+        )
+        try:
+            # Si una tarea falla el callback no se ejecuta; el errback cierra el trabajo con el error
+            callback = finalizar_trabajo_task.s(str(trabajo.id))
+            callback.link_error(trabajo_fallido_task.s(str(trabajo.id)))
+            chord(procesar_lote_task.s(tramo, str(trabajo.id)) for tramo in tramos)(callback)
+        except Exception as e:
+            trabajo.delete()
+            return Response({'detail': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        return Response({
+            'detail': f'{len(ids)} muestras enviadas a la cola en {len(tramos)} tareas.',
+            'job_id': str(trabajo.id),
+            'total': len(ids),
+            'tramos': len(tramos),
+            'status_url': self.reverse_action('process-pending-status', args=[trabajo.id]),
+        }, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=False, methods=['get'], url_path=r'process-pending/(?P<job_id>[0-9a-f-]+)')
+    def process_pending_status(self, request, job_id=None):
+        """
+        Avance de un trabajo de process-pending: hechas, con error, omitidas
+        (procesadas por otro worker), restantes, tasa y tiempo estimado. Los
+        conteos los acumulan las tareas al terminar cada tramo, así que la
+        consulta no depende del tamaño del trabajo.
+        """
+        try:
+            trabajo = TrabajoProcesamiento.objects.get(id=job_id)
+        except (TrabajoProcesamiento.DoesNotExist, ValueError):
+            return Response({'detail': 'Trabajo no encontrado.'}, status=status.HTTP_404_NOT_FOUND)
+
+        restantes = max(trabajo.total - trabajo.hechas - trabajo.fallidas - trabajo.omitidas, 0)
+        # Terminado si corrió el callback o el errback del chord, o si ya no queda ninguna muestra
+        terminado = trabajo.fecha_fin is not None or restantes == 0
+        transcurrido = ((trabajo.fecha_fin or timezone.now()) - trabajo.fecha_inicio).total_seconds()
+        tasa = (trabajo.hechas + trabajo.fallidas) / transcurrido if transcurrido > 0 else None
+        resumen = trabajo.resumen or {}
+        return Response({
+            'job_id': str(trabajo.id),
+            'estado': 'terminado' if terminado else 'en_curso',
+            'total': trabajo.total,
+            'tramos': trabajo.tramos,
+            'tramos_terminados': trabajo.tramos_terminados,
+            'hechas': trabajo.hechas,
+            'fallidas': trabajo.fallidas,
+            'omitidas': trabajo.omitidas,
+            'restantes': restantes, # Incluye las que están en proceso
+            'muestras_por_s': tasa,
+            'tiempo_restante_s': restantes / tasa if tasa and not terminado else None,
+            'fecha_inicio': trabajo.fecha_inicio,
+            'fecha_fin': trabajo.fecha_fin,
+            'filtros': trabajo.filtros,
+            'error': resumen.get('error'), # Solo si una tarea del trabajo falló por completo
+            'errores': resumen.get('errores', trabajo.errores),
+        })
+
+    @action(detail=False, methods=['get'], url_path='waveform-cache-stats')
+    def waveform_cache_stats(self, request):
+        """Aciertos y fallos de la caché de capturas crudas que está delante de InfluxDB."""
+        return Response(waveform_cache.get_stats())
+
     # Opcional: Agrega un endpoint para consultar el estado de una tarea
     @action(detail=False, methods=['get'], url_path='task-status/(?P<task_id>[^/.]+)')
     def task_status(self, request, task_id=None):
@@ -63,11 +203,162 @@ class MuestraViewSet(viewsets.ModelViewSet):
         return Response(data)
 
 
+class EspectrogramaPagination(LimitOffsetPagination):
+    default_limit = 50
+    max_limit = 500
+
+
 class EspectrogramaViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = Espectrograma.objects.all().select_related('muestra')
+    # Los datos binarios nunca se cargan al listar: se descargan con la acción `download`
+    queryset = Espectrograma.objects.all().select_related('muestra').defer('data_espectrograma').order_by('muestra')
     serializer_class = EspectrogramaSerializer
+    pagination_class = EspectrogramaPagination
     # permission_classes = [IsAuthenticated]
 
+    @action(detail=True, methods=['get'], url_path='download')
+    def download(self, request, pk=None):
+        """
+        Descarga por streaming el arreglo codificado del espectrograma como .npy
+        (?formato=npy, por defecto) o como tensor Arrow (?formato=arrow).
+        Soporta Range (para reanudar descargas) e If-None-Match con el ETag
+        derivado del checksum. Para decodificarlo se usa metadata_json.
+        """
+        espectrograma = self.get_object()
+        formato = request.query_params.get('formato', 'npy')
+        if formato not in DOWNLOAD_FORMATS:
+            return Response({'detail': f"Formato '{formato}' no válido. Opciones: {DOWNLOAD_FORMATS}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if formato not in available_download_formats():
+            return Response({'detail': f"El formato '{formato}' requiere pyarrow, que no está instalado."},
+                            status=status.HTTP_406_NOT_ACCEPTABLE)
+        # El ETag sale del checksum guardado: un 304 no lee ni arma el arreglo
+        respuesta = not_modified(request, download_etag(espectrograma, formato))
+        if respuesta is not None:
+            return respuesta
+        abrir, tamano, etag, content_type, nombre = spectrogram_download(espectrograma, formato)
+        return ranged_response(request, abrir, tamano, etag, content_type=content_type, filename=nombre)
+
+    @action(detail=True, methods=['get'], url_path='render')
+    def render_image(self, request, pk=None):
+        """
+        Imagen PNG/WebP de la magnitud del espectrograma, renderizada en el servidor:
+        ?formato=png|webp &ancho=&alto= (px) &f_min=&f_max= (Hz) &t_min=&t_max= (s)
+        &escala=db|lineal &db_min= (dB, piso de la escala) &colormap=viridis|magma|inferno|jet|gray
+
+        Las imágenes se guardan en una caché acotada por tamaño, indexada por la
+        muestra, los parámetros y el checksum del espectrograma (si se reprocesa
+        el evento, la clave cambia). El ETag permite además la caché del navegador.
+        """
+        espectrograma = self.get_object()
+        params = request.query_params
+        try:
+            opciones = {
+                'width': int(params.get('ancho', 800)),
+                'height': int(params.get('alto', 400)),
+                'f_min': float(params['f_min']) if 'f_min' in params else None,
+                'f_max': float(params['f_max']) if 'f_max' in params else None,
+                't_min': float(params['t_min']) if 't_min' in params else None,
+                't_max': float(params['t_max']) if 't_max' in params else None,
+                'db_min': float(params.get('db_min', -80.0)),
+                'scale': params.get('escala', 'db'),
+                'colormap': params.get('colormap', 'viridis'),
+                'formato': params.get('formato', 'png'),
+            }
+            numericos = ('f_min', 'f_max', 't_min', 't_max', 'db_min')
+            if not all(opciones[clave] is None or math.isfinite(opciones[clave]) for clave in numericos):
+                raise ValueError('nan/inf')
+        except ValueError:
+            return Response({'detail': 'Parámetros numéricos no válidos.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        version = espectrograma.checksum or espectrograma.fecha_generacion.isoformat()
+        # El rango dinámico de settings cambia la imagen, así que también va en la clave
+        clave = render_cache.make_key(espectrograma.pk, version, opciones, settings.SPECTROGRAM_DB_RANGE)
+        etag = f'"{clave}"'
+        if request.headers.get('If-None-Match') == etag:
+            response = HttpResponse(status=304)
+            response['ETag'] = etag
+            response['Cache-Control'] = 'private, max-age=3600'
+            return response
+
+        imagen = render_cache.get(clave)
+        if imagen is None:
+            try:
+                imagen = render_spectrogram(espectrograma, MST_FS, db_range=settings.SPECTROGRAM_DB_RANGE, **opciones)
+            except ValueError as e:
+                return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            render_cache.put(clave, imagen)
+
+        response = HttpResponse(imagen, content_type=f"image/{opciones['formato']}")
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, max-age=3600'
+        return response
+
+    @action(detail=True, methods=['get'], url_path='tiles')
+    def tiles(self, request, pk=None):
+        """
+        Teselas de la pirámide de magnitud para un nivel de zoom y una ventana:
+        ?nivel=&t_min=&t_max= (s) &f_min=&f_max= (Hz). Sin `nivel` se usa el más
+        grueso, que cabe en una sola tesela. Cada tesela es uint8 (dB relativos al
+        pico, 0 = por debajo del rango) en base64, con filas de frecuencia y
+        columnas de tiempo.
+        """
+        espectrograma = self.get_object()
+        piramide = espectrograma.piramide
+        if not piramide:
+            return Response({'detail': 'Este espectrograma no tiene pirámide de teselas.'}, status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            nivel = int(request.query_params.get('nivel', len(piramide['niveles']) - 1))
+            ventana = {
+                clave: float(request.query_params[clave]) if clave in request.query_params else None
+                for clave in ('t_min', 't_max', 'f_min', 'f_max')
+            }
+            if not all(valor is None or math.isfinite(valor) for valor in ventana.values()):
+                raise ValueError('nan/inf')
+        except ValueError:
+            return Response({'detail': 'Parámetros numéricos no válidos.'}, status=status.HTTP_400_BAD_REQUEST)
+        abierto = open_pyramid_level(espectrograma, nivel)
+        if abierto is None:
+            return Response({'detail': f"Nivel {nivel} no válido (0 a {len(piramide['niveles']) - 1})."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        teselas, descripcion = abierto
+
+        tile_size = piramide['tile_size']
+        n_f, n_t = descripcion['teselas']
+        try:
+            fila_ini, fila_fin = tile_range(ventana['f_min'], ventana['f_max'], descripcion['df_hz'], tile_size, n_f)
+            col_ini, col_fin = tile_range(ventana['t_min'], ventana['t_max'], descripcion['dt_s'], tile_size, n_t)
+        except (ValueError, OverflowError):
+            return Response({'detail': 'Ventana fuera de rango.'}, status=status.HTTP_400_BAD_REQUEST)
+        total = max(fila_fin - fila_ini + 1, 0) * max(col_fin - col_ini + 1, 0)
+        if total > settings.SPECTROGRAM_MAX_TILES_PER_REQUEST:
+            return Response({'detail': f'La ventana requiere {total} teselas (máximo '
+                                       f'{settings.SPECTROGRAM_MAX_TILES_PER_REQUEST}); use un nivel más grueso.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        resultado = []
+        for fila in range(fila_ini, fila_fin + 1):
+            for columna in range(col_ini, col_fin + 1):
+                resultado.append({
+                    'fila': fila,
+                    'columna': columna,
+                    'f_min_hz': fila * tile_size * descripcion['df_hz'],
+                    't_min_s': columna * tile_size * descripcion['dt_s'],
+                    'data': base64.b64encode(teselas[fila, columna].tobytes()).decode('ascii'),
+                })
+        return Response({
+            'muestra': espectrograma.pk,
+            'nivel': nivel,
+            'niveles': len(piramide['niveles']),
+            'tile_size': tile_size,
+            'shape': descripcion['shape'],
+            'df_hz': descripcion['df_hz'],
+            'dt_s': descripcion['dt_s'],
+            'db_range': piramide['db_range'],
+            'scale': piramide['scale'],
+            'teselas': resultado,
+        })
+
 class AnotacionViewSet(viewsets.ModelViewSet):
     queryset = Anotacion.objects.all().select_related('muestra', 'usuario_anotador')
     serializer_class = AnotacionSerializer
@@ -76,4 +367,14 @@ class AnotacionViewSet(viewsets.ModelViewSet):
 class ClasificacionViewSet(viewsets.ModelViewSet):
     queryset = Clasificacion.objects.all().select_related('muestra', 'usuario_validador')
     serializer_class = ClasificacionSerializer
-    # permission_classes = [IsAuthenticated]
\ No newline at end of file
+    # permission_classes = [IsAuthenticated]
+
+class CaracteristicasEventoViewSet(viewsets.ReadOnlyModelViewSet):
+    queryset = CaracteristicasEvento.objects.all().select_related('muestra')
+    serializer_class = CaracteristicasEventoSerializer
+    # permission_classes = [IsAuthenticated]
+
+
+def metricas(request):
+    """Métricas por etapa del procesamiento en el formato de texto de Prometheus (ver core/metrics.py)."""
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
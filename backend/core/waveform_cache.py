@@ -0,0 +1,259 @@
+# core/waveform_cache.py
+
+"""
+Caché de lectura de las capturas crudas delante de InfluxDB.
+
+Las capturas completas son inmutables, así que los reintentos y los
+reprocesamientos (p. ej. tras cambiar parámetros de la MST) no necesitan volver
+a consultar InfluxDB. Hay dos niveles:
+- LRU local en la memoria del proceso, acotada por tamaño total en bytes.
+- Redis opcional (por defecto el de CELERY_BROKER_URL), compartido por todos
+  los workers, con expiración.
+
+Las muestras se guardan compactas: uint16 si son enteros del ADC (el caso
+normal) o float32 si no; las marcas de tiempo, como inicio + periodo cuando
+son uniformes.
+"""
+
+import struct
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from django.conf import settings
+
+from .influx_client import influx_service
+
+try:
+    import redis
+except ImportError:  # Dependencia opcional: sin ella solo se usa la caché local
+    redis = None
+
+_KEY_PREFIX = 'pqs:waveform:'
+_STATS_KEY = 'pqs:waveform:stats'
+# Encabezado: versión, dtype de valores ('H' uint16 / 'f' float32), uniforme, inicio ns, periodo ns, n
+_HEADER = struct.Struct('<BcBqqI')
+_VERSION = 1
+_REDIS_RETRY_S = 30 # Tras un error de conexión, Redis se omite durante este tiempo
+
+
+def pack_waveform(timestamps, values):
+    """Serializa una captura en el formato compacto de la caché."""
+    values = np.asarray(values)
+    ns = np.asarray(timestamps).astype('datetime64[ns]').astype(np.int64)
+    if values.size and values.min() >= 0 and values.max() <= 65535 and np.all(values == np.rint(values)):
+        kind, stored = b'H', values.astype('<u2')
+    else:
+        kind, stored = b'f', values.astype('<f4')
+    steps = np.diff(ns)
+    uniform = ns.size < 2 or bool(np.all(steps == steps[0]))
+    period = int(steps[0]) if ns.size >= 2 else 0
+    header = _HEADER.pack(_VERSION, kind, uniform, int(ns[0]) if ns.size else 0, period, values.size)
+    body = stored.tobytes() if uniform else stored.tobytes() + ns.astype('<i8').tobytes()
+    return header + body
+
+
+def unpack_waveform(data):
+    """Inverso de `pack_waveform`. Retorna (timestamps datetime64[ns], valores float64)."""
+    version, kind, uniform, start, period, n = _HEADER.unpack_from(data)
+    if version != _VERSION:
+        raise ValueError(f"Versión de captura en caché {version} no soportada.")
+    dtype = np.dtype('<u2') if kind == b'H' else np.dtype('<f4')
+    offset = _HEADER.size
+    values = np.frombuffer(data, dtype=dtype, count=n, offset=offset).astype(np.float64)
+    if uniform:
+        ns = start + np.arange(n, dtype=np.int64) * period
+    else:
+        ns = np.frombuffer(data, dtype='<i8', count=n, offset=offset + n * dtype.itemsize)
+    return ns.astype('datetime64[ns]'), values
+
+
+class WaveformCache:
+    """Caché de lectura de capturas por event_id (LRU local + Redis opcional)."""
+
+    def __init__(self, max_bytes=64 * 1024 ** 2, redis_url=None, redis_ttl=7 * 24 * 3600):
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._redis = None
+        self._redis_retry_at = 0.0
+        self.max_bytes = max_bytes
+        self.redis_url = redis_url
+        self.redis_ttl = redis_ttl
+        self.stats = {'hits_local': 0, 'hits_redis': 0, 'misses': 0}
+
+    def configure(self, max_bytes=None, redis_url=None, redis_ttl=None):
+        """Ajusta el tamaño local, la URL de Redis (cadena vacía la desactiva) y la expiración."""
+        with self._lock:
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+            if redis_url is not None:
+                self.redis_url = redis_url or None
+                self._redis = None
+            if redis_ttl is not None:
+                self.redis_ttl = redis_ttl
+            self._entries.clear()
+            self._size = 0
+
+    @property
+    def redis(self):
+        if not self.redis_url or redis is None or time.monotonic() < self._redis_retry_at:
+            return None
+        if self._redis is None:
+            self._redis = redis.Redis.from_url(self.redis_url, socket_timeout=1, socket_connect_timeout=1)
+        return self._redis
+
+    def _redis_failed(self, error, action):
+        # Sin Redis la caché sigue funcionando con el nivel local; no se reintenta en cada lectura
+        print(f"Advertencia: caché de capturas en Redis no disponible al {action} ({error}); "
+              f"se reintentará en {_REDIS_RETRY_S} s.")
+        self._redis_retry_at = time.monotonic() + _REDIS_RETRY_S
+
+    # --- Nivel local ---
+    def _local_get(self, event_id):
+        with self._lock:
+            data = self._entries.get(event_id)
+            if data is not None:
+                self._entries.move_to_end(event_id)
+            return data
+
+    def _local_put(self, event_id, data):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            if event_id in self._entries:
+                self._size -= len(self._entries.pop(event_id))
+            self._entries[event_id] = data
+            self._size += len(data)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    # --- Nivel Redis (los errores de conexión se tratan como fallos de caché) ---
+    def _redis_get_many(self, event_ids):
+        if self.redis is None or not event_ids:
+            return [None] * len(event_ids)
+        try:
+            return self.redis.mget([_KEY_PREFIX + e for e in event_ids])
+        except redis.RedisError as e:
+            self._redis_failed(e, 'leer')
+            return [None] * len(event_ids)
+
+    def _redis_put_many(self, items):
+        if self.redis is None or not items:
+            return
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for event_id, data in items.items():
+                pipe.set(_KEY_PREFIX + event_id, data, ex=self.redis_ttl)
+            pipe.execute()
+        except redis.RedisError as e:
+            self._redis_failed(e, 'escribir')
+
+    def _count(self, **increments):
+        with self._lock:
+            for key, value in increments.items():
+                self.stats[key] += value
+        if self.redis is None:
+            return
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for key, value in increments.items():
+                if value:
+                    pipe.hincrby(_STATS_KEY, key, value)
+            pipe.execute()
+        except redis.RedisError as e:
+            self._redis_failed(e, 'contar')
+
+    def get_many(self, event_ids):
+        """Capturas en caché: {event_id: (timestamps, valores)}; las ausentes no aparecen."""
+        found = {}
+        pending = []
+        for event_id in event_ids:
+            data = self._local_get(event_id)
+            if data is None:
+                pending.append(event_id)
+            else:
+                found[event_id] = unpack_waveform(data)
+        hits_local = len(found)
+        for event_id, data in zip(pending, self._redis_get_many(pending)):
+            if data is not None:
+                self._local_put(event_id, data)
+                found[event_id] = unpack_waveform(data)
+        self._count(hits_local=hits_local, hits_redis=len(found) - hits_local, misses=len(event_ids) - len(found))
+        return found
+
+    def put_many(self, captures):
+        """Guarda capturas {event_id: (timestamps, valores)}. Solo se guardan las completas, que son inmutables."""
+        packed = {
+            event_id: pack_waveform(timestamps, values)
+            for event_id, (timestamps, values) in captures.items()
+            if len(values) == settings.CAPTURE_NUM_SAMPLES
+        }
+        for event_id, data in packed.items():
+            self._local_put(event_id, data)
+        self._redis_put_many(packed)
+
+    def invalidate(self, event_id):
+        with self._lock:
+            data = self._entries.pop(event_id, None)
+            if data is not None:
+                self._size -= len(data)
+        if self.redis is not None:
+            try:
+                self.redis.delete(_KEY_PREFIX + event_id)
+            except redis.RedisError as e:
+                self._redis_failed(e, 'borrar')
+
+    # --- Lectura a través de la caché ---
+    def get_signal_data(self, event_id, measurement=None, start=None):
+        """Como influx_service.get_signal_data, pero consultando primero la caché."""
+        event_id = str(event_id)
+        cached = self.get_many([event_id])
+        if event_id in cached:
+            return cached[event_id]
+        timestamps, values = influx_service.get_signal_data(
+            event_id, measurement or settings.INFLUX_POINTS_MEASUREMENT, start=start)
+        self.put_many({event_id: (timestamps, values)})
+        return timestamps, values
+
+    def get_signals_data(self, event_ids, measurement=None, starts=None):
+        """Como influx_service.get_signals_data, pero solo consulta InfluxDB para los eventos que no están en caché."""
+        event_ids = list(dict.fromkeys(str(e) for e in event_ids))
+        result = self.get_many(event_ids)
+        missing = [e for e in event_ids if e not in result]
+        if missing:
+            fetched = influx_service.get_signals_data(
+                missing, measurement=measurement or settings.INFLUX_POINTS_MEASUREMENT, starts=starts)
+            self.put_many(fetched)
+            result.update(fetched)
+        return result
+
+    def get_stats(self):
+        """
+        Contadores de aciertos y fallos. Con Redis son los globales de todos los
+        procesos; si no, los del proceso actual. Incluye el uso de la caché local.
+        """
+        stats = dict(self.stats)
+        scope = 'proceso'
+        if self.redis is not None:
+            try:
+                counts = self.redis.hmget(_STATS_KEY, list(self.stats))
+                stats = {key: int(count or 0) for key, count in zip(self.stats, counts)}
+                scope = 'global'
+            except redis.RedisError as e:
+                self._redis_failed(e, 'leer los contadores')
+        total = sum(stats.values())
+        return {
+            **stats,
+            'alcance': scope,
+            'tasa_aciertos': (stats['hits_local'] + stats['hits_redis']) / total if total else None,
+            'entradas_locales': len(self._entries),
+            'bytes_locales': self._size,
+            'max_bytes_locales': self.max_bytes,
+            'redis': bool(self.redis_url),
+        }
+
+
+# Instancia para toda la aplicación (se configura en CoreConfig.ready)
+waveform_cache = WaveformCache()
@@ -144,4 +144,155 @@ CELERY_RESULT_BACKEND = 'redis://127.0.0.1:6379/0' # Para almacenar los resultad
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
-CELERY_TIMEZONE = 'America/Mexico_City' # Ajusta a tu zona horaria
\ No newline at end of file
+CELERY_TIMEZONE = 'America/Mexico_City' # Ajusta a tu zona horaria
+# Caché de bancos de ventanas de la MST
+# Cada banco (N/2 x N) se construye por bloques en un .npy y se abre como memoria mapeada, de modo
+# que todos los workers prefork de un mismo host comparten una sola copia. El cálculo por bloques
+# (MST_MAX_MEMORY_MB) lee sus filas del archivo mapeado; sin directorio, las calcula en cada evento.
+MST_WINDOW_CACHE_DIR = BASE_DIR / 'cache' / 'mst_windows'
+MST_WINDOW_CACHE_MAX_ENTRIES = 4 # Bancos distintos (N, fs, p, alpha) retenidos en memoria por proceso
+
+# Configuración de captura (debe coincidir con signal_config.h del STM32)
+CAPTURE_SAMPLES_PER_CYCLE = 512 # SAMPLES_PER_CYCLE
+CAPTURE_TOTAL_CYCLES = 10 # TOTAL_CAPTURE_CYCLES
+CAPTURE_NUM_SAMPLES = CAPTURE_SAMPLES_PER_CYCLE * CAPTURE_TOTAL_CYCLES # PROCESSING_BUFFER_LEN = 5120
+
+# Presupuesto de memoria para los temporales de la MST (sin contar la matriz de salida).
+# Las filas de frecuencia se calculan por bloques para que el pico de memoria por
+# worker no crezca con N. None calcula todas las filas de una vez.
+MST_MAX_MEMORY_MB = 64
+
+# Hilos por cálculo de MST. Con varios workers prefork de Celery por host conviene 1;
+# si un operador espera un único evento, subirlo reduce la latencia (0 = todos los núcleos).
+MST_WORKERS = 1
+
+# Formato de almacenamiento de los espectrogramas (ver core/spectrogram_format.py)
+# 'mag_f16' (magnitud float16), 'db_u8' / 'db_u16' (dB cuantizados) o 'complex64' (sin pérdidas).
+# Todas salvo 'complex64' guardan solo la magnitud: la fase de la MST se descarta y no se puede recuperar.
+# La visualización, la pirámide y las características solo usan la magnitud.
+SPECTROGRAM_ENCODING = 'mag_f16'
+SPECTROGRAM_CODEC = None # None elige el más rápido disponible: 'zstd', 'lz4' o 'zlib'
+SPECTROGRAM_DB_RANGE = 120.0 # Rango dinámico (dB) para las codificaciones cuantizadas
+
+# Almacén de blobs para los espectrogramas (ver core/blobstore.py)
+# Con un backend configurado, el arreglo codificado se guarda como .npy fuera de
+# PostgreSQL y la tabla solo guarda la referencia, la forma, el dtype y el checksum.
+# None conserva el almacenamiento en línea (BYTEA) con compresión.
+# Para un almacenamiento de objetos:
+#   {'BACKEND': 'core.blobstore.DirectoryObjectStore',
+#    'OPTIONS': {'bucket_dir': '/srv/objetos/pqs', 'cache_dir': BASE_DIR / 'cache' / 'blobs'}}
+SPECTROGRAM_STORAGE = {
+    'BACKEND': 'core.blobstore.LocalBlobStore',
+    'OPTIONS': {'root': BASE_DIR / 'data' / 'espectrogramas'},
+}
+
+# Pirámide de teselas para visualizar los espectrogramas con zoom (requiere SPECTROGRAM_STORAGE).
+# Cada nivel reduce tiempo y frecuencia a la mitad; las teselas son cuadradas de este tamaño.
+# None desactiva la generación de la pirámide.
+SPECTROGRAM_TILE_SIZE = 256
+SPECTROGRAM_MAX_TILES_PER_REQUEST = 64 # Límite de teselas por petición al endpoint de teselas
+
+# Caché de imágenes del endpoint /api/espectrogramas/{id}/render/
+# Con directorio, los procesos del servidor web comparten las imágenes; sin él, cada proceso tiene la suya.
+SPECTROGRAM_RENDER_CACHE_DIR = BASE_DIR / 'cache' / 'render'
+SPECTROGRAM_RENDER_CACHE_MAX_MB = 256 # Tamaño máximo total; se desalojan primero las menos usadas
+
+# Periodo de muestreo de la captura en ns, tal como lo usa el ESP32 para las marcas de tiempo
+CAPTURE_SAMPLING_PERIOD_NS = 32552
+# Margen (s) alrededor de la captura al acotar las consultas de InfluxDB por evento
+INFLUX_QUERY_MARGIN_S = 1.0
+INFLUX_BULK_MAX_SPAN_S = 6 * 3600 # Intervalo máximo que abarca cada consulta de InfluxDB al traer muchos eventos
+
+# Almacenamiento de las capturas crudas en InfluxDB
+# 'packed': un registro por captura con las 5120 muestras uint16 en base64 (INFLUX_CAPTURE_MEASUREMENT).
+# 'points': un punto por muestra, como el firmware del ESP32 (INFLUX_POINTS_MEASUREMENT).
+# La lectura acepta ambos formatos en una sola consulta: los eventos sin captura empaquetada se leen de los puntos.
+INFLUX_CAPTURE_STORAGE = 'packed'
+INFLUX_CAPTURE_MEASUREMENT = 'voltage_capture'
+INFLUX_POINTS_MEASUREMENT = 'voltage_waveform'
+
+# Caché de capturas crudas delante de InfluxDB (ver core/waveform_cache.py)
+WAVEFORM_CACHE_MAX_MB = 64 # LRU local por proceso (~10 KB por captura uint16)
+WAVEFORM_CACHE_REDIS_URL = CELERY_BROKER_URL # Nivel compartido entre workers; '' lo desactiva
+WAVEFORM_CACHE_TTL_S = 7 * 24 * 3600
+
+# Gateway de ingesta de tramas crudas del STM32 (comando gateway_ingesta, ver core/ingestion.py)
+INGESTION_HOST = '0.0.0.0'
+INGESTION_TCP_PORT = 9500
+INGESTION_HTTP_PORT = 9501
+INGESTION_QUEUE_MAX_FRAMES = 2048 # ~21 MB en espera; al llenarse se deja de leer de los equipos
+INGESTION_BATCH_SIZE = 200 # Capturas por escritura a InfluxDB
+INGESTION_FLUSH_INTERVAL_S = 0.5 # Espera máxima antes de escribir un lote incompleto
+INGESTION_WRITERS = 2 # Escrituras a InfluxDB en paralelo
+INGESTION_DEFAULT_LOCATION = 'Laboratorio_A' # Si el equipo no la indica
+# Al recibir capturas, crea sus Muestras y encola su procesamiento sin intervención
+INGESTION_AUTO_PROCESS = True
+
+# Procesamiento por lotes (procesar_lote_task)
+PROCESS_BATCH_CHUNK_SIZE = 16 # Muestras por tramo: una transacción y unas pocas consultas por tramo
+# Máximo de capturas por llamada a la MST. Cada matriz de salida completa ocupa ~100 MB, así que el lote
+# se reduce para que sus matrices quepan en MST_MAX_MEMORY_MB; con 64 MB cada evento se calcula por separado.
+MST_BATCH_SIZE = 4
+PROCESS_PENDING_CHUNK_SIZE = 64 # Muestras por tarea procesar_lote_task en /api/muestras/process-pending/
+# Duración del reclamo de una muestra 'en_proceso'; al vencer, otro worker puede retomarla y los resultados
+# del primero se descartan. Debe superar el tiempo de procesar una muestra o, en procesar_lote_task, un tramo
+# de PROCESS_BATCH_CHUNK_SIZE muestras (cada tramo se reclama al empezar).
+PROCESS_LEASE_S = 15 * 60
+
+# Pipeline por etapas (ver core/tasks.py): captura (E/S) -> MST (CPU) -> guardado (E/S), cada etapa en su cola.
+# Desactivado por defecto: cada muestra se procesa con una sola tarea (procesar_evento_completo_task) en la
+# cola por defecto 'celery', que es la única que atiende `celery -A monitor_energia worker`.
+# Para activarlo hay que levantar workers para las tres colas ANTES de cambiar esto a True; si no, las tareas
+# quedan encoladas sin que nadie las tome y las Muestras siguen en 'pendiente'. Por ejemplo:
+#   celery -A monitor_energia worker -Q celery                               (resto de tareas)
+#   celery -A monitor_energia worker -Q captura,persistencia -P threads -c 32 (E/S, mucha concurrencia)
+#   celery -A monitor_energia worker -Q mst -P prefork -c <núcleos>           (CPU, un proceso por núcleo)
+PROCESS_STAGED_PIPELINE = False
+# Las colas propias solo se usan con el pipeline por etapas activado
+CELERY_TASK_ROUTES = {
+    'core.tasks.obtener_captura_task': {'queue': 'captura'},
+    'core.tasks.calcular_mst_task': {'queue': 'mst'},
+    'core.tasks.guardar_resultados_task': {'queue': 'persistencia'},
+} if PROCESS_STAGED_PIPELINE else {}
+# Área temporal donde las etapas se pasan la captura y los arreglos del espectrograma (no por Redis).
+# Debe ser el mismo directorio para las tres colas: mismo host o almacenamiento compartido.
+PIPELINE_STAGING_DIR = BASE_DIR / 'cache' / 'pipeline'
+PIPELINE_STAGING_MAX_AGE_S = 6 * 3600 # Se borran los restos de tareas interrumpidas más antiguos que esto
+
+# Métricas por etapa del procesamiento (ver core/metrics.py), servidas en /metrics
+METRICS_REDIS_URL = CELERY_BROKER_URL # Suma las métricas de todos los workers; '' las deja locales a cada proceso
+# Memoria pico de la MST con tracemalloc. Solo para diagnóstico y solo en workers prefork (un cálculo por
+# proceso): tracemalloc es global al proceso, así que con -P threads mezcla las asignaciones de otras tareas.
+# Además encarece las asignaciones de la propia etapa que se mide.
+METRICS_TRACE_MEMORY = False
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'mensaje': {'format': '%(message)s'},
+        'consola': {'format': '[%(asctime)s] %(levelname)s %(name)s: %(message)s'},
+    },
+    'handlers': {
+        'metricas': {'class': 'logging.StreamHandler', 'formatter': 'mensaje'},
+        'consola': {'class': 'logging.StreamHandler', 'formatter': 'consola'},
+    },
+    'loggers': {
+        'core.ingestion': {'handlers': ['consola'], 'level': 'INFO', 'propagate': False},
+        # Un registro JSON por etapa medida
+        'core.metricas': {'handlers': ['metricas'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
+# Antigüedad mínima (s) de un arreglo del almacén de blobs sin referencias para que limpiar_blobs lo borre.
+# Debe superar lo que tarda una tarea entre guardar los arreglos y confirmar la fila (ver PROCESS_LEASE_S).
+SPECTROGRAM_BLOB_GC_MIN_AGE_S = 24 * 3600
+
+# Descargas de /api/espectrogramas/{id}/download/ que hay que armar (.npy de los guardados en línea y
+# tensores Arrow): se escriben una vez aquí y se borran tras este tiempo sin usarse
+SPECTROGRAM_DOWNLOAD_CACHE_DIR = BASE_DIR / 'cache' / 'descargas'
+SPECTROGRAM_DOWNLOAD_CACHE_MAX_AGE_S = 24 * 3600
+
+# Precisión de la MST en el pipeline. 'single' usa la ruta rápida para señales reales (rfft y banco
+# float32, error relativo ~1e-6 frente a la referencia); 'double' reproduce el cálculo de referencia.
+# Forma parte de la huella de procesamiento: cambiarlo hace que se reprocesen las muestras.
+MST_PRECISION = 'single'
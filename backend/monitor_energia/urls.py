@@ -29,6 +29,7 @@ router.register(r'muestras', views.MuestraViewSet)
 router.register(r'espectrogramas', views.EspectrogramaViewSet)
 router.register(r'anotaciones', views.AnotacionViewSet)
 router.register(r'clasificaciones', views.ClasificacionViewSet)
+router.register(r'caracteristicas', views.CaracteristicasEventoViewSet)
 
 
 urlpatterns = [
@@ -36,4 +37,5 @@ urlpatterns = [
     path('api/', include(router.urls)), # Incluye las URLs generadas por el router para tu API
     # DRF también proporciona URLs para autenticación básica y de sesión si las necesitas
     path('api-auth/', include('rest_framework.urls', namespace='rest_framework')), 
+    path('metrics', views.metricas), # Métricas por etapa para Prometheus
 ]
\ No newline at end of file